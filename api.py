@@ -1,18 +1,99 @@
-from fastapi import FastAPI, HTTPException
+import time
+
+_inicio_importacion = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
-from datetime import datetime
-import data_manager as dm
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+import numpy as np
+import asyncio
+import json
+import logging
+import os
+import threading
+import zlib
+from contextlib import asynccontextmanager
+from datetime import date
+import impuestos
+import metricas
+
+# pandas, pyarrow y los módulos de datos (data_manager, compartido, consultas,
+# exportacion, importacion) se importan dentro de las funciones que los usan:
+# así el proceso arranca sin cargarlos y se cargan al precalentar o con el
+# primer pedido que los necesita.
+
+metricas.ARRANQUE.fijar(time.perf_counter() - _inicio_importacion, etapa='importacion')
+
+# El registro de uvicorn, para que el informe de arranque salga junto a sus mensajes
+logger = logging.getLogger('uvicorn.error')
+
+# Con FACTURACION_PRECALENTAR=0 no se cargan los datos al arrancar sino con el primer pedido
+PRECALENTAR = os.environ.get('FACTURACION_PRECALENTAR', '1') != '0'
+
+async def _vigilar_bucle(intervalo=0.5):
+    """Mide cuánto tarda el bucle de eventos en retomar una espera: si hay demora, algo lo está frenando."""
+    while True:
+        inicio = time.perf_counter()
+        await asyncio.sleep(intervalo)
+        metricas.RETRASO_BUCLE.observar(max(0.0, time.perf_counter() - inicio - intervalo))
+
+@asynccontextmanager
+async def ciclo_de_vida(app):
+    # Uvicorn no atiende pedidos hasta que termina esta parte
+    if PRECALENTAR:
+        await asyncio.to_thread(precalentar)
+    _listo.set()
+    informe = metricas.informe_arranque()
+    logger.info("Arranque: %s", ", ".join(f"{etapa} {segundos:.3f} s" for etapa, segundos in informe.items()))
+    vigilancia = asyncio.create_task(_vigilar_bucle())
+    yield
+    _listo.clear()
+    vigilancia.cancel()
+    # Lo que quedó en el diario de escritura se aplicaría igual al volver a abrir,
+    # pero así el próximo arranque no tiene nada que recuperar
+    if _almacen_compartido is not None:
+        await asyncio.to_thread(_almacen_compartido.volcar)
+
+class RutaPerfilada(APIRoute):
+    """Ruta cuyos endpoints `def` se perfilan en el hilo del pool donde corren (ver `metricas.hilo_del_pedido`)."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = metricas.hilo_del_pedido(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+api = FastAPI(title="API Financiera para Power BI", lifespan=ciclo_de_vida)
+api.router.route_class = RutaPerfilada
+
+# Almacén compartido con la aplicación Streamlit a través de la carpeta de datos:
+# lo que se guarda desde la interfaz se ve aquí sin reenviarlo
+_almacen_compartido = None
+_bloqueo_almacen = threading.Lock()
+_listo = threading.Event()
+
+def almacen_compartido():
+    """Devuelve el almacén compartido, que se abre (y carga los datos) la primera vez."""
+    global _almacen_compartido
+    with _bloqueo_almacen:
+        if _almacen_compartido is None:
+            import compartido
 
-api = FastAPI(title="API Financiera para Power BI")
+            _almacen_compartido = compartido.AlmacenCompartido()
+    return _almacen_compartido
 
-# Variable global para almacenar datos
-datos_financieros = pd.DataFrame(columns=[
-    'fecha', 'facturacion_a', 'facturacion_b', 'facturacion_c',
-    'gastos_operativos', 'otros_gastos', 'retenciones',
-    'iva_debito', 'iva_credito', 'iva_total',
-    'ingresos_brutos', 'utilidad'
-])
+TIPO_ARROW = 'application/vnd.apache.arrow.stream'
+
+# Respuestas ya serializadas para la versión actual de los datos.
+# Las ETag usan la etiqueta del estado del disco, igual en todos los procesos.
+_cache_respuestas = {}
+_version_cache = None
+_bloqueo_cache = threading.Lock()
+
+# Los endpoints de lectura se declaran con `def` para que FastAPI los ejecute
+# en su grupo de hilos y los cálculos no frenen el bucle de eventos; los que
+# leen el cuerpo del pedido son `async` y delegan el trabajo con run_in_threadpool.
 
 # Configurar CORS
 api.add_middleware(
@@ -23,74 +104,511 @@ api.add_middleware(
     allow_headers=["*"],
 )
 
+@api.middleware("http")
+async def medir_pedidos(request: Request, call_next):
+    """Registra la duración de cada pedido por endpoint y, si está activado, perfila los lentos."""
+    inicio = time.perf_counter()
+    estado = 500
+    try:
+        with metricas.perfilar_si_lento(f'{request.method} {request.url.path}'):
+            respuesta = await call_next(request)
+        estado = respuesta.status_code
+        return respuesta
+    finally:
+        # La ruta declarada ('/datos/mensuales') y no la pedida, para no multiplicar las series
+        ruta = request.scope.get('route')
+        metricas.PEDIDOS.observar(
+            time.perf_counter() - inicio,
+            endpoint=ruta.path if ruta is not None else 'otro',
+            metodo=request.method,
+            estado=str(estado)
+        )
+
+@api.get("/metrics", response_class=PlainTextResponse)
+def obtener_metricas():
+    """Endpoint con las métricas en formato Prometheus: latencias, etapas y tamaño de los datos."""
+    almacen = _almacen()
+    registros = np.bincount(almacen.columna('entidad'), minlength=len(almacen.entidades))
+    for entidad, cantidad in zip(almacen.entidades, registros):
+        metricas.REGISTROS.fijar(int(cantidad), entidad=entidad)
+    rango = almacen.mensual.rango()
+    metricas.MESES.fijar(0 if rango is None else rango[1] - rango[0] + 1)
+    metricas.BYTES.fijar(sum(almacen.columna(c).nbytes for c in ['id', 'fecha', 'entidad']) + almacen.bloque().nbytes)
+    metricas.BYTES_DIARIO.fijar(almacen_compartido().bytes_diario)
+    return PlainTextResponse(metricas.exponer(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
 @api.get("/")
 async def root():
     """Endpoint de prueba."""
     return {"message": "API Financiera funcionando correctamente"}
 
+@api.get("/listo")
+async def listo():
+    """Endpoint de disponibilidad: 503 hasta terminar de precalentar, y el informe de arranque."""
+    return JSONResponse(
+        {"listo": _listo.is_set(), "arranque": metricas.informe_arranque()},
+        status_code=200 if _listo.is_set() else 503
+    )
+
+def _almacen():
+    """Devuelve el almacén con los últimos cambios guardados por cualquier proceso."""
+    return almacen_compartido().actualizar()
+
 @api.post("/actualizar_datos")
-async def actualizar_datos(data: dict):
-    """Endpoint para actualizar datos desde Streamlit."""
-    global datos_financieros
+def actualizar_datos(data: dict):
+    """Endpoint para reemplazar todos los datos desde otra aplicación."""
+    import pandas as pd
+    import data_manager as dm
+
     try:
-        datos_financieros = pd.DataFrame(data['datos'])
-        return {"message": "Datos actualizados correctamente"}
+        nuevos_datos = dm.AlmacenColumnar.desde_dataframe(pd.DataFrame(data['datos']))
+        secuencia = int(data.get('secuencia', 0))
+        almacen_compartido().reemplazar(nuevos_datos.filas(), recalcular=False, secuencia=secuencia)
+        return {"message": "Datos actualizados correctamente", "secuencia": secuencia}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@metricas.hilo_del_pedido
+def _leer_delta(encabezados, cuerpo):
+    """Obtiene la secuencia y los registros de un cuerpo JSON o Arrow IPC."""
+    import pandas as pd
+    import pyarrow as pa
+
+    if encabezados.get('content-type', '').startswith(TIPO_ARROW):
+        registros = pa.ipc.open_stream(cuerpo).read_all().to_pandas()
+        secuencia = int(encabezados['X-Secuencia'])
+    else:
+        data = json.loads(cuerpo)
+        if not isinstance(data, dict):
+            raise ValueError("se esperaba un objeto con 'secuencia' y 'registros'")
+        if not isinstance(data['secuencia'], int) or isinstance(data['secuencia'], bool):
+            raise ValueError("'secuencia' debe ser un número entero")
+        if not isinstance(data['registros'], list):
+            raise ValueError("'registros' debe ser una lista")
+        registros = pd.DataFrame(data['registros'])
+        secuencia = data['secuencia']
+    return secuencia, registros
+
+@api.get("/actualizar_datos/secuencia")
+def obtener_secuencia():
+    """Endpoint para consultar la última secuencia aplicada y resincronizar."""
+    import data_manager as dm
+
+    return {"secuencia": dm.leer_secuencia(almacen_compartido().directorio)}
+
+@api.post("/actualizar_datos/delta")
+async def actualizar_datos_delta(request: Request):
+    """Endpoint para aplicar solo los registros nuevos o modificados.
+
+    Cada envío lleva el número de secuencia siguiente al último aplicado. Los
+    registros con 'id' reemplazan a los existentes y los que no lo tienen se
+    agregan. Si la secuencia no es consecutiva se responde 409 con la secuencia
+    actual para que el cliente se resincronice.
+    """
+    # Los errores de Arrow al leer el cuerpo (ArrowInvalid) son ValueError
+    cuerpo = await request.body()
+    try:
+        secuencia, registros = await run_in_threadpool(_leer_delta, request.headers, cuerpo)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Cuerpo inválido: {e}")
+    return await run_in_threadpool(_aplicar_delta, secuencia, registros)
+
+@metricas.hilo_del_pedido
+def _aplicar_delta(secuencia, registros):
+    import data_manager as dm
+
+    # La secuencia se verifica y avanza junto con la escritura, con el mismo
+    # bloqueo, y se confirma en la misma entrada del diario que los registros
+    with almacen_compartido().bloqueo():
+        secuencia_actual = dm.leer_secuencia(almacen_compartido().directorio)
+        if secuencia != secuencia_actual + 1:
+            raise HTTPException(
+                status_code=409,
+                detail={
+                    "message": "Secuencia fuera de orden, se requiere resincronizar",
+                    "secuencia_actual": secuencia_actual
+                }
+            )
+
+        try:
+            ids = almacen_compartido().registrar(registros, secuencia)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    return {"secuencia": secuencia, "ids": ids.tolist()}
+
+def _respuesta_cacheada(request, generar):
+    """Devuelve la respuesta serializada para la versión actual de los datos.
+
+    Si el cliente envía If-None-Match con la ETag vigente se responde 304 sin
+    recalcular nada. Las respuestas se guardan como bytes y el caché se vacía
+    cuando cambia la versión de los datos. `generar` recibe la instantánea
+    del almacén, la misma cuya etiqueta va en la ETag, y puede devolver un
+    objeto a serializar o directamente los bytes JSON. La etiqueta depende
+    solo de lo guardado, así la ETag de un worker vale en los demás.
+    """
+    almacen, etiqueta = almacen_compartido().vigente()
+    clave = (request.url.path, str(request.query_params))
+    etag = f'"{etiqueta}-{zlib.crc32(repr(clave).encode()):08x}"'
+    encabezados = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+    if etag in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers=encabezados)
+
+    cuerpo = _cuerpo_cacheado(almacen, clave, generar)
+    return Response(content=cuerpo, media_type='application/json', headers=encabezados)
+
+def _cuerpo_cacheado(almacen, clave, generar):
+    """Devuelve los bytes de la respuesta de `clave` (ruta y parámetros), generándolos si no están."""
+    global _version_cache
+    version = almacen.version
+    with _bloqueo_cache:
+        if _version_cache != version:
+            _cache_respuestas.clear()
+            _version_cache = version
+        cuerpo = _cache_respuestas.get(clave)
+
+    if cuerpo is None:
+        # Fuera del bloqueo, para que los pedidos distintos se calculen en paralelo
+        with metricas.etapa(f'api.generar {clave[0]}'):
+            cuerpo = generar(almacen)
+        if not isinstance(cuerpo, bytes):
+            with metricas.etapa('api.json'):
+                cuerpo = json.dumps(
+                    cuerpo, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+                ).encode('utf-8')
+        with _bloqueo_cache:
+            # Si mientras tanto cambiaron los datos, la respuesta ya no se guarda
+            if _version_cache == version:
+                _cache_respuestas[clave] = cuerpo
+    return cuerpo
+
+def _serializar_columnas(df, fechas):
+    """Serializa un DataFrame como un objeto JSON con un arreglo por columna."""
+    partes = ['"fecha":' + json.dumps(fechas.tolist(), separators=(",", ":"))]
+    for columna in df.columns:
+        partes.append(f'"{columna}":' + df[columna].to_json(orient='values', double_precision=15))
+    return ('{' + ','.join(partes) + '}').encode('utf-8')
+
+def _serializar_tabla(df, formato):
+    """Serializa una tabla con índice de fechas como lista de registros o con un arreglo por columna."""
+    # Formatear fechas para Power BI de una sola vez para toda la columna
+    fechas = np.datetime_as_string(df.index.to_numpy(dtype='datetime64[D]'), unit='D')
+    if formato == 'columnas':
+        return _serializar_columnas(df, fechas)
+
+    datos_power_bi = df.reset_index(drop=True)
+    datos_power_bi.insert(0, 'fecha', fechas)
+    return datos_power_bi.to_json(orient='records', double_precision=15).encode('utf-8')
+
+def _datos_mensuales(almacen, desde=None, hasta=None, desplazamiento=0, limite=None, formato='registros', entidad=None):
+    if almacen.empty:
+        return b'{}' if formato == 'columnas' else b'[]'
+
+    import pandas as pd
+    import data_manager as dm
+
+    df_mensual = dm.analisis_mensual(almacen, entidad)
+
+    # Filtrar por meses completos y paginar antes de serializar
+    if desde is not None:
+        df_mensual = df_mensual.loc[pd.Timestamp(desde) + pd.offsets.MonthEnd(0):]
+    if hasta is not None:
+        df_mensual = df_mensual.loc[:pd.Timestamp(hasta) + pd.offsets.MonthEnd(0)]
+    fin = None if limite is None else desplazamiento + limite
+    df_mensual = df_mensual.iloc[desplazamiento:fin]
+
+    with metricas.etapa('api.mensuales.serializacion'):
+        return _serializar_tabla(df_mensual, formato)
+
+def _ventanas(almacen, meses=12, periodos=3, hasta=None, formato='registros', entidad=None):
+    if almacen.empty:
+        return b'{}' if formato == 'columnas' else b'[]'
+    import ventanas
+
+    return _serializar_tabla(ventanas.analisis_ventanas(almacen, entidad, meses, periodos, hasta), formato)
+
+def _resumen_ventanas(almacen, periodos=3, hasta=None, entidad=None):
+    if almacen.empty:
+        return {}
+    import ventanas
+
+    return ventanas.resumen_ventanas(almacen, entidad, periodos, hasta)
+
+def _estadisticas(almacen, detalle=False, percentiles=None, entidad=None):
+    # Como en /datos/mensuales, una entidad sin registros no tiene estadísticas
+    if almacen.empty or (entidad is not None and almacen.codigo(entidad) is None):
+        return {}
+    import data_manager as dm
+
+    return dm.calcular_estadisticas(almacen, detalle, percentiles, entidad)
+
+def _datos_por_categoria(almacen, entidad=None):
+    if almacen.empty:
+        return {}
+    import data_manager as dm
+
+    return dm.calcular_categorias(almacen, entidad)
+
+def _consulta(almacen, dimensiones, medidas, desde, hasta, granularidad, entidades, ventanas, periodos, formato):
+    import consultas
+
+    resultado = consultas.consultar(
+        almacen, dimensiones, medidas, desde, hasta, granularidad, entidades, ventanas, periodos
+    )
+    if 'fecha' in resultado:
+        resultado['fecha'] = np.datetime_as_string(resultado['fecha'].to_numpy(dtype='datetime64[D]'), unit='D')
+    if formato == 'columnas':
+        partes = [
+            json.dumps(columna) + ':' + resultado[columna].to_json(orient='values', double_precision=15)
+            for columna in resultado.columns
+        ]
+        return ('{' + ','.join(partes) + '}').encode('utf-8')
+    return resultado.to_json(orient='records', double_precision=15).encode('utf-8')
+
+def _entidades(almacen):
+    registros = np.bincount(almacen.columna('entidad'), minlength=len(almacen.entidades))
+    return [
+        {"entidad": entidad, "registros": int(cantidad)}
+        for entidad, cantidad in zip(almacen.entidades, registros)
+    ]
+
+# Respuestas que se dejan calculadas al precalentar: las de cada endpoint sin parámetros
+PRECALENTADAS = {
+    '/datos/mensuales': lambda almacen: _datos_mensuales(almacen),
+    '/datos/ventanas': lambda almacen: _ventanas(almacen),
+    '/datos/ventanas/resumen': lambda almacen: _resumen_ventanas(almacen),
+    '/datos/estadisticas': lambda almacen: _estadisticas(almacen),
+    '/datos/categorias': lambda almacen: _datos_por_categoria(almacen),
+    '/datos/entidades': _entidades
+}
+
+def precalentar():
+    """Carga los datos y calcula las respuestas más pedidas antes de atender pedidos.
+
+    Cada etapa queda en el informe de arranque (`GET /listo` y la métrica
+    facturacion_arranque_segundos).
+    """
+    with metricas.arranque('modulos'):
+        # pandas, pyarrow y data_manager, que necesitan casi todos los endpoints
+        import compartido
+    with metricas.arranque('datos'):
+        almacen = _almacen()
+    with metricas.arranque('respuestas'):
+        for ruta, generar in PRECALENTADAS.items():
+            _cuerpo_cacheado(almacen, (ruta, ''), generar)
+
 @api.get("/datos/mensuales")
-async def obtener_datos_mensuales():
-    """Endpoint para obtener datos mensuales."""
+def obtener_datos_mensuales(
+    request: Request,
+    desde: date | None = None,
+    hasta: date | None = None,
+    desplazamiento: int = Query(0, ge=0),
+    limite: int | None = Query(None, ge=1),
+    formato: str = Query('registros', pattern='^(registros|columnas)$'),
+    entidad: str | None = None
+):
+    """Endpoint para obtener datos mensuales.
+
+    Admite filtrar por rango de meses (`desde`/`hasta`) y por `entidad` (sin
+    ella se consolidan todas), paginar con `desplazamiento` y `limite`, y
+    elegir entre una lista de registros o un objeto con un arreglo por
+    columna (`formato=columnas`).
+    """
     try:
-        if datos_financieros.empty:
-            return []
+        return _respuesta_cacheada(
+            request,
+            lambda almacen: _datos_mensuales(almacen, desde, hasta, desplazamiento, limite, formato, entidad)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        df_mensual = dm.analisis_mensual(datos_financieros)
-        datos_power_bi = df_mensual.reset_index().to_dict(orient='records')
+@api.get("/datos/ventanas")
+def obtener_ventanas(
+    request: Request,
+    meses: int = Query(12, ge=1),
+    periodos: int = Query(3, ge=1),
+    hasta: date | None = None,
+    formato: str = Query('registros', pattern='^(registros|columnas)$'),
+    entidad: str | None = None
+):
+    """Endpoint para obtener indicadores móviles de los últimos `meses` meses.
 
-        # Formatear fechas para Power BI
-        for registro in datos_power_bi:
-            registro['fecha'] = registro['fecha'].strftime('%Y-%m-%d')
+    Por mes: facturación, gastos y utilidad del mes y de los últimos 12 meses
+    (`_12m`), su variación contra el mismo mes del año anterior
+    (`_interanual`), el promedio móvil de `periodos` meses de facturación y
+    gastos y la utilidad acumulada. Termina en el mes de `hasta` o en el
+    último con datos, y tarda lo mismo sea cual sea el largo de la historia.
+    """
+    try:
+        return _respuesta_cacheada(
+            request, lambda almacen: _ventanas(almacen, meses, periodos, hasta, formato, entidad)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        return datos_power_bi
+@api.get("/datos/ventanas/resumen")
+def obtener_resumen_ventanas(
+    request: Request,
+    periodos: int = Query(3, ge=1),
+    hasta: date | None = None,
+    entidad: str | None = None
+):
+    """Endpoint con los indicadores móviles del último mes con datos (o del mes de `hasta`)."""
+    try:
+        return _respuesta_cacheada(request, lambda almacen: _resumen_ventanas(almacen, periodos, hasta, entidad))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api.get("/datos/estadisticas")
-async def obtener_estadisticas():
-    """Endpoint para obtener estadísticas generales."""
+def obtener_estadisticas(
+    request: Request,
+    detalle: bool = False,
+    percentiles: list[float] | None = Query(None),
+    entidad: str | None = None
+):
+    """Endpoint para obtener estadísticas generales, de todas las entidades o de una.
+
+    Con `detalle=true` agrega mínimo, máximo, media y desvío por columna, y con
+    `percentiles` (repetible, por ejemplo `?percentiles=50&percentiles=90`) los
+    percentiles de cada columna.
+    """
+    if percentiles and not all(0 <= p <= 100 for p in percentiles):
+        raise HTTPException(status_code=422, detail="Los percentiles deben estar entre 0 y 100")
     try:
-        if datos_financieros.empty:
-            return {}
-        return dm.calcular_estadisticas(datos_financieros)
+        return _respuesta_cacheada(request, lambda almacen: _estadisticas(almacen, detalle, percentiles, entidad))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api.get("/datos/categorias")
-async def obtener_datos_por_categoria():
+def obtener_datos_por_categoria(request: Request, entidad: str | None = None):
     """Endpoint para obtener datos agrupados por categoría."""
     try:
-        if datos_financieros.empty:
-            return {}
-
-        # Agrupar datos por categorías relevantes
-        categorias = {
-            'facturacion': {
-                'A': float(datos_financieros['facturacion_a'].sum()),
-                'B': float(datos_financieros['facturacion_b'].sum()),
-                'C': float(datos_financieros['facturacion_c'].sum())
-            },
-            'gastos': {
-                'operativos': float(datos_financieros['gastos_operativos'].sum()),
-                'otros': float(datos_financieros['otros_gastos'].sum())
-            },
-            'impuestos': {
-                'iva': float(datos_financieros['iva_total'].sum()),
-                'ingresos_brutos': float(datos_financieros['ingresos_brutos'].sum()),
-                'retenciones': float(datos_financieros['retenciones'].sum())
-            }
-        }
-
-        return categorias
+        return _respuesta_cacheada(request, lambda almacen: _datos_por_categoria(almacen, entidad))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api.get("/datos/consulta")
+def consultar_datos(
+    request: Request,
+    dimensiones: list[str] = Query(['fecha']),
+    medidas: list[str] = Query(['facturacion_total']),
+    desde: date | None = None,
+    hasta: date | None = None,
+    granularidad: str = 'mensual',
+    entidad: list[str] | None = Query(None),
+    ventanas: list[str] = Query([]),
+    periodos: int = Query(3, ge=1),
+    formato: str = Query('registros', pattern='^(registros|columnas)$')
+):
+    """Endpoint para consultas agregadas que resuelve el servidor.
+
+    `dimensiones` ('fecha' y/o 'entidad'; vacía para un total), `medidas` ('columna' o
+    'funcion:columna', por ejemplo `promedio:utilidad`), `granularidad` de la
+    fecha, filtros por rango y `entidad` (repetible) y `ventanas`
+    ('acumulado', 'promedio_movil' de `periodos` períodos y 'variacion').
+    """
+    try:
+        return _respuesta_cacheada(
+            request,
+            lambda almacen: _consulta(
+                almacen, [d for d in dimensiones if d], medidas, desde, hasta, granularidad, entidad, ventanas, periodos, formato
+            )
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api.get("/datos/entidades")
+def obtener_entidades(request: Request):
+    """Endpoint para listar las entidades (empresas, sucursales o CUIT) con datos."""
+    try:
+        return _respuesta_cacheada(request, _entidades)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api.get("/datos/exportar")
+def exportar_datos(formato: str = Query('csv', pattern='^(csv|parquet|excel)$')):
+    """Endpoint para descargar todos los registros en CSV, Parquet o Excel por bloques."""
+    import exportacion
+
+    mime, extension = exportacion.FORMATOS[formato]
+    return StreamingResponse(
+        exportacion.exportar(_almacen(), formato),
+        media_type=mime,
+        headers={'Content-Disposition': f'attachment; filename="datos_financieros.{extension}"'}
+    )
+
+@api.post("/importar")
+async def importar_archivo(
+    request: Request,
+    formato: str = Query('registros', pattern='^(registros|afip)$'),
+    tipo_archivo: str = Query('csv', pattern='^(csv|excel)$'),
+    entidad: str | None = None
+):
+    """Endpoint para importar un archivo CSV o Excel completo enviado en el cuerpo."""
+    import importacion
+
+    try:
+        contenido = await request.body()
+        resultado = await run_in_threadpool(
+            metricas.hilo_del_pedido(importacion.importar_bytes), contenido, almacen_compartido(), formato, tipo_archivo, entidad=entidad
+        )
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=f"Archivo inválido: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "filas_leidas": resultado.filas_leidas,
+        "filas_invalidas": resultado.filas_invalidas,
+        "registros": resultado.registros,
+        "segundos": resultado.segundos,
+        "filas_por_segundo": resultado.filas_por_segundo,
+        "errores": resultado.errores
+    }
+
+@api.get("/comprobantes/mensuales")
+def obtener_comprobantes_mensuales(
+    desde: date | None = None,
+    hasta: date | None = None,
+    entidad: str | None = None,
+    formato: str = Query('registros', pattern='^(registros|columnas)$')
+):
+    """Endpoint con la facturación A, B y C por entidad y mes, sumada desde los comprobantes de AFIP guardados.
+
+    Permite conciliar los registros mensuales importados con sus comprobantes;
+    `desde` y `hasta` filtran por fecha de comprobante.
+    """
+    import comprobantes
+
+    try:
+        guardados = comprobantes.leer_comprobantes(almacen_compartido().directorio, entidad, desde, hasta)
+        mensual = guardados.mensual().set_index('fecha')
+        return Response(_serializar_tabla(mensual, formato), media_type='application/json')
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api.get("/impuestos/reglas")
+def obtener_reglas_impuestos():
+    """Endpoint para consultar las reglas de impuestos vigentes."""
+    return impuestos.reglas_vigentes().a_dict()
+
+@api.put("/impuestos/reglas")
+def cambiar_reglas_impuestos(data: dict):
+    """Endpoint para reemplazar las reglas de impuestos.
+
+    Solo se recalculan los registros de las entidades y fechas cuyas tasas
+    cambian, y solo se reescriben sus particiones.
+    """
+    try:
+        reglas = impuestos.ReglasImpuestos.desde_dict(data)
+        recalculados = almacen_compartido().cambiar_reglas(reglas)
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"message": "Reglas actualizadas correctamente", "registros_recalculados": recalculados}
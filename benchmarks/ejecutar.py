@@ -0,0 +1,292 @@
+import argparse
+import gc
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# La API carga los datos guardados al precalentar: se apunta a una carpeta vacía
+os.environ['FACTURACION_DATOS'] = os.path.join(tempfile.mkdtemp(), 'datos')
+
+import data_manager as dm
+from generador import generar_datos
+
+TAMANIOS = {'1k': 1_000, '100k': 100_000, '10M': 10_000_000}
+LINEA_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'linea_base.json')
+PRESUPUESTO_SEGUNDOS = 2.0
+MAXIMO_REPETICIONES = 5
+
+CASOS = []
+
+def caso(nombre):
+    """Registra una función que prepara el caso y devuelve lo que hay que medir."""
+    def registrar(preparar):
+        CASOS.append((nombre, preparar))
+        return preparar
+    return registrar
+
+@caso('data_manager.agregar_registros')
+def _agregar_registros(contexto):
+    return lambda: dm.agregar_registros(dm.AlmacenColumnar(), contexto['datos'])
+
+@caso('data_manager.agregar_registro x1000')
+def _agregar_registro(contexto):
+    almacen = dm.AlmacenColumnar.desde_dataframe(contexto['datos'])
+    registros = contexto['datos'].head(1000).to_dict('records')
+
+    def agregar():
+        for registro in registros:
+            dm.agregar_registros(almacen, [registro])
+    return agregar
+
+@caso('compartido.registrar x200 en 8 hilos')
+def _registrar_concurrente(contexto):
+    import threading
+    import compartido
+
+    # Altas de a un registro, como las del formulario: se confirman en el diario por grupos
+    almacen = compartido.AlmacenCompartido(os.path.join(tempfile.mkdtemp(), 'datos'), intervalo_volcado=None)
+    registros = contexto['datos'].head(200).to_dict('records')
+
+    def registrar():
+        hilos = [
+            threading.Thread(target=lambda parte: [almacen.registrar([r]) for r in parte], args=(registros[i::8],))
+            for i in range(8)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+    return registrar
+
+@caso('data_manager.analisis_mensual')
+def _analisis_mensual(contexto):
+    return lambda: dm.analisis_mensual(contexto['almacen'])
+
+@caso('data_manager.agrupar_por_periodo')
+def _agrupar_por_periodo(contexto):
+    def agrupar():
+        for periodo in ["Mensual", "Bimestral", "Trimestral", "Anual"]:
+            dm.agrupar_por_periodo(contexto['almacen'], periodo)
+    return agrupar
+
+@caso('data_manager.calcular_estadisticas')
+def _calcular_estadisticas(contexto):
+    return lambda: dm.calcular_estadisticas(contexto['almacen'], detalle=True)
+
+@caso('data_manager.calcular_estadisticas (DataFrame)')
+def _calcular_estadisticas_dataframe(contexto):
+    df = contexto['almacen'].a_dataframe()
+    return lambda: dm.calcular_estadisticas(df)
+
+@caso('data_manager.analisis_mensual por entidad')
+def _analisis_mensual_entidad(contexto):
+    almacen = contexto['almacen']
+    return lambda: [dm.analisis_mensual(almacen, entidad) for entidad in almacen.entidades]
+
+@caso('ventanas.analisis_ventanas')
+def _analisis_ventanas(contexto):
+    import ventanas
+
+    return lambda: ventanas.analisis_ventanas(contexto['almacen'], meses=24)
+
+@caso('comprobantes.agregar')
+def _agregar_comprobantes(contexto):
+    import numpy as np
+    import comprobantes
+
+    # Un comprobante por fila de registros, con tipos de las tres letras y notas de crédito
+    filas = len(contexto['datos'])
+    azar = np.random.default_rng(0)
+    fechas = contexto['datos']['fecha'].to_numpy(dtype='datetime64[ns]')
+    tipos = azar.choice([1, 3, 6, 8, 11, 13], filas)
+    importes = azar.integers(1_000, 10_000_000, filas)
+    entidades = contexto['datos']['entidad'].to_numpy()
+    return lambda: comprobantes.AlmacenComprobantes().agregar(fechas, tipos, importes, entidades)
+
+@caso('consultas.consultar entidad x trimestre con ventanas')
+def _consultar(contexto):
+    import consultas
+
+    return lambda: consultas.consultar(
+        contexto['almacen'], ['entidad', 'fecha'], ['facturacion_total', 'promedio:utilidad'],
+        granularidad='trimestral', ventanas=['acumulado', 'variacion']
+    )
+
+@caso('consultas.consultar entidad x trimestre sobre la carpeta')
+def _consultar_carpeta(contexto):
+    import consultas
+
+    directorio = os.path.join(tempfile.mkdtemp(), 'datos')
+    dm.reemplazar_registros(contexto['almacen'].filas(), directorio, recalcular=False)
+    return lambda: consultas.consultar(
+        directorio, ['entidad', 'fecha'], ['facturacion_total', 'promedio:utilidad'], granularidad='trimestral'
+    )
+
+def _endpoint(ruta):
+    def preparar(contexto):
+        import api
+        from fastapi.testclient import TestClient
+
+        # Sin cambios en la carpeta, `actualizar` devuelve este almacén tal cual
+        api.almacen_compartido().almacen = contexto['almacen']
+        cliente = TestClient(api.api)
+
+        def pedir():
+            # Se vacía el caché para medir el cálculo y la serialización
+            api._cache_respuestas.clear()
+            respuesta = cliente.get(ruta)
+            respuesta.raise_for_status()
+        return pedir
+    return preparar
+
+for _ruta in ['/datos/mensuales', '/datos/estadisticas', '/datos/categorias',
+              '/datos/consulta?dimensiones=entidad', '/datos/ventanas?meses=24']:
+    caso(f'api GET {_ruta}')(_endpoint(_ruta))
+
+@caso('api arranque en frío (importar y precalentar)')
+def _arranque(contexto):
+    # En un proceso nuevo, porque los módulos ya importados no se vuelven a cargar
+    return lambda: subprocess.run([sys.executable, '-c', 'import api; api.precalentar()'], cwd=RAIZ, check=True)
+
+def _figura(nombre_funcion, fuente):
+    def preparar(contexto):
+        import visualizations as viz
+
+        funcion = getattr(viz, nombre_funcion)
+        return lambda: funcion(contexto[fuente])
+    return preparar
+
+for _funcion in ['grafico_lineas_temporales', 'grafico_barras_comparativo', 'grafico_barras_gastos', 'grafico_impuestos']:
+    caso(f'visualizations.{_funcion}')(_figura(_funcion, 'mensual'))
+caso('visualizations.grafico_lineas_temporales (registros)')(_figura('grafico_lineas_temporales', 'registros'))
+
+@caso('visualizations.pagina con series compartidas')
+def _pagina(contexto):
+    import visualizations as viz
+
+    def graficar():
+        series = viz.preparar_series(contexto['mensual'])
+        for funcion in [viz.grafico_lineas_temporales, viz.grafico_barras_comparativo,
+                        viz.grafico_barras_gastos, viz.grafico_impuestos]:
+            funcion(series)
+    return graficar
+
+def medir(funcion):
+    """Mide la latencia de varias ejecuciones y la memoria de una ejecución trazada."""
+    latencias = []
+    inicio = time.perf_counter()
+    while len(latencias) < MAXIMO_REPETICIONES:
+        gc.collect()
+        comienzo = time.perf_counter()
+        funcion()
+        latencias.append(time.perf_counter() - comienzo)
+        if time.perf_counter() - inicio > PRESUPUESTO_SEGUNDOS:
+            break
+
+    gc.collect()
+    tracemalloc.start()
+    antes = tracemalloc.take_snapshot()
+    funcion()
+    despues = tracemalloc.take_snapshot()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    asignaciones = sum(diferencia.count_diff for diferencia in despues.compare_to(antes, 'filename'))
+
+    return {
+        'latencia_mediana_s': statistics.median(latencias),
+        'latencia_minima_s': min(latencias),
+        'repeticiones': len(latencias),
+        'memoria_pico_mb': pico / 2 ** 20,
+        'asignaciones_netas': asignaciones
+    }
+
+def ejecutar(tamanios, filtro=None):
+    resultados = {}
+    for etiqueta in tamanios:
+        filas = TAMANIOS[etiqueta]
+        print(f"\n== {etiqueta} ({filas:,} filas) ==")
+        datos = generar_datos(filas)
+        almacen = dm.AlmacenColumnar.desde_dataframe(datos)
+        contexto = {
+            'datos': datos,
+            'almacen': almacen,
+            'mensual': dm.analisis_mensual(almacen),
+            'registros': almacen.a_dataframe().set_index('fecha')
+        }
+
+        resultados[etiqueta] = {}
+        for nombre, preparar in CASOS:
+            if filtro and filtro not in nombre:
+                continue
+            medicion = medir(preparar(contexto))
+            resultados[etiqueta][nombre] = medicion
+            print(
+                f"{nombre:<58} {medicion['latencia_mediana_s'] * 1000:>11.2f} ms"
+                f" {medicion['memoria_pico_mb']:>10.1f} MB {medicion['asignaciones_netas']:>9}"
+            )
+    return resultados
+
+def comparar(resultados, linea_base, tolerancia):
+    """Devuelve los casos más lentos o con más memoria que la línea base más la tolerancia."""
+    regresiones = []
+    for etiqueta, casos in resultados.items():
+        for nombre, medicion in casos.items():
+            base = linea_base.get(etiqueta, {}).get(nombre)
+            if base is None:
+                continue
+            for metrica in ['latencia_mediana_s', 'memoria_pico_mb']:
+                if medicion[metrica] > base[metrica] * (1 + tolerancia):
+                    regresiones.append(
+                        f"{etiqueta} {nombre}: {metrica} {medicion[metrica]:.4f} (línea base {base[metrica]:.4f})"
+                    )
+    return regresiones
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el rendimiento de data_manager, la API y los gráficos.")
+    parser.add_argument('--tamanios', nargs='+', choices=list(TAMANIOS), default=list(TAMANIOS))
+    parser.add_argument('--filtro', help="Ejecuta solo los casos cuyo nombre contiene este texto")
+    parser.add_argument('--linea-base', default=LINEA_BASE, help="Archivo JSON con la línea base")
+    parser.add_argument('--guardar-linea-base', action='store_true', help="Guarda los resultados como nueva línea base")
+    parser.add_argument('--tolerancia', type=float, default=0.25, help="Empeoramiento admitido (0.25 = 25%%)")
+    parser.add_argument('--salida', help="Archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    resultados = ejecutar(args.tamanios, args.filtro)
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            json.dump(resultados, archivo, indent=2)
+
+    if args.guardar_linea_base:
+        # Se actualizan solo los tamaños y casos medidos; los demás quedan como estaban
+        linea_base = {}
+        if os.path.exists(args.linea_base):
+            with open(args.linea_base, encoding='utf-8') as archivo:
+                linea_base = json.load(archivo)
+        for etiqueta, casos in resultados.items():
+            linea_base.setdefault(etiqueta, {}).update(casos)
+        with open(args.linea_base, 'w', encoding='utf-8') as archivo:
+            json.dump(linea_base, archivo, indent=2)
+        print(f"\nLínea base guardada en {args.linea_base}")
+        return
+
+    if os.path.exists(args.linea_base):
+        with open(args.linea_base, encoding='utf-8') as archivo:
+            regresiones = comparar(resultados, json.load(archivo), args.tolerancia)
+        if regresiones:
+            print("\nRegresiones detectadas:")
+            for regresion in regresiones:
+                print(f"  {regresion}")
+            sys.exit(1)
+        print("\nSin regresiones respecto de la línea base")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import data_manager as dm
+import impuestos
+import metricas
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Segundos mínimos entre compactaciones automáticas de la instantánea mapeada
+INTERVALO_COMPACTACION = 300
+
+# El diario de escritura se vuelca a Parquet al escribir si pasaron estos
+# segundos desde el último volcado o si ocupa más de estos bytes
+INTERVALO_VOLCADO = 60
+MAXIMO_BYTES_DIARIO = 8 * 1024 * 1024
+# Los lotes más grandes, como una importación, van directo a Parquet
+MAXIMO_REGISTROS_DIARIO = 10_000
+
+@contextmanager
+def bloqueo_archivo(ruta, esperar=True):
+    """Bloqueo exclusivo entre procesos sobre el archivo indicado.
+
+    Con `esperar=False` no se espera a que se libere: el contexto entrega
+    False si otro proceso lo tiene tomado.
+    """
+    with open(ruta, 'a+b') as archivo:
+        try:
+            if fcntl is not None:
+                fcntl.flock(archivo, fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                archivo.seek(0)
+                msvcrt.locking(archivo.fileno(), msvcrt.LK_LOCK if esperar else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            if esperar:
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            if fcntl is not None:
+                fcntl.flock(archivo, fcntl.LOCK_UN)
+            else:
+                archivo.seek(0)
+                msvcrt.locking(archivo.fileno(), msvcrt.LK_UNLCK, 1)
+
+class AlmacenCompartido:
+    """Almacén único por proceso sobre la carpeta de datos compartida.
+
+    La aplicación Streamlit y la API abren cada una un solo almacén para
+    todas sus sesiones y pedidos. Las escrituras se hacen con un bloqueo de
+    archivo y se anotan en el registro de cambios de la carpeta
+    (`dm.ARCHIVO_CAMBIOS`); `actualizar` lee solo los archivos anotados desde
+    la última vez, así cada proceso ve lo que escribe el otro sin recargar todo.
+
+    `almacen` es siempre una instantánea que no se modifica: los cambios se
+    aplican sobre una copia (`dm.AlmacenColumnar.copia`) que después la
+    reemplaza, así los lectores nunca ven un lote a medio aplicar.
+
+    Si la carpeta tiene una instantánea mapeada (ver `compactar`), los
+    registros se leen de ahí y todos los procesos comparten las mismas
+    páginas de memoria; solo los cambios posteriores ocupan memoria propia
+    hasta la siguiente compactación, que se hace al escribir cada
+    `intervalo_compactacion` segundos.
+
+    Cada instantánea lleva la `etiqueta` del estado del disco del que sale
+    (generación y posición del registro de cambios y del diario), que es la
+    misma en todos los procesos que leyeron hasta el mismo punto.
+
+    Los lotes de hasta `MAXIMO_REGISTROS_DIARIO` registros se confirman en
+    el diario de escritura (`dm.ARCHIVO_DIARIO`) en lugar de escribir
+    Parquet: los que llegan mientras otro hilo confirma se juntan y se
+    escriben con un solo fsync (ver `registrar`). El diario se vuelca a
+    Parquet cada `intervalo_volcado` segundos o cuando pasa de
+    `MAXIMO_BYTES_DIARIO`, y al abrir el almacén se aplica lo que tenga.
+    """
+
+    def __init__(self, directorio=dm.DIRECTORIO_DATOS, intervalo_compactacion=INTERVALO_COMPACTACION,
+                 intervalo_volcado=INTERVALO_VOLCADO):
+        self.directorio = directorio
+        self.intervalo_compactacion = intervalo_compactacion
+        self.intervalo_volcado = intervalo_volcado
+        # Junto a la carpeta y no dentro, porque reemplazar la borra
+        self.ruta_bloqueo = f'{os.path.normpath(directorio)}.bloqueo'
+        self._hilos = threading.RLock()
+        self._profundidad = 0
+        self._generacion = None
+        self._posicion = 0
+        self._firma = None
+        self._instantanea = None
+        self._ultima_compactacion = time.monotonic()
+        self._diario = None
+        self._posicion_diario = 0
+        self._ultimo_volcado = time.monotonic()
+        # Lotes que esperan confirmarse en el diario
+        self._pendientes = []
+        self._bloqueo_pendientes = threading.Lock()
+        # Registros que se aplicaron desde el diario en la última carga completa
+        self.recuperados = 0
+        self._vigente = None
+        with self.bloqueo():
+            dm.recuperar_reemplazo(directorio)
+            # El diario nombra los registros por id; los datos anteriores a los ids se completan
+            dm.completar_ids(directorio)
+            self._recargar()
+
+    @contextmanager
+    def bloqueo(self, esperar=True):
+        """Bloquea las escrituras de los demás hilos y procesos; es reentrante.
+
+        Con `esperar=False` entrega False en lugar de esperar si otro hilo o
+        proceso tiene el bloqueo.
+        """
+        if not self._hilos.acquire(blocking=esperar):
+            yield False
+            return
+        try:
+            if self._profundidad:
+                self._profundidad += 1
+                try:
+                    yield True
+                finally:
+                    self._profundidad -= 1
+                return
+            os.makedirs(os.path.dirname(self.ruta_bloqueo) or '.', exist_ok=True)
+            with bloqueo_archivo(self.ruta_bloqueo, esperar) as obtenido:
+                if not obtenido:
+                    yield False
+                    return
+                self._profundidad = 1
+                try:
+                    yield True
+                finally:
+                    self._profundidad = 0
+        finally:
+            self._hilos.release()
+
+    def _firma_cambios(self):
+        """Estado del registro de cambios, del puntero a la instantánea y del diario, para detectar cambios con un stat."""
+        firma = []
+        for nombre in [dm.ARCHIVO_CAMBIOS, dm.ARCHIVO_INSTANTANEA, dm.ARCHIVO_DIARIO]:
+            try:
+                estado = os.stat(os.path.join(self.directorio, nombre))
+            except FileNotFoundError:
+                firma.append(None)
+                continue
+            firma.append((estado.st_ino, estado.st_size, estado.st_mtime_ns))
+        return tuple(firma)
+
+    @property
+    def almacen(self):
+        """Instantánea vigente del almacén."""
+        return self._vigente[0]
+
+    @almacen.setter
+    def almacen(self, almacen):
+        # La etiqueta sale del estado actual, así que se publica después de actualizarlo
+        estado = f'{self._generacion}:{self._posicion}:{self._diario}:{self._posicion_diario}'
+        etiqueta = hashlib.blake2b(estado.encode(), digest_size=8).hexdigest()
+        self._vigente = (almacen, etiqueta)
+
+    def vigente(self):
+        """Incorpora los cambios pendientes y devuelve la instantánea vigente junto con su etiqueta."""
+        self.actualizar()
+        return self._vigente
+
+    @property
+    def bytes_diario(self):
+        """Bytes del diario de escritura que todavía no se volcaron a Parquet."""
+        return max(0, self._posicion_diario - dm.LARGO_IDENTIFICADOR_DIARIO)
+
+    def _recargar(self):
+        """Carga todo de nuevo, desde la instantánea si corresponde a la generación actual.
+
+        Después se aplican los lotes del diario de escritura, que todavía no
+        están en Parquet.
+        """
+        firma = self._firma_cambios()
+        generacion, _, posicion = dm.leer_cambios(self.directorio)
+        instantanea = dm.abrir_instantanea(self.directorio)
+        if instantanea is not None and instantanea.generacion == generacion:
+            almacen = instantanea.almacen
+            self._instantanea = instantanea.carpeta
+            _, archivos, posicion = dm.leer_cambios(self.directorio, instantanea.posicion)
+            if archivos:
+                almacen = self._incorporar(dm.leer_archivos(archivos, self.directorio), almacen)
+        else:
+            almacen = dm.cargar_almacen(self.directorio, diario=False)
+            self._instantanea = None
+        self._diario, filas, _, self._posicion_diario = dm.leer_diario(self.directorio)
+        if len(filas):
+            almacen = self._incorporar(filas, almacen)
+        self.recuperados = len(filas)
+        self._generacion, self._posicion, self._firma = generacion, posicion, firma
+        self.almacen = almacen
+
+    def actualizar(self):
+        """Incorpora los cambios escritos por otros procesos y devuelve la instantánea vigente.
+
+        Si otro hilo o proceso está escribiendo no se lo espera: se devuelve
+        la última instantánea y los cambios se leen en la próxima llamada.
+        """
+        firma = self._firma_cambios()
+        if firma == self._firma:
+            return self.almacen
+
+        # Con el bloqueo ningún escritor borra particiones mientras se leen
+        with self.bloqueo(esperar=False) as obtenido:
+            if not obtenido:
+                return self.almacen
+            generacion, archivos, posicion = dm.leer_cambios(self.directorio, self._posicion)
+            # Una generación nueva o una instantánea nueva se vuelven a cargar enteras
+            if generacion != self._generacion or firma[1] != self._firma[1]:
+                self._recargar()
+                return self.almacen
+            almacen = self.almacen
+            if archivos:
+                almacen = self._incorporar(dm.leer_archivos(archivos, self.directorio), almacen)
+            # El diario va después: sus lotes son posteriores a todo lo que está en Parquet
+            self._diario, filas, _, self._posicion_diario = dm.leer_diario(
+                self.directorio, self._posicion_diario, self._diario
+            )
+            if len(filas):
+                almacen = self._incorporar(filas, almacen)
+            self._posicion = posicion
+            self._firma = firma
+            self.almacen = almacen
+        return self.almacen
+
+    def _incorporar(self, df, almacen):
+        """Aplica las filas leídas sobre una copia de `almacen`: reemplaza las que ya están y agrega las nuevas."""
+        almacen = almacen.copia()
+        if df.empty:
+            return almacen
+        # Una partición reescrita puede repetir filas de archivos anteriores
+        df = df.drop_duplicates('id', keep='last')
+        existentes = almacen.columna('id')
+        posiciones = np.searchsorted(existentes, df['id'].to_numpy())
+        encontrados = posiciones < len(existentes)
+        encontrados[encontrados] = existentes[posiciones[encontrados]] == df['id'].to_numpy()[encontrados]
+        if encontrados.any():
+            almacen.aplicar_cambios(df[encontrados], recalcular=False)
+        if not encontrados.all():
+            almacen.agregar(df[~encontrados].sort_values('id', kind='stable'), recalcular=False)
+        return almacen
+
+    def registrar(self, registros, secuencia=None):
+        """Aplica y persiste un lote de altas y modificaciones; devuelve sus ids.
+
+        Las escrituras de todos los hilos y procesos se hacen de a una. Los
+        lotes chicos se confirman en el diario: cada uno se pone en la cola
+        y el hilo que obtiene el bloqueo confirma todos los que encuentra,
+        así mientras uno espera el fsync los demás se juntan para el siguiente.
+        Al volver, el lote ya está en el disco.
+
+        Un lote con `secuencia` de sincronización va siempre al diario, en la
+        misma entrada que la secuencia (ver `dm.leer_secuencia`).
+        """
+        if secuencia is None and len(registros) > MAXIMO_REGISTROS_DIARIO:
+            return self._registrar_parquet(registros)
+
+        pedido = _Pedido(registros, secuencia)
+        with self._bloqueo_pendientes:
+            self._pendientes.append(pedido)
+        while not pedido.listo.is_set():
+            with self.bloqueo():
+                if not pedido.listo.is_set():
+                    self._confirmar_pendientes()
+        if pedido.error is not None:
+            raise pedido.error
+        return pedido.ids
+
+    def _confirmar_pendientes(self):
+        """Aplica los lotes de la cola sobre una copia y los anota juntos en el diario."""
+        with self._bloqueo_pendientes:
+            pedidos, self._pendientes = self._pendientes, []
+        try:
+            almacen = self.actualizar().copia()
+            ids, particiones = [], []
+            for pedido in pedidos:
+                # aplicar_cambios valida el lote antes de modificar el almacén
+                try:
+                    pedido.ids, cambiadas = almacen.aplicar_cambios(pedido.registros)
+                except Exception as e:
+                    pedido.error = e
+                    continue
+                ids.append(pedido.ids)
+                particiones.append(cambiadas)
+            confirmados = [pedido for pedido in pedidos if pedido.error is None]
+            if confirmados:
+                if self._diario is None:
+                    self._diario = dm.iniciar_diario(self.directorio)
+                    self._posicion_diario = dm.LARGO_IDENTIFICADOR_DIARIO
+                secuencia = max(
+                    (pedido.secuencia for pedido in confirmados if pedido.secuencia is not None), default=None
+                )
+                self._posicion_diario = dm.anotar_diario(
+                    almacen, np.concatenate(ids), np.concatenate(particiones), self._posicion_diario,
+                    self.directorio, secuencia
+                )
+                metricas.LOTES_DIARIO.observar(len(confirmados))
+                self.almacen = almacen
+                self._firma = self._firma_cambios()
+        except Exception as e:
+            for pedido in pedidos:
+                if pedido.error is None:
+                    pedido.error = e
+        finally:
+            for pedido in pedidos:
+                pedido.listo.set()
+
+        if (self.intervalo_volcado is not None
+                and (self.bytes_diario >= MAXIMO_BYTES_DIARIO
+                     or time.monotonic() - self._ultimo_volcado >= self.intervalo_volcado)):
+            self.volcar()
+        self._compactar_si_corresponde()
+
+    def _registrar_parquet(self, registros):
+        """Escribe un lote grande directamente en Parquet, después de volcar el diario."""
+        with self.bloqueo():
+            # Así lo que queda en el diario es siempre posterior a lo que está en Parquet
+            self.volcar()
+            almacen = self.actualizar().copia()
+            ids = dm.registrar(almacen, registros, self.directorio)
+            # El cambio propio ya está en memoria
+            self._generacion, _, self._posicion = dm.leer_cambios(self.directorio, self._posicion)
+            self._firma = self._firma_cambios()
+            self.almacen = almacen
+            self._compactar_si_corresponde()
+        return ids
+
+    def _compactar_si_corresponde(self):
+        if (self._instantanea is not None and self.intervalo_compactacion is not None
+                and time.monotonic() - self._ultima_compactacion >= self.intervalo_compactacion):
+            self.compactar()
+
+    def volcar(self):
+        """Pasa a Parquet los lotes del diario de escritura y lo vacía."""
+        with self.bloqueo():
+            almacen = self.actualizar()
+            self._ultimo_volcado = time.monotonic()
+            if not self.bytes_diario:
+                return
+            self._diario = dm.volcar_diario(almacen, self.directorio)
+            self._posicion_diario = dm.LARGO_IDENTIFICADOR_DIARIO
+            # Lo volcado ya está en memoria; cambia la etiqueta aunque los datos sean los mismos
+            self._generacion, _, self._posicion = dm.leer_cambios(self.directorio, self._posicion)
+            self._firma = self._firma_cambios()
+            self.almacen = almacen
+
+    def reemplazar(self, registros, recalcular=True, secuencia=None):
+        """Reemplaza todos los datos guardados, con su secuencia de sincronización si hay, y recarga el almacén."""
+        with self.bloqueo():
+            habia_instantanea = self._instantanea is not None
+            dm.reemplazar_registros(registros, self.directorio, recalcular, secuencia)
+            self._recargar()
+            if habia_instantanea:
+                self.compactar()
+        return self.almacen
+
+    def cambiar_reglas(self, reglas):
+        """Guarda nuevas reglas de impuestos y recalcula solo los registros afectados.
+
+        El recálculo usa las reglas guardadas, así que se guardan antes; si el
+        recálculo falla se vuelven a guardar las anteriores, para que los
+        impuestos guardados sigan correspondiendo a las reglas vigentes.
+        Devuelve la cantidad de registros recalculados.
+        """
+        with self.bloqueo():
+            almacen = self.actualizar()
+            previas = impuestos.reglas_vigentes()
+            afectados = dm.registros_afectados(almacen, previas, reglas)
+            impuestos.guardar_reglas(reglas)
+            try:
+                if len(afectados):
+                    self.registrar(afectados)
+            except Exception:
+                impuestos.guardar_reglas(previas)
+                raise
+        return len(afectados)
+
+    def compactar(self):
+        """Guarda el almacén como instantánea mapeada en memoria y pasa a usarla.
+
+        Las filas que cada proceso agregó en memoria propia vuelven a quedar
+        en páginas compartidas: los demás procesos mapean la nueva instantánea
+        la próxima vez que llaman a `actualizar`.
+        """
+        with self.bloqueo():
+            # La instantánea sigue al registro de cambios, así que el diario se vuelca antes
+            self.volcar()
+            almacen = self.actualizar()
+            dm.guardar_instantanea(almacen, self._generacion, self._posicion, self.directorio)
+            self._recargar()
+            self._ultima_compactacion = time.monotonic()
+        return self.almacen
+
+class _Pedido:
+    """Lote que espera confirmarse en el diario, con su resultado."""
+
+    def __init__(self, registros, secuencia=None):
+        self.registros = registros
+        self.secuencia = secuencia
+        self.listo = threading.Event()
+        self.ids = None
+        self.error = None
@@ -0,0 +1,261 @@
+import os
+import uuid
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import data_manager as dm
+
+# Códigos de comprobante de AFIP agrupados por letra
+CODIGOS_AFIP = {
+    'facturacion_a': [1, 2, 3, 4, 5, 51, 52, 53, 201, 202, 203],
+    'facturacion_b': [6, 7, 8, 9, 10, 206, 207, 208],
+    'facturacion_c': [11, 12, 13, 15, 211, 212, 213],
+}
+# Las notas de crédito restan de la facturación del mes
+NOTAS_CREDITO_AFIP = [3, 8, 13, 53, 203, 208, 213]
+# Los demás tipos (recibos, remitos, etc.) no suman a la facturación y se rechazan al importar
+CODIGOS_ADMITIDOS = sorted(codigo for codigos in CODIGOS_AFIP.values() for codigo in codigos)
+
+COLUMNAS_FACTURACION = list(CODIGOS_AFIP)
+
+# Carpeta de los comprobantes dentro de la de datos; el guion bajo la deja
+# fuera del dataset de registros mensuales
+CARPETA_COMPROBANTES = '_comprobantes'
+
+ESQUEMA_COMPROBANTES = pa.schema([
+    ('fecha', pa.date32()),
+    ('tipo', pa.int16()),
+    ('entidad', pa.dictionary(pa.int16(), pa.string())),
+    ('importe', pa.int64())  # centavos
+])
+
+def _columna_y_signo(tipos):
+    """Devuelve, por tipo de comprobante AFIP, la columna de facturación (-1 si no suma) y el signo."""
+    tipos = np.asarray(tipos)
+    columnas = np.full(len(tipos), -1, dtype=np.int8)
+    for i, codigos in enumerate(CODIGOS_AFIP.values()):
+        columnas[np.isin(tipos, codigos)] = i
+    signos = np.where(np.isin(tipos, NOTAS_CREDITO_AFIP), -1, 1)
+    return columnas, signos
+
+class AcumuladorMensual:
+    """Sumas de facturación A, B y C por entidad y mes de los comprobantes recibidos.
+
+    Recibe los comprobantes por lotes y ocupa memoria por celda (entidad, mes)
+    y no por comprobante. `vaciar` entrega las sumas con el esquema de los
+    registros mensuales y vuelve a empezar.
+    """
+
+    def __init__(self):
+        self._sumas = {}
+
+    def __len__(self):
+        return len(self._sumas)
+
+    def sumar(self, meses, entidades, columnas, importes):
+        """Suma un lote: número de mes, código de entidad, columna de facturación e importe firmado en centavos."""
+        validos = columnas >= 0
+        if not validos.any():
+            return
+        meses, entidades, columnas, importes = meses[validos], entidades[validos], columnas[validos], importes[validos]
+
+        # Un único bincount sobre una clave combinada (entidad, mes, columna), como en la tabla mensual
+        primero = int(meses.min())
+        ancho = int(meses.max()) - primero + 1
+        celdas = entidades.astype(np.int64) * ancho + (meses - primero)
+        cantidad = (int(entidades.max()) + 1) * ancho
+        conteos = np.bincount(celdas, minlength=cantidad)
+        sumas = dm.sumar_centavos(
+            celdas * len(COLUMNAS_FACTURACION) + columnas, importes, cantidad * len(COLUMNAS_FACTURACION)
+        ).reshape(cantidad, len(COLUMNAS_FACTURACION))
+        for celda in np.flatnonzero(conteos):
+            clave = (int(celda // ancho), primero + int(celda % ancho))
+            self._sumas[clave] = self._sumas.get(clave, 0) + sumas[celda]
+
+    def vaciar(self, entidades):
+        """Devuelve las sumas como registros mensuales en pesos (`entidades` da el nombre de cada código) y las descarta."""
+        claves = sorted(self._sumas)
+        sumas = np.array([self._sumas[clave] for clave in claves], dtype=np.int64).reshape(-1, len(COLUMNAS_FACTURACION))
+        meses = np.array([mes for _, mes in claves], dtype=np.int64)
+        registros = pd.DataFrame({
+            'fecha': meses.astype('datetime64[M]').astype('datetime64[ns]'),
+            'entidad': [entidades[codigo] for codigo, _ in claves]
+        })
+        for i, columna in enumerate(COLUMNAS_FACTURACION):
+            registros[columna] = dm.a_pesos(sumas[:, i])
+        self._sumas = {}
+        return registros
+
+class AlmacenComprobantes:
+    """Comprobantes individuales en columnas compactas con crecimiento amortizado.
+
+    Por comprobante se guardan la fecha en días desde 1970 (int32), el tipo
+    de AFIP como código de `tipos` (uint8), la entidad como código de
+    `entidades` (int16) y el importe en centavos (int64): 15 bytes. Los
+    lotes que se agregan se suman también en `acumulador`, que entrega los
+    registros mensuales para el almacén de `data_manager`.
+    """
+
+    def __init__(self, capacidad=1024):
+        self._fechas = np.empty(capacidad, dtype=np.int32)
+        self._tipos = np.empty(capacidad, dtype=np.uint8)
+        self._entidades = np.empty(capacidad, dtype=np.int16)
+        self._importes = np.empty(capacidad, dtype=np.int64)
+        self._n = 0
+        self.tipos = []
+        self.entidades = []
+        self._codigos_tipo = {}
+        self._codigos_entidad = {}
+        self.acumulador = AcumuladorMensual()
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def nbytes(self):
+        """Bytes que ocupan los comprobantes guardados (sin contar la capacidad libre)."""
+        return self._n * sum(a.itemsize for a in [self._fechas, self._tipos, self._entidades, self._importes])
+
+    def _asegurar_capacidad(self, extra):
+        requerida = self._n + extra
+        capacidad = len(self._fechas)
+        if requerida <= capacidad:
+            return
+
+        capacidad = max(capacidad, 1024)
+        while capacidad < requerida:
+            capacidad *= 2
+        for nombre in ['_fechas', '_tipos', '_entidades', '_importes']:
+            anterior = getattr(self, nombre)
+            nuevo = np.empty(capacidad, dtype=anterior.dtype)
+            nuevo[:self._n] = anterior[:self._n]
+            setattr(self, nombre, nuevo)
+
+    @staticmethod
+    def _codificar(unicos, lista, codigos, maximo):
+        """Devuelve el código de cada valor distinto en `lista`, agregando los nuevos."""
+        for valor in unicos:
+            if valor not in codigos:
+                if len(lista) >= maximo:
+                    raise ValueError(f"Demasiados valores distintos: no se puede agregar {valor!r}")
+                codigos[valor] = len(lista)
+                lista.append(valor)
+        return np.array([codigos[valor] for valor in unicos], dtype=np.int64)
+
+    def agregar(self, fechas, tipos, importes, entidades=None, acumular=True):
+        """Agrega un lote de comprobantes.
+
+        `fechas` son datetime64 (o días desde 1970), `tipos` los códigos de
+        comprobante de AFIP, `importes` los montos en centavos (sin signo: las
+        notas de crédito restan según su tipo) y `entidades` un nombre para
+        todo el lote o uno por comprobante, también como Categorical (sin
+        ellas, la entidad predeterminada). Con `acumular` el lote se suma
+        también en `acumulador`.
+        """
+        fechas = np.asarray(fechas)
+        dias = fechas.astype('datetime64[D]').astype(np.int64) if fechas.dtype.kind == 'M' else fechas
+        tipos = np.asarray(tipos, dtype=np.int64)
+        importes = np.asarray(importes, dtype=np.int64)
+        if not len(dias) == len(tipos) == len(importes):
+            raise ValueError("Las fechas, los tipos y los importes deben tener la misma cantidad de comprobantes")
+        if len(tipos) and tipos.min() < 0:
+            raise ValueError("Tipo de comprobante inválido")
+        if isinstance(entidades, str):
+            nombres = pd.Categorical.from_codes(np.zeros(len(dias), dtype=np.int8), categories=[entidades])
+        else:
+            nombres = dm.normalizar_entidades(entidades, len(dias))
+
+        # Los tipos son enteros chicos: los distintos salen de un bincount, sin ordenar
+        presentes = np.flatnonzero(np.bincount(tipos))
+        mapa = np.zeros(presentes[-1] + 1 if len(presentes) else 0, dtype=np.int64)
+        mapa[presentes] = self._codificar(presentes.tolist(), self.tipos, self._codigos_tipo, np.iinfo(np.uint8).max + 1)
+        codigos_tipo = mapa[tipos]
+        codigos_entidad = self._codificar(
+            list(nombres.categories), self.entidades, self._codigos_entidad, np.iinfo(np.int16).max + 1
+        )[nombres.codes]
+
+        self._asegurar_capacidad(len(dias))
+        fin = self._n + len(dias)
+        self._fechas[self._n:fin] = dias
+        self._tipos[self._n:fin] = codigos_tipo
+        self._entidades[self._n:fin] = codigos_entidad
+        self._importes[self._n:fin] = importes
+        self._n = fin
+
+        if acumular:
+            columnas, signos = _columna_y_signo(tipos)
+            meses = dm.meses_de(dias.astype('datetime64[D]'))
+            self.acumulador.sumar(meses, codigos_entidad, columnas, signos * importes)
+
+    def columna(self, nombre):
+        """Devuelve una columna tal como se guarda: 'fecha' (días), 'tipo' y 'entidad' (códigos) o 'importe' (centavos)."""
+        arreglos = {'fecha': self._fechas, 'tipo': self._tipos, 'entidad': self._entidades, 'importe': self._importes}
+        return arreglos[nombre][:self._n]
+
+    def mensual(self):
+        """Suma todos los comprobantes guardados en registros mensuales, sin tocar el acumulador."""
+        acumulador = AcumuladorMensual()
+        tipos = np.array(self.tipos, dtype=np.int64)[self.columna('tipo')]
+        columnas, signos = _columna_y_signo(tipos)
+        acumulador.sumar(
+            dm.meses_de(self.columna('fecha').astype('datetime64[D]')),
+            self.columna('entidad'), columnas, signos * self.columna('importe')
+        )
+        return acumulador.vaciar(self.entidades)
+
+    def a_tabla(self):
+        """Devuelve los comprobantes como tabla Arrow con tipos compactos (ver `ESQUEMA_COMPROBANTES`)."""
+        return pa.table({
+            'fecha': pa.array(self.columna('fecha')).cast(pa.date32()),
+            'tipo': pa.array(np.array(self.tipos, dtype=np.int16)[self.columna('tipo')]),
+            'entidad': pa.DictionaryArray.from_arrays(
+                pa.array(self.columna('entidad')), pa.array(self.entidades, type=pa.string())
+            ),
+            'importe': pa.array(self.columna('importe'))
+        }, schema=ESQUEMA_COMPROBANTES)
+
+    @classmethod
+    def desde_tabla(cls, tabla):
+        """Crea un almacén a partir de una tabla Arrow con el esquema de los comprobantes, sin acumularlos."""
+        comprobantes = cls(capacidad=max(1024, tabla.num_rows))
+        for lote in tabla.to_batches():
+            entidades = lote.column('entidad')
+            comprobantes.agregar(
+                lote.column('fecha').cast(pa.int32()).to_numpy(),
+                lote.column('tipo').to_numpy(),
+                lote.column('importe').to_numpy(),
+                pd.Categorical.from_codes(entidades.indices.to_numpy(), categories=entidades.dictionary.to_pylist()),
+                acumular=False
+            )
+        return comprobantes
+
+def guardar_comprobantes(comprobantes, directorio=dm.DIRECTORIO_DATOS):
+    """Guarda los comprobantes en un archivo Parquet nuevo dentro de la carpeta de comprobantes."""
+    if not len(comprobantes):
+        return None
+    carpeta = os.path.join(directorio, CARPETA_COMPROBANTES)
+    os.makedirs(carpeta, exist_ok=True)
+    ruta = os.path.join(carpeta, f'{uuid.uuid4().hex}.parquet')
+    pq.write_table(comprobantes.a_tabla(), ruta + '.tmp')
+    os.replace(ruta + '.tmp', ruta)
+    return ruta
+
+def leer_comprobantes(directorio=dm.DIRECTORIO_DATOS, entidad=None, desde=None, hasta=None):
+    """Carga los comprobantes guardados, opcionalmente de una entidad y un rango de fechas."""
+    carpeta = os.path.join(directorio, CARPETA_COMPROBANTES)
+    if not os.path.isdir(carpeta):
+        return AlmacenComprobantes()
+
+    filtro = None
+    if desde is not None:
+        filtro = ds.field('fecha') >= pa.scalar(pd.Timestamp(desde).date(), type=pa.date32())
+    if hasta is not None:
+        condicion = ds.field('fecha') <= pa.scalar(pd.Timestamp(hasta).date(), type=pa.date32())
+        filtro = condicion if filtro is None else filtro & condicion
+    if entidad is not None:
+        condicion = ds.field('entidad') == entidad
+        filtro = condicion if filtro is None else filtro & condicion
+    tabla = ds.dataset(carpeta, format='parquet', schema=ESQUEMA_COMPROBANTES).to_table(filter=filtro)
+    return AlmacenComprobantes.desde_tabla(tabla)
@@ -0,0 +1,243 @@
+import itertools
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.acero as ac
+import pyarrow.compute as pc
+import data_manager as dm
+
+DIMENSIONES = ['fecha', 'entidad']
+
+# Meses que abarca cada período; dividen a 12, así los períodos respetan el año calendario
+GRANULARIDADES = {'mensual': 1, 'bimestral': 2, 'trimestral': 3, 'semestral': 6, 'anual': 12}
+
+FUNCIONES = {
+    'suma': 'sum',
+    'promedio': 'mean',
+    'minimo': 'min',
+    'maximo': 'max',
+    'cantidad': 'count',
+    'desvio': 'stddev'
+}
+
+VENTANAS = ['acumulado', 'promedio_movil', 'variacion']
+
+# Totales que se calculan en el motor a partir de las columnas guardadas
+COLUMNAS_CALCULADAS = dm.COLUMNAS_TOTALES
+MEDIDAS = dm.COLUMNAS_NUMERICAS + list(COLUMNAS_CALCULADAS)
+
+def interpretar_medida(medida):
+    """Separa una medida 'funcion:columna' (o solo 'columna', que se suma).
+
+    Devuelve la función, la columna y el nombre de la columna de resultado.
+    """
+    funcion, _, columna = medida.rpartition(':')
+    funcion = funcion or 'suma'
+    if funcion not in FUNCIONES:
+        raise ValueError(f"Función desconocida: {funcion}")
+    if columna not in MEDIDAS:
+        raise ValueError(f"Medida desconocida: {columna}")
+    nombre = columna if funcion == 'suma' else f'{funcion}_{columna}'
+    return funcion, columna, nombre
+
+def tabla_almacen(almacen):
+    """Expone las columnas del almacén como tabla Arrow sin copiarlas; los montos, en centavos."""
+    columnas = {
+        'fecha': pa.array(almacen.columna('fecha')),
+        'entidad': pa.array(almacen.columna('entidad'))
+    }
+    for columna in dm.COLUMNAS_NUMERICAS:
+        columnas[columna] = pa.array(almacen.columna(columna))
+    return pa.table(columnas)
+
+def _campo(columna, en_pesos):
+    if en_pesos:
+        # Los archivos guardan pesos: se pasan a centavos para sumar enteros exactos
+        centavos = pc.round(pc.multiply(pc.field(columna), dm.CENTAVOS), round_mode='half_towards_infinity')
+        return centavos.cast(pa.int64())
+    return pc.field(columna)
+
+def _expresion(columna, en_pesos):
+    if columna in COLUMNAS_CALCULADAS:
+        partes = [_campo(c, en_pesos) for c in COLUMNAS_CALCULADAS[columna]]
+        total = partes[0]
+        for parte in partes[1:]:
+            total = pc.add(total, parte)
+        return total
+    return _campo(columna, en_pesos)
+
+def _filtro(desde, hasta, entidades):
+    filtro = None
+    if desde is not None:
+        filtro = pc.field('fecha') >= pa.scalar(pd.Timestamp(desde).value, pa.timestamp('ns'))
+    if hasta is not None:
+        condicion = pc.field('fecha') <= pa.scalar(pd.Timestamp(hasta).value, pa.timestamp('ns'))
+        filtro = condicion if filtro is None else filtro & condicion
+    if entidades is not None:
+        condicion = pc.field('entidad').isin(entidades)
+        filtro = condicion if filtro is None else filtro & condicion
+    return filtro
+
+def _filtro_anios(desde, hasta):
+    """Condiciones sobre la partición 'anio' de la carpeta, que descartan carpetas enteras sin leerlas."""
+    filtro = None
+    if desde is not None:
+        filtro = pc.field('anio') >= pd.Timestamp(desde).year
+    if hasta is not None:
+        condicion = pc.field('anio') <= pd.Timestamp(hasta).year
+        filtro = condicion if filtro is None else filtro & condicion
+    return filtro
+
+def _origen(fuente, desde, hasta, entidades):
+    """Arma el nodo de lectura y el filtro sobre un almacén o una carpeta Parquet.
+
+    En el almacén la entidad es su código entero; en la carpeta es el nombre,
+    y el filtro descarta particiones enteras sin leerlas.
+    """
+    if isinstance(fuente, dm.AlmacenColumnar):
+        if entidades is not None:
+            entidades = [c for c in (fuente.codigo(e) for e in entidades) if c is not None]
+            entidades = pa.array(entidades, type=pa.int32())
+        origen = ac.Declaration('table_source', ac.TableSourceNodeOptions(tabla_almacen(fuente)))
+        return origen, _filtro(desde, hasta, entidades), fuente.entidades
+
+    # El diario antes que Parquet: si mientras tanto se vuelca, sus filas ya están en los archivos
+    diario = dm.registros_diario(fuente)
+    dm.migrar_particiones(fuente)
+    dataset = dm.dataset_registros(fuente)
+    filtro = _filtro(desde, hasta, None if entidades is None else pa.array(entidades, type=pa.string()))
+    # El filtro por año permite descartar particiones
+    filtro_archivos = filtro
+    filtro_anios = _filtro_anios(desde, hasta)
+    if filtro_anios is not None:
+        filtro_archivos = filtro_anios if filtro is None else filtro & filtro_anios
+    if not diario.num_rows:
+        opciones = ac.ScanNodeOptions(dataset, filter=filtro_archivos) if filtro_archivos is not None else ac.ScanNodeOptions(dataset)
+        return ac.Declaration('scan', opciones), filtro_archivos, None
+
+    # Los registros del diario, que todavía no se volcó, reemplazan a sus filas en Parquet
+    excluidos = pc.invert(pc.field('id').isin(diario.column('id')))
+    filtro_archivos = excluidos if filtro_archivos is None else filtro_archivos & excluidos
+    archivos = dataset.scanner(columns=diario.column_names, filter=filtro_archivos)
+    lotes = itertools.chain(archivos.to_batches(), diario.cast(archivos.projected_schema).to_batches())
+    lector = pa.RecordBatchReader.from_batches(archivos.projected_schema, lotes)
+    return ac.Declaration('record_batch_reader_source', ac.RecordBatchReaderSourceNodeOptions(lector)), filtro, None
+
+def consultar(fuente, dimensiones=('fecha',), medidas=('facturacion_total',), desde=None, hasta=None,
+              granularidad='mensual', entidades=None, ventanas=(), periodos=3):
+    """Agrupa, filtra y calcula ventanas con el motor vectorizado y multihilo de Arrow.
+
+    `fuente` es un almacén columnar o la carpeta de datos guardados, con los
+    lotes de su diario que todavía no se volcaron. La
+    dimensión 'fecha' agrupa por período según `granularidad` y se rotula con
+    el último día del período. Las medidas son 'funcion:columna' (ver
+    `FUNCIONES` y `MEDIDAS`); se calculan en centavos enteros y se devuelven
+    en pesos. Las ventanas se calculan por entidad a lo largo
+    de los períodos: 'acumulado', 'promedio_movil' de `periodos` períodos
+    (los que no tienen datos cuentan como cero) y 'variacion' relativa al
+    período anterior. Devuelve un DataFrame ordenado por las dimensiones.
+    """
+    dimensiones = list(dict.fromkeys(dimensiones))
+    for dimension in dimensiones:
+        if dimension not in DIMENSIONES:
+            raise ValueError(f"Dimensión desconocida: {dimension}")
+    if granularidad not in GRANULARIDADES:
+        raise ValueError(f"Granularidad desconocida: {granularidad}")
+    for ventana in ventanas:
+        if ventana not in VENTANAS:
+            raise ValueError(f"Ventana desconocida: {ventana}")
+    if ventanas and 'fecha' not in dimensiones:
+        raise ValueError("Las ventanas requieren la dimensión 'fecha'")
+    if periodos < 1:
+        raise ValueError("'periodos' debe ser al menos 1")
+    medidas = [interpretar_medida(m) for m in dict.fromkeys(medidas)]
+    if not medidas:
+        raise ValueError("Se requiere al menos una medida")
+
+    origen, filtro, nombres_entidades = _origen(fuente, desde, hasta, entidades)
+    nodos = [origen]
+    if filtro is not None:
+        nodos.append(ac.Declaration('filter', ac.FilterNodeOptions(filtro)))
+
+    # Proyección: claves de agrupación y columnas de las medidas
+    expresiones, nombres = [], []
+    meses = GRANULARIDADES[granularidad]
+    if 'fecha' in dimensiones:
+        # Número de mes desde el año 0, redondeado al comienzo del período
+        mes = pc.add(pc.multiply(pc.year(pc.field('fecha')), 12), pc.subtract(pc.month(pc.field('fecha')), 1))
+        expresiones.append(pc.multiply(pc.divide(mes, meses), meses))
+        nombres.append('fecha')
+    if 'entidad' in dimensiones:
+        expresiones.append(pc.field('entidad'))
+        nombres.append('entidad')
+    columnas = list(dict.fromkeys(columna for _, columna, _ in medidas))
+    en_pesos = not isinstance(fuente, dm.AlmacenColumnar)
+    for columna in columnas:
+        expresiones.append(_expresion(columna, en_pesos))
+        nombres.append(columna)
+    nodos.append(ac.Declaration('project', ac.ProjectNodeOptions(expresiones, nombres)))
+
+    prefijo = 'hash_' if dimensiones else ''
+    agregados = [
+        (columna, prefijo + FUNCIONES[funcion], None, nombre)
+        for funcion, columna, nombre in medidas
+    ]
+    nodos.append(ac.Declaration('aggregate', ac.AggregateNodeOptions(agregados, keys=dimensiones)))
+    if dimensiones:
+        orden = [('entidad', 'ascending')] if 'entidad' in dimensiones else []
+        orden += [('fecha', 'ascending')] if 'fecha' in dimensiones else []
+        nodos.append(ac.Declaration('order_by', ac.OrderByNodeOptions(orden)))
+
+    tabla = ac.Declaration.from_sequence(nodos).to_table(use_threads=True)
+    resultado = pd.DataFrame({
+        nombre: tabla.column(nombre).to_numpy(zero_copy_only=False)
+        for nombre in dimensiones
+    })
+    for _, _, nombre in medidas:
+        resultado[nombre] = tabla.column(nombre).to_numpy(zero_copy_only=False)
+
+    if 'entidad' in dimensiones and nombres_entidades is not None:
+        # Los códigos siguen el orden de alta; se ordena por nombre como en la carpeta
+        resultado['entidad'] = np.asarray(nombres_entidades, dtype=object)[resultado['entidad'].to_numpy(dtype=np.int64)]
+        resultado = resultado.sort_values('entidad', kind='stable', ignore_index=True)
+    if ventanas:
+        _agregar_ventanas(resultado, [nombre for _, _, nombre in medidas], ventanas, periodos, meses)
+    # Los montos (y sus acumulados y promedios) pasan de centavos a pesos recién al final
+    for funcion, _, nombre in medidas:
+        if funcion != 'cantidad':
+            for columna in [nombre, f'{nombre}_acumulado', f'{nombre}_promedio_movil']:
+                if columna in resultado:
+                    resultado[columna] = dm.a_pesos(resultado[columna].to_numpy())
+    if 'fecha' in dimensiones:
+        # Último día del período (meses contados desde el año 0)
+        resultado['fecha'] = dm.fin_de_mes(resultado['fecha'].to_numpy() + meses - 1 - dm.MES_CERO)
+    return resultado[dimensiones + [c for c in resultado.columns if c not in dimensiones]]
+
+def _agregar_ventanas(resultado, medidas, ventanas, periodos, meses):
+    """Calcula las ventanas sobre el resultado ya agrupado, ordenado por entidad y fecha."""
+    periodo = resultado['fecha'].to_numpy(dtype=np.int64) // meses
+    if 'entidad' in resultado:
+        grupo = pd.factorize(resultado['entidad'], sort=False)[0]
+    else:
+        grupo = np.zeros(len(resultado), dtype=np.int64)
+    # Clave creciente dentro del resultado ordenado: grupo y período
+    clave = grupo * (periodo.max(initial=0) + periodos + 2) + periodo
+    inicio_grupo = np.searchsorted(grupo, grupo)
+
+    for medida in medidas:
+        valores = resultado[medida].to_numpy(dtype=np.float64)
+        acumulado = np.cumsum(valores)
+        previo = np.concatenate([[0.0], acumulado])
+        if 'acumulado' in ventanas:
+            resultado[f'{medida}_acumulado'] = acumulado - previo[inicio_grupo]
+        if 'promedio_movil' in ventanas:
+            desde = np.searchsorted(clave, clave - periodos + 1)
+            resultado[f'{medida}_promedio_movil'] = (acumulado - previo[desde]) / periodos
+        if 'variacion' in ventanas:
+            variacion = np.full(len(valores), np.nan)
+            consecutivo = np.zeros(len(valores), dtype=bool)
+            consecutivo[1:] = clave[1:] == clave[:-1] + 1
+            anterior = np.roll(valores, 1)
+            validos = consecutivo & (anterior != 0)
+            variacion[validos] = valores[validos] / anterior[validos] - 1
+            resultado[f'{medida}_variacion'] = variacion
@@ -1,71 +1,1604 @@
+import copy
+import itertools
+import json
+import os
+import shutil
+import struct
+import uuid
+import zlib
+from collections import namedtuple
+from urllib.parse import quote, unquote
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import impuestos
+import metricas
+
+COLUMNAS_BASE = [
+    'facturacion_a', 'facturacion_b', 'facturacion_c',
+    'gastos_operativos', 'otros_gastos', 'retenciones'
+]
+COLUMNAS_DERIVADAS = ['iva_debito', 'iva_credito', 'iva_total', 'ingresos_brutos', 'utilidad']
+COLUMNAS_NUMERICAS = COLUMNAS_BASE + COLUMNAS_DERIVADAS
+COLUMNAS = ['fecha'] + COLUMNAS_NUMERICAS
+
+# Totales que se calculan sumando columnas guardadas
+COLUMNAS_TOTALES = {
+    'facturacion_total': ['facturacion_a', 'facturacion_b', 'facturacion_c'],
+    'gastos_totales': ['gastos_operativos', 'otros_gastos'],
+    'impuestos_totales': ['iva_total', 'ingresos_brutos', 'retenciones']
+}
+
+# Los montos se guardan en memoria como centavos enteros (int64): las sumas
+# son exactas y se convierten a pesos solo al entregarlas
+CENTAVOS = 100
+
+# Los ids los asigna el almacén a partir de 1; 0 indica un registro todavía sin id
+SIN_ID = 0
+
+# Empresa, sucursal o CUIT al que pertenece cada registro. Los registros sin
+# entidad (por ejemplo, los guardados antes de que existiera) van a la principal.
+ENTIDAD_PREDETERMINADA = 'principal'
+
+DIRECTORIO_DATOS = os.environ.get('FACTURACION_DATOS', 'datos')
+
+def redondear(montos):
+    """Redondea montos en centavos al entero más cercano, con las mitades lejos de cero como AFIP.
+
+    Antes se descarta el error de representación binaria, así 100.5 centavos
+    guardados como 100.49999999999999 también suben a 101.
+    """
+    montos = np.round(np.asarray(montos, dtype=np.float64), 6)
+    return np.trunc(montos + np.copysign(0.5, montos)).astype(np.int64)
+
+def a_centavos(pesos):
+    """Convierte montos en pesos a centavos enteros (int64) redondeando al centavo."""
+    return redondear(np.asarray(pesos, dtype=np.float64) * CENTAVOS)
+
+def a_pesos(centavos):
+    """Convierte centavos enteros a pesos (float64) para mostrarlos o guardarlos."""
+    return np.asarray(centavos) / CENTAVOS
+
+def calcular_impuestos(valores, fechas, entidades, reglas=None):
+    """Calcula IVA, ingresos brutos y utilidad sobre columnas completas en centavos.
+
+    Las tasas de cada registro salen de las reglas vigentes según su fecha y
+    su entidad (un Categorical de nombres); ver `impuestos.ReglasImpuestos`.
+    Cada impuesto se redondea al centavo y el resto son sumas enteras exactas.
+    """
+    reglas = reglas or impuestos.reglas_vigentes()
+    facturacion_a = valores['facturacion_a']
+    facturacion_b = valores['facturacion_b']
+    facturacion_c = valores['facturacion_c']
+
+    iva_debito = (
+        redondear(facturacion_a * reglas.tasas('iva_a', entidades, fechas))
+        + redondear(facturacion_b * reglas.tasas('iva_b', entidades, fechas))
+    )
+    iva_credito = redondear(valores['gastos_operativos'] * reglas.tasas('iva_credito', entidades, fechas))
+    iva_total = iva_debito - iva_credito
+
+    facturacion = facturacion_a + facturacion_b + facturacion_c
+    ingresos_brutos = redondear(facturacion * reglas.tasas('ingresos_brutos', entidades, fechas))
+
+    utilidad = (
+        facturacion
+        - valores['gastos_operativos']
+        - valores['otros_gastos']
+        - iva_total
+        - ingresos_brutos
+        - valores['retenciones']
+    )
+
+    return {
+        'iva_debito': iva_debito,
+        'iva_credito': iva_credito,
+        'iva_total': iva_total,
+        'ingresos_brutos': ingresos_brutos,
+        'utilidad': utilidad
+    }
+
+# Cada escritura en cualquier almacén obtiene una versión única dentro del proceso
+_versiones = itertools.count(1)
+
+Lote = namedtuple('Lote', ['fechas', 'valores', 'ids', 'entidades'])
+
+def normalizar_entidades(entidades, cantidad):
+    """Convierte la columna de entidades en un Categorical de nombres sin faltantes."""
+    if entidades is None:
+        return pd.Categorical.from_codes(np.zeros(cantidad, dtype=np.int8), categories=[ENTIDAD_PREDETERMINADA])
+
+    categorias = pd.Categorical(entidades)
+    categorias = categorias.rename_categories(categorias.categories.astype(str))
+    if (categorias.codes == -1).any() or '' in categorias.categories:
+        if ENTIDAD_PREDETERMINADA not in categorias.categories:
+            categorias = categorias.add_categories([ENTIDAD_PREDETERMINADA])
+        if '' in categorias.categories:
+            categorias = categorias.remove_categories([''])
+        categorias = categorias.fillna(ENTIDAD_PREDETERMINADA)
+    return categorias
+
+def _monto(registro, columna):
+    valor = registro.get(columna)
+    return 0.0 if valor is None or pd.isna(valor) else float(valor)
+
+def _normalizar_registro(registro, recalcular):
+    """Camino corto de `normalizar_registros` para un solo registro en un dict, como los del formulario.
+
+    Arma los arreglos de un elemento directamente, sin pasar por un DataFrame,
+    con los mismos criterios para los valores faltantes.
+    """
+    if 'fecha' not in registro:
+        raise ValueError("Los registros deben incluir la columna 'fecha'")
+
+    fechas = np.array([pd.Timestamp(registro['fecha']).to_datetime64()], dtype='datetime64[ns]')
+    valores = {columna: a_centavos([_monto(registro, columna)]) for columna in COLUMNAS_BASE}
+
+    entidad = registro.get('entidad')
+    if 'entidad' not in registro:
+        entidades = normalizar_entidades(None, 1)
+    else:
+        nombre = ENTIDAD_PREDETERMINADA if entidad is None or pd.isna(entidad) or entidad == '' else str(entidad)
+        # Con categorías object se evita que pandas infiera el tipo de texto, que es lo más lento aquí
+        entidades = pd.Categorical.from_codes(np.zeros(1, dtype=np.int8), categories=pd.Index([nombre], dtype=object))
+    if recalcular:
+        valores.update(calcular_impuestos(valores, fechas, entidades))
+    else:
+        for columna in COLUMNAS_DERIVADAS:
+            valores[columna] = a_centavos([_monto(registro, columna)])
+
+    registro_id = registro.get('id')
+    ids = np.array([SIN_ID if registro_id is None or pd.isna(registro_id) else registro_id], dtype=np.int64)
+    return Lote(fechas, valores, ids, entidades)
+
+def normalizar_registros(registros, recalcular=True):
+    """Convierte un lote de registros en arreglos de fechas, montos en centavos e ids."""
+    if isinstance(registros, (list, tuple)) and len(registros) == 1 and isinstance(registros[0], dict):
+        return _normalizar_registro(registros[0], recalcular)
+    lote = registros if isinstance(registros, pd.DataFrame) else pd.DataFrame(registros)
+    if 'fecha' not in lote:
+        raise ValueError("Los registros deben incluir la columna 'fecha'")
+
+    fechas = pd.to_datetime(lote['fecha']).to_numpy(dtype='datetime64[ns]')
+    valores = {}
+    for columna in COLUMNAS_BASE:
+        if columna in lote:
+            valores[columna] = a_centavos(lote[columna].to_numpy(dtype=np.float64, na_value=0.0))
+        else:
+            valores[columna] = np.zeros(len(lote), dtype=np.int64)
+
+    entidades = normalizar_entidades(lote['entidad'] if 'entidad' in lote else None, len(lote))
+    if recalcular:
+        valores.update(calcular_impuestos(valores, fechas, entidades))
+    else:
+        for columna in COLUMNAS_DERIVADAS:
+            valores[columna] = a_centavos(lote[columna].to_numpy(dtype=np.float64, na_value=0.0))
+
+    if 'id' in lote:
+        ids = lote['id'].to_numpy(dtype=np.int64, na_value=SIN_ID)
+    else:
+        ids = np.full(len(lote), SIN_ID, dtype=np.int64)
+    return Lote(fechas, valores, ids, entidades)
+
+def meses_de(fechas):
+    """Convierte fechas en números de mes consecutivos (meses desde 1970-01)."""
+    return fechas.astype('datetime64[M]').astype(np.int64)
+
+def fin_de_mes(meses):
+    """Devuelve el último día de cada mes como índice de fechas."""
+    meses = np.asarray(meses, dtype=np.int64)
+    dias = (meses + 1).astype('datetime64[M]').astype('datetime64[D]') - np.timedelta64(1, 'D')
+    return pd.DatetimeIndex(dias.astype('datetime64[ns]'), name='fecha')
+
+# Clave entera única por partición (entidad, mes). Las fechas en nanosegundos
+# van de 1677 a 2262, así que los meses contados desde el año 0 entran holgados.
+_MESES_POR_CLAVE = 12 * 10_000
+# Enero de 1970 contado desde el año 0: pasa de los meses de `meses_de` a los contados desde el año 0
+MES_CERO = 1970 * 12
+
+def clave_particion(codigos, meses):
+    """Combina códigos de entidad y números de mes en una clave por partición."""
+    return np.asarray(codigos, dtype=np.int64) * _MESES_POR_CLAVE + meses + MES_CERO
+
+def separar_clave(clave):
+    """Devuelve el código de entidad y el número de mes de una clave de partición."""
+    codigo, mes = divmod(int(clave), _MESES_POR_CLAVE)
+    return codigo, mes - MES_CERO
+
+def sumar_centavos(grupos, centavos, cantidad):
+    """Suma centavos por grupo con bincount y devuelve enteros.
+
+    bincount acumula en float64, que representa exactamente los enteros de
+    hasta 2**53 centavos (unos 90 billones de pesos por celda).
+    """
+    return np.rint(np.bincount(grupos, weights=centavos, minlength=cantidad)).astype(np.int64)
+
+class AgregadoMensual:
+    """Tabla materializada de sumas por mes, en centavos, que se actualiza con cada lote.
+
+    Junto a las sumas de cada mes mantiene las sumas acumuladas desde el
+    inicio de la tabla (y en su última fila, la cantidad de registros), con
+    las que cualquier ventana de meses se resuelve con una resta. Cada lote
+    las recalcula solo desde el primer mes que toca hasta el último con datos,
+    así que agregar registros del mes en curso no recorre la historia.
+    """
+
+    def __init__(self):
+        self._base = 0
+        self._sumas = np.zeros((len(COLUMNAS_NUMERICAS), 0), dtype=np.int64)
+        self._conteos = np.zeros(0, dtype=np.int64)
+        self._acumulados = np.zeros((len(COLUMNAS_NUMERICAS) + 1, 0), dtype=np.int64)
+        # Las sumas acumuladas son válidas hasta esta posición (exclusive);
+        # después no hay datos y valen lo mismo que en la anterior
+        self._fin = 0
+
+    @classmethod
+    def desde_dataframe(cls, df):
+        """Construye la tabla mensual a partir de un DataFrame de registros."""
+        agregado = cls()
+        if df.empty:
+            return agregado
+
+        valores = {}
+        for columna in COLUMNAS_NUMERICAS:
+            if columna in df:
+                valores[columna] = a_centavos(pd.to_numeric(df[columna]).to_numpy(dtype=np.float64, na_value=0.0))
+            else:
+                valores[columna] = np.zeros(len(df), dtype=np.int64)
+        fechas = pd.to_datetime(df['fecha']).to_numpy(dtype='datetime64[ns]')
+        agregado.sumar(meses_de(fechas), valores)
+        return agregado
+
+    def copia(self):
+        """Devuelve una copia independiente de la tabla."""
+        agregado = AgregadoMensual()
+        agregado._base = self._base
+        agregado._sumas = self._sumas.copy()
+        agregado._conteos = self._conteos.copy()
+        agregado._acumulados = self._acumulados.copy()
+        agregado._fin = self._fin
+        return agregado
+
+    def _asegurar_rango(self, primero, ultimo):
+        capacidad = len(self._conteos)
+        if capacidad and self._base <= primero and ultimo < self._base + capacidad:
+            return
+
+        inicio = min(primero, self._base) if capacidad else primero
+        fin = max(ultimo + 1, self._base + capacidad) if capacidad else ultimo + 1
+        nueva = max(fin - inicio, 2 * capacidad)
+        # El espacio extra queda del lado por el que creció la tabla
+        if capacidad and primero < self._base:
+            inicio = fin - nueva
+
+        sumas = np.zeros((len(COLUMNAS_NUMERICAS), nueva), dtype=np.int64)
+        conteos = np.zeros(nueva, dtype=np.int64)
+        acumulados = np.zeros((len(COLUMNAS_NUMERICAS) + 1, nueva), dtype=np.int64)
+        desplazamiento = 0
+        if capacidad:
+            desplazamiento = self._base - inicio
+            sumas[:, desplazamiento:desplazamiento + capacidad] = self._sumas
+            conteos[desplazamiento:desplazamiento + capacidad] = self._conteos
+            # Los meses nuevos del principio están vacíos: no cambian lo acumulado
+            acumulados[:, desplazamiento:desplazamiento + self._fin] = self._acumulados[:, :self._fin]
+
+        self._base = inicio
+        self._sumas = sumas
+        self._conteos = conteos
+        self._acumulados = acumulados
+        self._fin = self._fin + desplazamiento if self._fin else 0
+
+    def _acumular_desde(self, desde, hasta):
+        """Recalcula las sumas acumuladas desde la posición `desde`, después de un lote que llega hasta `hasta`."""
+        # Si el lote empieza después del último mes con datos, se arrastra lo acumulado por los meses vacíos
+        desde = min(desde, self._fin)
+        self._fin = max(self._fin, hasta)
+        tramo = np.cumsum(
+            np.vstack([self._sumas[:, desde:self._fin], self._conteos[desde:self._fin]]), axis=1
+        )
+        if desde:
+            tramo += self._acumulados[:, desde - 1:desde]
+        self._acumulados[:, desde:self._fin] = tramo
+
+    def sumar(self, meses, valores, signo=1):
+        """Suma (o resta con signo=-1) los valores en centavos de un lote en sus meses."""
+        if len(meses) == 0:
+            return
+
+        self._asegurar_rango(int(meses.min()), int(meses.max()))
+        posiciones = meses - self._base
+        capacidad = len(self._conteos)
+        self._conteos += signo * np.bincount(posiciones, minlength=capacidad)
+        for i, columna in enumerate(COLUMNAS_NUMERICAS):
+            self._sumas[i] += signo * sumar_centavos(posiciones, valores[columna], capacidad)
+        self._acumular_desde(int(posiciones.min()), int(posiciones.max()) + 1)
+
+    def acumular(self, primero, sumas, conteos):
+        """Suma tablas ya agregadas (columnas x meses) que empiezan en el mes `primero`."""
+        ultimo = primero + len(conteos) - 1
+        self._asegurar_rango(primero, ultimo)
+        destino = slice(primero - self._base, ultimo - self._base + 1)
+        self._sumas[:, destino] += sumas
+        self._conteos[destino] += conteos
+        self._acumular_desde(destino.start, destino.stop)
+
+    def rango(self):
+        """Devuelve el primer y último mes con registros, o None si está vacía."""
+        if self._fin == 0 or self._acumulados[-1, self._fin - 1] == 0:
+            return None
+        # Búsqueda binaria sobre la cantidad acumulada de registros, que no decrece
+        registros = self._acumulados[-1, :self._fin]
+        primero = int(np.searchsorted(registros, 0, side='right'))
+        ultimo = int(np.searchsorted(registros, registros[-1], side='left'))
+        return self._base + primero, self._base + ultimo
+
+    def acumulado(self, columna, meses):
+        """Devuelve la suma en centavos de `columna` desde el principio hasta cada uno de `meses`, inclusive.
+
+        Acepta también los totales de `COLUMNAS_TOTALES`. Cada mes se
+        resuelve con una lectura, sin importar cuántos meses tenga la tabla.
+        """
+        if columna in COLUMNAS_TOTALES:
+            return sum(self.acumulado(c, meses) for c in COLUMNAS_TOTALES[columna])
+        posiciones = np.asarray(meses, dtype=np.int64) - self._base
+        if self._fin == 0:
+            return np.zeros(posiciones.shape, dtype=np.int64)
+        valores = self._acumulados[COLUMNAS_NUMERICAS.index(columna), np.clip(posiciones, 0, self._fin - 1)]
+        return np.where(posiciones < 0, 0, valores)
+
+    def _centavos(self, columna, inicio, fin):
+        if columna in COLUMNAS_TOTALES:
+            return sum(self._centavos(c, inicio, fin) for c in COLUMNAS_TOTALES[columna])
+        return self._sumas[COLUMNAS_NUMERICAS.index(columna), inicio:fin]
+
+    def a_dataframe(self, columnas=COLUMNAS_NUMERICAS):
+        """Devuelve las sumas mensuales en pesos entre el primer y el último mes con datos.
+
+        Acepta también los totales de `COLUMNAS_TOTALES`, sumados en centavos.
+        """
+        rango = self.rango()
+        if rango is None:
+            return pd.DataFrame(columns=columnas, index=pd.DatetimeIndex([], name='fecha'), dtype=np.float64)
+
+        primero, ultimo = rango
+        inicio, fin = primero - self._base, ultimo - self._base + 1
+        datos = {c: a_pesos(self._centavos(c, inicio, fin)) for c in columnas}
+        return pd.DataFrame(datos, index=fin_de_mes(np.arange(primero, ultimo + 1)))
+
+    def agrupar(self, periodo, columnas=COLUMNAS_NUMERICAS):
+        """Consolida los meses en bimestres, trimestres o años sin releer los registros."""
+        if periodo == "Mensual" or self.rango() is None:
+            return self.a_dataframe(columnas)
+
+        primero, ultimo = self.rango()
+        meses = np.arange(primero, ultimo + 1)
+        if periodo == "Bimestral":
+            # Igual que resample('2ME'): el primer mes con datos cierra el primer bimestre
+            grupos = (meses - primero + 1) // 2
+            etiquetas = primero + 2 * np.unique(grupos)
+        elif periodo == "Trimestral":
+            grupos = meses // 3
+            etiquetas = 3 * np.unique(grupos) + 2
+        else:  # Anual
+            grupos = meses // 12
+            etiquetas = 12 * np.unique(grupos) + 11
+
+        inicios = np.flatnonzero(np.r_[True, grupos[1:] != grupos[:-1]])
+        inicio, fin = primero - self._base, ultimo - self._base + 1
+        datos = {
+            c: a_pesos(np.add.reduceat(self._centavos(c, inicio, fin), inicios))
+            for c in columnas
+        }
+        return pd.DataFrame(datos, columns=list(columnas), index=fin_de_mes(etiquetas))
+
+# Arreglos de una instantánea mapeada en memoria, que nunca se modifican
+Base = namedtuple('Base', ['ids', 'fechas', 'entidades', 'bloque'])
+
+# Valores vigentes de filas de la base que se modificaron, ordenados por posición
+Parche = namedtuple('Parche', ['posiciones', 'fechas', 'entidades', 'bloque'])
+
+class AlmacenColumnar:
+    """Almacena los registros en arreglos NumPy por columna con crecimiento amortizado.
+
+    Los montos se guardan en centavos (int64); `filas` y `a_dataframe` los
+    entregan en pesos.
+
+    Un almacén abierto desde una instantánea (`desde_arreglos`) lee sus
+    primeras filas de la base mapeada, que no se copia ni se modifica: las
+    filas nuevas van a una cola de arreglos propios y las filas modificadas
+    de la base, a un parche. Solo esos cambios ocupan memoria del proceso.
+    """
+
+    def __init__(self, capacidad=1024):
+        # Arreglos propios: con base, solo las filas posteriores a ella (la cola)
+        self._ids = np.empty(capacidad, dtype=np.int64)
+        self._fechas = np.empty(capacidad, dtype='datetime64[ns]')
+        self._entidades = np.empty(capacidad, dtype=np.int32)
+        self._bloque = np.empty((len(COLUMNAS_NUMERICAS), capacidad), dtype=np.int64)
+        self._base = None
+        self._nb = 0
+        self._parche = None
+        self._n = 0
+        self._siguiente_id = 1
+        self._df = None
+        # Indica si los arreglos propios se comparten con otra instantánea (ver `copia`)
+        self._compartido = False
+        self.version = next(_versiones)
+        # Las entidades se guardan como códigos que indexan esta lista de nombres
+        self.entidades = []
+        self._codigos = {}
+        self.mensual = AgregadoMensual()
+        self.mensual_por_entidad = {}
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def empty(self):
+        return self._n == 0
+
+    @classmethod
+    def desde_dataframe(cls, df):
+        """Crea un almacén a partir de un DataFrame existente."""
+        almacen = cls(capacidad=max(1024, len(df)))
+        if not df.empty:
+            almacen.agregar(df)
+        return almacen
+
+    @classmethod
+    def desde_arreglos(cls, ids, fechas, entidades, bloque, nombres):
+        """Crea un almacén sobre arreglos existentes sin copiarlos, por ejemplo mapeados en memoria.
+
+        Los arreglos quedan como base de solo lectura: las filas que se
+        agreguen o modifiquen después se guardan aparte.
+        """
+        almacen = cls(capacidad=0)
+        almacen._base = Base(ids, fechas, entidades, bloque)
+        almacen._nb = almacen._n = len(ids)
+        almacen._siguiente_id = int(ids[-1]) + 1 if len(ids) else 1
+        for nombre in nombres:
+            almacen._codigos[nombre] = len(almacen.entidades)
+            almacen.entidades.append(nombre)
+            almacen.mensual_por_entidad[almacen._codigos[nombre]] = AgregadoMensual()
+        almacen._sumar_mensual(
+            meses_de(fechas), entidades, {c: bloque[i] for i, c in enumerate(COLUMNAS_NUMERICAS)}
+        )
+        return almacen
+
+    @property
+    def _cola(self):
+        """Cantidad de filas en los arreglos propios."""
+        return self._n - self._nb
+
+    def _asegurar_capacidad(self, extra):
+        requerida = self._cola + extra
+        capacidad = len(self._fechas)
+        if requerida <= capacidad:
+            return
+
+        capacidad = max(capacidad, 1024)
+        while capacidad < requerida:
+            capacidad *= 2
+
+        cola = self._cola
+        ids = np.empty(capacidad, dtype=np.int64)
+        ids[:cola] = self._ids[:cola]
+        fechas = np.empty(capacidad, dtype='datetime64[ns]')
+        fechas[:cola] = self._fechas[:cola]
+        entidades = np.empty(capacidad, dtype=np.int32)
+        entidades[:cola] = self._entidades[:cola]
+        bloque = np.empty((len(COLUMNAS_NUMERICAS), capacidad), dtype=np.int64)
+        bloque[:, :cola] = self._bloque[:, :cola]
+        self._ids = ids
+        self._fechas = fechas
+        self._entidades = entidades
+        self._bloque = bloque
+        self._compartido = False
+
+    def copia(self):
+        """Devuelve una instantánea que comparte los arreglos de registros con este almacén.
+
+        Sirve para escribir sobre la copia mientras otros hilos siguen leyendo
+        el original sin bloqueos. Las filas nuevas se escriben más allá del
+        tamaño del original, que no las ve; antes de modificar filas de la
+        cola la copia duplica sus arreglos. La base y el parche no se
+        modifican nunca (un cambio crea un parche nuevo), así que se comparten
+        tal cual. Las tablas mensuales y las entidades, que son chicas, se
+        copian siempre.
+        """
+        almacen = copy.copy(self)
+        almacen.entidades = list(self.entidades)
+        almacen._codigos = dict(self._codigos)
+        almacen.mensual = self.mensual.copia()
+        almacen.mensual_por_entidad = {c: m.copia() for c, m in self.mensual_por_entidad.items()}
+        self._compartido = almacen._compartido = True
+        return almacen
+
+    def _separar(self):
+        """Duplica los arreglos propios compartidos con otras instantáneas antes de modificarlos."""
+        if self._compartido:
+            self._fechas = self._fechas.copy()
+            self._entidades = self._entidades.copy()
+            self._bloque = self._bloque.copy()
+            self._compartido = False
+
+    def codificar(self, entidades):
+        """Traduce un Categorical de nombres de entidad a los códigos del almacén."""
+        codigos = np.empty(len(entidades.categories), dtype=np.int32)
+        usadas = np.bincount(entidades.codes, minlength=len(entidades.categories)) > 0
+        for i, nombre in enumerate(entidades.categories):
+            if not usadas[i]:
+                continue
+            if nombre not in self._codigos:
+                self._codigos[nombre] = len(self.entidades)
+                self.entidades.append(nombre)
+                self.mensual_por_entidad[self._codigos[nombre]] = AgregadoMensual()
+            codigos[i] = self._codigos[nombre]
+        return codigos[entidades.codes]
+
+    def codigo(self, entidad):
+        """Devuelve el código de una entidad, o None si no tiene registros."""
+        return self._codigos.get(entidad)
+
+    def _sumar_mensual(self, meses, codigos, valores, signo=1):
+        """Actualiza la tabla mensual consolidada y la de cada entidad del lote.
+
+        Las sumas por entidad y mes salen de un único bincount por columna
+        sobre una clave combinada, sin recorrer las entidades del lote.
+        """
+        self.mensual.sumar(meses, valores, signo)
+        if len(meses) == 0:
+            return
+
+        presentes = np.flatnonzero(np.bincount(codigos))
+        locales = np.zeros(presentes[-1] + 1, dtype=np.int64)
+        locales[presentes] = np.arange(len(presentes))
+        primero = int(meses.min())
+        ancho = int(meses.max()) - primero + 1
+        clave = locales[codigos] * ancho + (meses - primero)
+        celdas = len(presentes) * ancho
+
+        conteos = signo * np.bincount(clave, minlength=celdas).reshape(len(presentes), ancho)
+        sumas = np.stack([
+            signo * sumar_centavos(clave, valores[c], celdas)
+            for c in COLUMNAS_NUMERICAS
+        ]).reshape(len(COLUMNAS_NUMERICAS), len(presentes), ancho)
+        for i, codigo in enumerate(presentes):
+            self.mensual_por_entidad[int(codigo)].acumular(primero, sumas[:, i], conteos[i])
+
+    def _ultimo_id(self):
+        if self._cola:
+            return self._ids[self._cola - 1]
+        return self._base.ids[-1]
+
+    def _anexar(self, lote):
+        cantidad = len(lote.fechas)
+        ids = lote.ids.copy()
+        sin_id = ids == SIN_ID
+        ids[sin_id] = np.arange(self._siguiente_id, self._siguiente_id + sin_id.sum())
+        if cantidad == 0:
+            return ids
+        if (self._n and ids[0] <= self._ultimo_id()) or np.any(np.diff(ids) <= 0):
+            raise ValueError("Los ids de los registros nuevos deben ser crecientes")
+
+        self._asegurar_capacidad(cantidad)
+        inicio, fin = self._cola, self._cola + cantidad
+        codigos = self.codificar(lote.entidades)
+        self._ids[inicio:fin] = ids
+        self._fechas[inicio:fin] = lote.fechas
+        self._entidades[inicio:fin] = codigos
+        for i, columna in enumerate(COLUMNAS_NUMERICAS):
+            self._bloque[i, inicio:fin] = lote.valores[columna]
+
+        self._n += cantidad
+        self._siguiente_id = int(ids[-1]) + 1
+        self._df = None
+        self.version = next(_versiones)
+        self._sumar_mensual(meses_de(lote.fechas), codigos, lote.valores)
+        return ids
+
+    def agregar(self, registros, recalcular=True):
+        """Agrega un lote de registros, calcula sus impuestos una sola vez y devuelve sus ids."""
+        return self._anexar(normalizar_registros(registros, recalcular))
+
+    def posiciones(self, ids):
+        """Ubica las filas de los ids indicados; lanza ValueError si alguno no existe."""
+        ids = np.asarray(ids, dtype=np.int64)
+        posiciones = np.zeros(len(ids), dtype=np.int64)
+        encontrados = np.zeros(len(ids), dtype=bool)
+        # La base y la cola están ordenadas por id: se busca en cada una
+        tramos = [(self._nb, self._ids[:self._cola])]
+        if self._base is not None:
+            tramos.append((0, self._base.ids))
+        for inicio, existentes in tramos:
+            encontradas = np.searchsorted(existentes, ids)
+            en_tramo = encontradas < len(existentes)
+            en_tramo[en_tramo] = existentes[encontradas[en_tramo]] == ids[en_tramo]
+            posiciones[en_tramo] = encontradas[en_tramo] + inicio
+            encontrados |= en_tramo
+        if not encontrados.all():
+            raise ValueError(f"Registros inexistentes: {ids[~encontrados].tolist()}")
+        return posiciones
+
+    def _tomar(self, posiciones):
+        """Devuelve ids, fechas, códigos de entidad y montos (columnas x filas) de las posiciones indicadas."""
+        ids = np.empty(len(posiciones), dtype=np.int64)
+        fechas = np.empty(len(posiciones), dtype='datetime64[ns]')
+        entidades = np.empty(len(posiciones), dtype=np.int32)
+        bloque = np.empty((len(COLUMNAS_NUMERICAS), len(posiciones)), dtype=np.int64)
+        en_cola = posiciones >= self._nb
+        cola = posiciones[en_cola] - self._nb
+        ids[en_cola] = self._ids[cola]
+        fechas[en_cola] = self._fechas[cola]
+        entidades[en_cola] = self._entidades[cola]
+        bloque[:, en_cola] = self._bloque[:, cola]
+        if self._base is not None and not en_cola.all():
+            en_base = ~en_cola
+            base = posiciones[en_base]
+            ids[en_base] = self._base.ids[base]
+            fechas[en_base] = self._base.fechas[base]
+            entidades[en_base] = self._base.entidades[base]
+            bloque[:, en_base] = self._base.bloque[:, base]
+            if self._parche is not None:
+                indices = np.searchsorted(self._parche.posiciones, posiciones)
+                parcheadas = indices < len(self._parche.posiciones)
+                parcheadas[parcheadas] = self._parche.posiciones[indices[parcheadas]] == posiciones[parcheadas]
+                indices = indices[parcheadas]
+                fechas[parcheadas] = self._parche.fechas[indices]
+                entidades[parcheadas] = self._parche.entidades[indices]
+                bloque[:, parcheadas] = self._parche.bloque[:, indices]
+        return ids, fechas, entidades, bloque
+
+    def _parchear(self, posiciones, fechas, entidades, bloque):
+        """Registra valores nuevos para filas de la base en un parche nuevo, sin tocar el anterior."""
+        if self._parche is not None:
+            posiciones = np.concatenate([self._parche.posiciones, posiciones])
+            fechas = np.concatenate([self._parche.fechas, fechas])
+            entidades = np.concatenate([self._parche.entidades, entidades])
+            bloque = np.concatenate([self._parche.bloque, bloque], axis=1)
+        # Por posición queda el último valor; unique devuelve las posiciones ordenadas
+        _, desde_el_final = np.unique(posiciones[::-1], return_index=True)
+        ultimos = len(posiciones) - 1 - desde_el_final
+        self._parche = Parche(posiciones[ultimos], fechas[ultimos], entidades[ultimos], bloque[:, ultimos])
+
+    def aplicar_cambios(self, registros, recalcular=True):
+        """Reemplaza los registros con id existente y agrega los nuevos.
+
+        Devuelve los ids de todo el lote y las claves de las particiones
+        (entidad y mes, ver `clave_particion`) cuyos datos cambiaron.
+        """
+        lote = normalizar_registros(registros, recalcular)
+        modificados = lote.ids != SIN_ID
+        ids_modificados = lote.ids[modificados]
+        if len(np.unique(ids_modificados)) != len(ids_modificados):
+            raise ValueError("El lote repite ids de registros")
+
+        posiciones = self.posiciones(ids_modificados)
+        _, fechas_previas, codigos_previos, bloque_previo = self._tomar(posiciones)
+        meses_previos = meses_de(fechas_previas)
+        codigos_nuevos = self.codificar(lote.entidades[modificados])
+        meses_nuevos = meses_de(lote.fechas[modificados])
+        if len(posiciones):
+            self._sumar_mensual(
+                meses_previos,
+                codigos_previos,
+                {c: bloque_previo[i] for i, c in enumerate(COLUMNAS_NUMERICAS)},
+                signo=-1
+            )
+            fechas = lote.fechas[modificados]
+            bloque = np.stack([lote.valores[c][modificados] for c in COLUMNAS_NUMERICAS])
+            en_cola = posiciones >= self._nb
+            if en_cola.any():
+                self._separar()
+                cola = posiciones[en_cola] - self._nb
+                self._fechas[cola] = fechas[en_cola]
+                self._entidades[cola] = codigos_nuevos[en_cola]
+                self._bloque[:, cola] = bloque[:, en_cola]
+            if not en_cola.all():
+                en_base = ~en_cola
+                self._parchear(posiciones[en_base], fechas[en_base], codigos_nuevos[en_base], bloque[:, en_base])
+            self._sumar_mensual(
+                meses_nuevos,
+                codigos_nuevos,
+                {c: v[modificados] for c, v in lote.valores.items()}
+            )
+            self._df = None
+            self.version = next(_versiones)
+
+        nuevos = Lote(
+            lote.fechas[~modificados],
+            {c: v[~modificados] for c, v in lote.valores.items()},
+            lote.ids[~modificados],
+            lote.entidades[~modificados]
+        )
+        ids = lote.ids.copy()
+        ids[~modificados] = self._anexar(nuevos)
+        particiones = np.union1d(
+            clave_particion(codigos_previos, meses_previos),
+            clave_particion(codigos_nuevos, meses_nuevos)
+        )
+        return ids, particiones
+
+    def _unir(self, base, cola, parche=None):
+        """Une la base y la cola de una columna (o del bloque) con el parche aplicado.
+
+        Sin base devuelve la cola, y sin cola ni parche la base tal cual,
+        sin copiarla; en los demás casos arma una copia temporal.
+        """
+        if self._base is None:
+            return cola
+        if cola.shape[-1] == 0 and (parche is None or self._parche is None):
+            return base
+        resultado = np.concatenate([base, cola], axis=-1)
+        if parche is not None and self._parche is not None:
+            resultado[..., self._parche.posiciones] = parche
+        return resultado
+
+    def columna(self, nombre):
+        """Devuelve una columna de solo lectura; los montos, en centavos.
+
+        Es una vista de los arreglos, salvo que haya filas nuevas o
+        modificadas sobre una base mapeada: entonces es una copia temporal.
+        """
+        base, parche = self._base, self._parche
+        cola = self._cola
+        if nombre == 'id':
+            vista = self._unir(base and base.ids, self._ids[:cola])
+        elif nombre == 'fecha':
+            vista = self._unir(base and base.fechas, self._fechas[:cola], parche and parche.fechas)
+        elif nombre == 'entidad':
+            vista = self._unir(base and base.entidades, self._entidades[:cola], parche and parche.entidades)
+        else:
+            i = COLUMNAS_NUMERICAS.index(nombre)
+            vista = self._unir(base and base.bloque[i], self._bloque[i, :cola], parche and parche.bloque[i])
+        vista = vista.view()
+        vista.flags.writeable = False
+        return vista
+
+    def bloque(self, entidad=None):
+        """Devuelve las columnas numéricas en centavos como un bloque (columnas x filas) de solo lectura.
+
+        Con `entidad` devuelve una copia con solo las filas de esa entidad.
+        """
+        if entidad is not None:
+            codigo = self.codigo(entidad)
+            if codigo is None:
+                return np.empty((len(COLUMNAS_NUMERICAS), 0), dtype=np.int64)
+            return self.bloque()[:, self.columna('entidad') == codigo]
+        vista = self._unir(
+            self._base and self._base.bloque, self._bloque[:, :self._cola], self._parche and self._parche.bloque
+        ).view()
+        vista.flags.writeable = False
+        return vista
+
+    def filas(self, posiciones=slice(None)):
+        """Devuelve las filas indicadas (todas por defecto) como DataFrame con su id, entidad y montos en pesos."""
+        if isinstance(posiciones, slice):
+            ids, fechas, entidades = (self.columna(nombre)[posiciones] for nombre in ['id', 'fecha', 'entidad'])
+            bloque = self.bloque()[:, posiciones]
+        else:
+            ids, fechas, entidades, bloque = self._tomar(np.arange(self._n)[posiciones])
+        datos = {
+            'id': ids,
+            'entidad': pd.Categorical.from_codes(entidades, categories=list(self.entidades)),
+            'fecha': fechas
+        }
+        for i, columna in enumerate(COLUMNAS_NUMERICAS):
+            datos[columna] = a_pesos(bloque[i])
+        return pd.DataFrame(datos, columns=['id', 'entidad'] + COLUMNAS)
+
+    def a_dataframe(self):
+        """Materializa el almacén como DataFrame, reutilizándolo hasta la próxima escritura."""
+        if self._df is None:
+            self._df = self.filas()
+        return self._df
+
+def como_dataframe(df):
+    """Devuelve un DataFrame tanto para almacenes columnares como para DataFrames."""
+    if isinstance(df, AlmacenColumnar):
+        return df.a_dataframe()
+    return df
+
+def agregar_registros(df, registros):
+    """Agrega un lote de registros financieros calculando los impuestos en bloque."""
+    if isinstance(df, AlmacenColumnar):
+        df.agregar(registros)
+        return df
+
+    lote = normalizar_registros(registros)
+    lote = pd.DataFrame(
+        {'entidad': lote.entidades, 'fecha': lote.fechas, **{c: a_pesos(v) for c, v in lote.valores.items()}},
+        columns=['entidad'] + COLUMNAS
+    )
+    if df.empty:
+        return lote
+    return pd.concat([df, lote], ignore_index=True)
 
 def agregar_registro(df, fecha, datos):
     """Agrega un nuevo registro financiero al DataFrame."""
-    datos['fecha'] = fecha
-    datos['iva_debito'] = datos['facturacion_a'] * 0.21 + datos['facturacion_b'] * 0.21
-    datos['iva_credito'] = datos['gastos_operativos'] * 0.21
-    datos['iva_total'] = datos['iva_debito'] - datos['iva_credito']
-
-    datos['ingresos_brutos'] = (datos['facturacion_a'] + datos['facturacion_b'] + datos['facturacion_c']) * 0.035
-
-    datos['utilidad'] = (
-        datos['facturacion_a'] + datos['facturacion_b'] + datos['facturacion_c']
-        - datos['gastos_operativos']
-        - datos['otros_gastos']
-        - datos['iva_total']
-        - datos['ingresos_brutos']
-        - datos['retenciones']
-    )
+    registro = dict(datos)
+    registro['fecha'] = fecha
+    return agregar_registros(df, [registro])
 
-    nuevo_registro = pd.DataFrame([datos])
-    return pd.concat([df, nuevo_registro], ignore_index=True)
+def filtrar_entidad(df, entidad):
+    """Devuelve solo las filas de un DataFrame que pertenecen a la entidad indicada."""
+    if entidad is None:
+        return df
+    if 'entidad' not in df:
+        return df if entidad == ENTIDAD_PREDETERMINADA else df.iloc[0:0]
+    return df[np.asarray(normalizar_entidades(df['entidad'], len(df)) == entidad)]
 
-def agrupar_por_periodo(df, periodo):
+def agregado_mensual(df, entidad=None):
+    """Obtiene la tabla mensual materializada de un almacén o la construye para un DataFrame."""
+    if isinstance(df, AlmacenColumnar):
+        if entidad is None:
+            return df.mensual
+        codigo = df.codigo(entidad)
+        return df.mensual_por_entidad[codigo] if codigo is not None else AgregadoMensual()
+    return AgregadoMensual.desde_dataframe(filtrar_entidad(df, entidad))
+
+def agrupar_por_periodo(df, periodo, entidad=None):
     """Agrupa los datos según el período seleccionado."""
-    df = df.copy()
-    df['fecha'] = pd.to_datetime(df['fecha'])
-
-    if periodo == "Mensual":
-        return df.set_index('fecha').resample('ME').sum()
-    elif periodo == "Bimestral":
-        return df.set_index('fecha').resample('2ME').sum()
-    elif periodo == "Trimestral":
-        return df.set_index('fecha').resample('QE').sum()
-    else:  # Anual
-        return df.set_index('fecha').resample('YE').sum()
-
-def analisis_mensual(df):
-    """Realiza un análisis detallado mensual."""
-    df = df.copy()
-    df['fecha'] = pd.to_datetime(df['fecha'])
-    df_mensual = df.set_index('fecha').resample('ME').agg({
-        'facturacion_a': 'sum',
-        'facturacion_b': 'sum',
-        'facturacion_c': 'sum',
-        'gastos_operativos': 'sum',
-        'otros_gastos': 'sum',
-        'retenciones': 'sum',
-        'iva_total': 'sum',
-        'ingresos_brutos': 'sum',
-        'utilidad': 'sum'
-    })
-
-    # Calcular totales y promedios mensuales
-    df_mensual['facturacion_total'] = df_mensual['facturacion_a'] + df_mensual['facturacion_b'] + df_mensual['facturacion_c']
-    df_mensual['gastos_totales'] = df_mensual['gastos_operativos'] + df_mensual['otros_gastos']
-    df_mensual['impuestos_totales'] = df_mensual['iva_total'] + df_mensual['ingresos_brutos'] + df_mensual['retenciones']
-
-    return df_mensual
-
-def calcular_estadisticas(df):
-    """Calcula estadísticas básicas de los datos financieros."""
-    return {
-        'facturacion_total': df[['facturacion_a', 'facturacion_b', 'facturacion_c']].sum().sum(),
-        'gastos_totales': df['gastos_operativos'].sum() + df['otros_gastos'].sum(),
-        'impuestos_totales': df['iva_total'].sum() + df['ingresos_brutos'].sum() + df['retenciones'].sum(),
-        'utilidad_total': df['utilidad'].sum(),
-        'promedio_facturacion': df[['facturacion_a', 'facturacion_b', 'facturacion_c']].sum(axis=1).mean(),
-        'promedio_gastos': (df['gastos_operativos'] + df['otros_gastos']).mean()
-    }
\ No newline at end of file
+    return agregado_mensual(df, entidad).agrupar(periodo)
+
+def analisis_mensual(df, entidad=None):
+    """Realiza un análisis detallado mensual, de todas las entidades o de una sola."""
+    with metricas.etapa('analisis_mensual.agregado'):
+        agregado = agregado_mensual(df, entidad)
+    # Los totales se suman en centavos, antes de pasar a pesos
+    with metricas.etapa('analisis_mensual.tabla'):
+        return agregado.a_dataframe([
+            'facturacion_a', 'facturacion_b', 'facturacion_c',
+            'gastos_operativos', 'otros_gastos', 'retenciones',
+            'iva_total', 'ingresos_brutos', 'utilidad'
+        ] + list(COLUMNAS_TOTALES))
+
+_INDICE = {columna: i for i, columna in enumerate(COLUMNAS_NUMERICAS)}
+
+def _flotante(valor):
+    """Convierte a float dejando None en lugar de NaN para que sea serializable."""
+    return None if np.isnan(valor) else float(valor)
+
+class EstadisticasParciales:
+    """Resumen combinable de las columnas numéricas de un conjunto de registros.
+
+    Guarda conteo, sumas, mínimos, máximos y la suma de desvíos al cuadrado por
+    columna, de modo que los resultados de distintas particiones se pueden unir
+    con `combinar` sin volver a leer los registros. Todo se lleva en centavos,
+    con sumas enteras exactas, y se pasa a pesos en los resultados.
+    """
+
+    def __init__(self, n, sumas, minimos, maximos, m2):
+        self.n = n
+        self.sumas = sumas
+        self.minimos = minimos
+        self.maximos = maximos
+        self.m2 = m2
+
+    @classmethod
+    def desde_bloque(cls, bloque):
+        """Calcula el resumen de un bloque (columnas x filas) con reducciones sobre todas las columnas a la vez."""
+        n = bloque.shape[1]
+        columnas = bloque.shape[0]
+        if n == 0:
+            vacio = np.full(columnas, np.nan)
+            return cls(0, np.zeros(columnas, dtype=np.int64), vacio, vacio.copy(), np.zeros(columnas))
+
+        sumas = bloque.sum(axis=1)
+        desvios = bloque - (sumas / n)[:, None]
+        return cls(
+            n,
+            sumas,
+            bloque.min(axis=1),
+            bloque.max(axis=1),
+            np.einsum('ij,ij->i', desvios, desvios)
+        )
+
+    def combinar(self, otra):
+        """Une dos resúmenes parciales como si se hubieran calculado juntos."""
+        if self.n == 0:
+            return otra
+        if otra.n == 0:
+            return self
+
+        n = self.n + otra.n
+        delta = otra.sumas / otra.n - self.sumas / self.n
+        return EstadisticasParciales(
+            n,
+            self.sumas + otra.sumas,
+            np.fmin(self.minimos, otra.minimos),
+            np.fmax(self.maximos, otra.maximos),
+            self.m2 + otra.m2 + delta ** 2 * self.n * otra.n / n
+        )
+
+    def suma(self, *columnas):
+        return float(a_pesos(sum(int(self.sumas[_INDICE[c]]) for c in columnas)))
+
+    def resumen(self):
+        """Devuelve los totales y promedios generales."""
+        n = self.n if self.n else np.nan
+        return {
+            'facturacion_total': self.suma('facturacion_a', 'facturacion_b', 'facturacion_c'),
+            'gastos_totales': self.suma('gastos_operativos', 'otros_gastos'),
+            'impuestos_totales': self.suma('iva_total', 'ingresos_brutos', 'retenciones'),
+            'utilidad_total': self.suma('utilidad'),
+            # Sin registros no hay promedio: None en lugar de NaN
+            'promedio_facturacion': _flotante(self.suma('facturacion_a', 'facturacion_b', 'facturacion_c') / n),
+            'promedio_gastos': _flotante(self.suma('gastos_operativos', 'otros_gastos') / n)
+        }
+
+    def categorias(self):
+        """Devuelve los totales agrupados por categoría."""
+        return {
+            'facturacion': {
+                'A': self.suma('facturacion_a'),
+                'B': self.suma('facturacion_b'),
+                'C': self.suma('facturacion_c')
+            },
+            'gastos': {
+                'operativos': self.suma('gastos_operativos'),
+                'otros': self.suma('otros_gastos')
+            },
+            'impuestos': {
+                'iva': self.suma('iva_total'),
+                'ingresos_brutos': self.suma('ingresos_brutos'),
+                'retenciones': self.suma('retenciones')
+            }
+        }
+
+    def detalle(self):
+        """Devuelve mínimo, máximo, media y desvío estándar de cada columna."""
+        medias = a_pesos(self.sumas / self.n) if self.n else np.full(len(self.sumas), np.nan)
+        desvios = a_pesos(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else np.full(len(self.sumas), np.nan)
+        minimos, maximos = a_pesos(self.minimos), a_pesos(self.maximos)
+        return {
+            columna: {
+                'minimo': _flotante(minimos[i]),
+                'maximo': _flotante(maximos[i]),
+                'media': _flotante(medias[i]),
+                'desvio': _flotante(desvios[i])
+            }
+            for i, columna in enumerate(COLUMNAS_NUMERICAS)
+        }
+
+def bloque_numerico(df, entidad=None):
+    """Obtiene las columnas numéricas en centavos como un único bloque contiguo (columnas x filas)."""
+    if isinstance(df, AlmacenColumnar):
+        return df.bloque(entidad)
+    return np.ascontiguousarray(a_centavos(
+        filtrar_entidad(df, entidad).reindex(columns=COLUMNAS_NUMERICAS).to_numpy(dtype=np.float64, na_value=0.0).T
+    ))
+
+def estadisticas_parciales(df, entidad=None):
+    """Calcula el resumen combinable de un DataFrame o almacén."""
+    return EstadisticasParciales.desde_bloque(bloque_numerico(df, entidad))
+
+def calcular_estadisticas(df, detalle=False, percentiles=None, entidad=None):
+    """Calcula estadísticas básicas de los datos financieros.
+
+    Con `detalle` agrega mínimo, máximo, media y desvío por columna, y con
+    `percentiles` (por ejemplo [50, 90]) los percentiles pedidos. Los percentiles
+    no se pueden combinar entre particiones, por eso se calculan aparte.
+    """
+    with metricas.etapa('estadisticas.bloque'):
+        bloque = bloque_numerico(df, entidad)
+    with metricas.etapa('estadisticas.resumen'):
+        parciales = EstadisticasParciales.desde_bloque(bloque)
+        estadisticas = parciales.resumen()
+
+    if detalle or percentiles:
+        estadisticas['detalle'] = parciales.detalle()
+    if percentiles and bloque.shape[1]:
+        with metricas.etapa('estadisticas.percentiles'):
+            valores = a_pesos(np.percentile(bloque, percentiles, axis=1))
+        for i, columna in enumerate(COLUMNAS_NUMERICAS):
+            for j, percentil in enumerate(percentiles):
+                estadisticas['detalle'][columna][f'p{percentil:g}'] = _flotante(valores[j, i])
+
+    return estadisticas
+
+def calcular_categorias(df, entidad=None):
+    """Calcula los totales por categoría en una sola pasada sobre los datos."""
+    return estadisticas_parciales(df, entidad).categorias()
+
+# Almacenamiento persistente en Parquet particionado por entidad, año y mes
+
+PARTICIONES = ds.partitioning(
+    pa.schema([('entidad', pa.string()), ('anio', pa.int16()), ('mes', pa.int8())]),
+    flavor='hive'
+)
+
+ESQUEMA = pa.schema(
+    [('id', pa.int64()), ('entidad', pa.string()), ('fecha', pa.timestamp('ns'))]
+    + [(columna, pa.float64()) for columna in COLUMNAS_NUMERICAS]
+)
+
+ESQUEMA_PARTICIONADO = pa.unify_schemas([ESQUEMA, PARTICIONES.schema])
+
+ARCHIVO_SINCRONIZACION = '_sincronizacion.json'
+
+# Registro de los archivos escritos, para que otros procesos lean solo lo nuevo
+ARCHIVO_CAMBIOS = '_cambios.jsonl'
+
+# Copia del almacén en arreglos .npy que todos los procesos mapean en memoria
+ARCHIVO_INSTANTANEA = '_instantanea.json'
+PREFIJO_INSTANTANEA = '_instantanea-'
+
+# Diario de escritura anticipada: los lotes chicos se confirman agregándolos
+# a este archivo, con un solo fsync por grupo de lotes, y pasan a Parquet al volcarlo
+ARCHIVO_DIARIO = '_diario.arrow'
+# El diario empieza con su identificador y cada entrada con su largo y su CRC32
+LARGO_IDENTIFICADOR_DIARIO = 32
+_ENCABEZADO_ENTRADA = struct.Struct('<QI')
+
+# Marca que todas las filas guardadas tienen su id (ver `completar_ids`)
+ARCHIVO_IDS = '_ids_completos'
+
+def _tabla(registros, recalcular):
+    lote = normalizar_registros(registros, recalcular)
+    return pa.Table.from_arrays(
+        [pa.array(lote.ids), pa.array(lote.entidades).cast(pa.string()), pa.array(lote.fechas)]
+        + [pa.array(a_pesos(lote.valores[c])) for c in COLUMNAS_NUMERICAS],
+        schema=ESQUEMA
+    )
+
+def _tabla_particionada(registros, recalcular):
+    tabla = _tabla(registros, recalcular)
+    indice = pd.DatetimeIndex(tabla.column('fecha').to_numpy())
+    return (
+        tabla
+        .append_column('anio', pa.array(indice.year, pa.int16()))
+        .append_column('mes', pa.array(indice.month, pa.int8()))
+    )
+
+def guardar_registros(registros, directorio=DIRECTORIO_DATOS, recalcular=True):
+    """Agrega un lote de registros (con sus ids) como nuevos archivos Parquet en sus particiones.
+
+    Devuelve las rutas de los archivos escritos, relativas a `directorio`.
+    """
+    tabla = _tabla_particionada(registros, recalcular)
+    if tabla.num_rows == 0:
+        return []
+
+    # Con muchas entidades un lote toca miles de particiones: ordenado por
+    # partición, cada una se escribe de corrido en un solo archivo
+    tabla = tabla.sort_by([('entidad', 'ascending'), ('anio', 'ascending'), ('mes', 'ascending')])
+    escritos = []
+    ds.write_dataset(
+        tabla,
+        directorio,
+        format='parquet',
+        partitioning=PARTICIONES,
+        basename_template=f'parte-{uuid.uuid4().hex}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+        max_partitions=max(1024, tabla.num_rows),
+        file_visitor=lambda archivo: escritos.append(os.path.relpath(archivo.path, directorio))
+    )
+    return escritos
+
+def _directorio_entidad(directorio, entidad):
+    # Mismo escape que usa pyarrow para los valores de particiones hive
+    return os.path.join(directorio, f"entidad={quote(entidad, safe='')}")
+
+def _directorio_particion(directorio, entidad, mes):
+    anio, numero = divmod(int(mes), 12)
+    return os.path.join(_directorio_entidad(directorio, entidad), f'anio={anio + 1970}', f'mes={numero + 1}')
+
+def reescribir_particiones(almacen, claves, directorio=DIRECTORIO_DATOS):
+    """Reescribe por completo las particiones (entidad y mes) indicadas desde el almacén.
+
+    Los archivos nuevos se escriben antes de borrar los anteriores: si se
+    corta en el medio quedan filas repetidas, que la carga descarta, pero
+    no se pierde ninguna.
+    """
+    claves = np.unique(claves)
+    if len(claves) == 0:
+        return []
+
+    claves_filas = clave_particion(almacen.columna('entidad'), meses_de(almacen.columna('fecha')))
+    escritos = guardar_registros(almacen.filas(np.isin(claves_filas, claves)), directorio, recalcular=False)
+    nuevos = {os.path.normpath(os.path.join(directorio, archivo)) for archivo in escritos}
+    for clave in claves:
+        codigo, mes = separar_clave(clave)
+        particion = _directorio_particion(directorio, almacen.entidades[codigo], mes)
+        if not os.path.isdir(particion):
+            continue
+        for nombre in os.listdir(particion):
+            ruta = os.path.normpath(os.path.join(particion, nombre))
+            if ruta not in nuevos:
+                os.remove(ruta)
+        if not os.listdir(particion):
+            os.rmdir(particion)
+    return escritos
+
+def _con_ids(registros):
+    """Asigna ids, a continuación del mayor, a los registros que no tienen."""
+    lote = registros if isinstance(registros, pd.DataFrame) else pd.DataFrame(registros)
+    if 'id' in lote:
+        ids = lote['id'].to_numpy(dtype=np.int64, na_value=SIN_ID)
+    else:
+        ids = np.full(len(lote), SIN_ID, dtype=np.int64)
+    sin_id = ids == SIN_ID
+    if not sin_id.any():
+        return lote
+    ids = ids.copy()
+    ids[sin_id] = np.arange(ids.max() + 1, ids.max() + 1 + sin_id.sum())
+    return lote.assign(id=ids)
+
+def reemplazar_registros(registros, directorio=DIRECTORIO_DATOS, recalcular=True, secuencia=None):
+    """Reemplaza todos los datos guardados por el lote indicado.
+
+    Si se indica `secuencia`, queda guardada junto con los datos nuevos.
+    """
+    temporal = f'{directorio}.tmp-{uuid.uuid4().hex}'
+    os.makedirs(temporal)
+    # Con sus ids en los archivos, las lecturas directas pueden superponerles el diario
+    guardar_registros(_con_ids(registros), temporal, recalcular)
+    open(os.path.join(temporal, ARCHIVO_IDS), 'w').close()
+    if secuencia is not None:
+        guardar_secuencia(secuencia, temporal)
+    # Una generación nueva indica a los demás procesos que deben recargar todo
+    iniciar_cambios(temporal)
+    # Los datos anteriores se apartan y se borran recién después del cambio;
+    # si se corta entre los dos renombres, `recuperar_reemplazo` los restituye
+    anterior = f'{directorio}.anterior-{uuid.uuid4().hex}'
+    # Las reglas de impuestos se guardan en la carpeta de datos y no son parte del reemplazo
+    reglas = os.path.join(directorio, impuestos.NOMBRE_ARCHIVO_REGLAS)
+    if os.path.exists(reglas):
+        shutil.copy2(reglas, temporal)
+    if os.path.isdir(directorio):
+        os.replace(directorio, anterior)
+    os.replace(temporal, directorio)
+    _sincronizar_directorio(os.path.dirname(os.path.abspath(directorio)))
+    if os.path.isdir(anterior):
+        shutil.rmtree(anterior)
+
+def recuperar_reemplazo(directorio=DIRECTORIO_DATOS):
+    """Deja la carpeta como antes de un `reemplazar_registros` interrumpido y borra sus restos.
+
+    Si la carpeta de datos falta, el reemplazo se cortó después de apartar
+    los datos anteriores: se vuelven a poner, porque el reemplazo nunca se
+    confirmó. Las carpetas temporales y apartadas que quedan se borran.
+    """
+    padre = os.path.dirname(os.path.abspath(directorio))
+    nombre = os.path.basename(os.path.normpath(directorio))
+    if not os.path.isdir(padre):
+        return
+    apartadas = [c for c in os.listdir(padre) if c.startswith(f'{nombre}.anterior-')]
+    if not os.path.isdir(directorio) and apartadas:
+        os.replace(os.path.join(padre, apartadas.pop()), directorio)
+    for carpeta in os.listdir(padre):
+        if carpeta.startswith((f'{nombre}.anterior-', f'{nombre}.tmp-')):
+            shutil.rmtree(os.path.join(padre, carpeta), ignore_errors=True)
+
+def leer_secuencia(directorio=DIRECTORIO_DATOS):
+    """Devuelve el último número de secuencia de sincronización aplicado.
+
+    Los lotes con secuencia se confirman en el diario junto con ella (ver
+    `anotar_diario`), así que también se busca ahí.
+    """
+    try:
+        with open(os.path.join(directorio, ARCHIVO_SINCRONIZACION), encoding='utf-8') as archivo:
+            secuencia = json.load(archivo)['secuencia']
+    except FileNotFoundError:
+        secuencia = 0
+    return max(secuencia, secuencia_diario(directorio) or 0)
+
+def guardar_secuencia(secuencia, directorio=DIRECTORIO_DATOS):
+    """Registra de forma atómica y en el disco el último número de secuencia aplicado."""
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, ARCHIVO_SINCRONIZACION)
+    with open(ruta + '.tmp', 'w', encoding='utf-8') as archivo:
+        json.dump({'secuencia': secuencia}, archivo)
+        archivo.flush()
+        os.fsync(archivo.fileno())
+    os.replace(ruta + '.tmp', ruta)
+    _sincronizar_directorio(directorio)
+
+def iniciar_cambios(directorio=DIRECTORIO_DATOS):
+    """Crea un registro de cambios vacío con un identificador de generación nuevo."""
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, ARCHIVO_CAMBIOS)
+    with open(ruta + '.tmp', 'w', encoding='utf-8') as archivo:
+        archivo.write(json.dumps({'generacion': uuid.uuid4().hex}) + '\n')
+    os.replace(ruta + '.tmp', ruta)
+
+def anotar_cambio(archivos, directorio=DIRECTORIO_DATOS, sincronizar=False):
+    """Agrega al registro de cambios los archivos recién escritos.
+
+    Con `sincronizar` la línea llega al disco (fsync) antes de volver.
+    """
+    ruta = os.path.join(directorio, ARCHIVO_CAMBIOS)
+    if not os.path.exists(ruta):
+        iniciar_cambios(directorio)
+    with open(ruta, 'a', encoding='utf-8') as archivo:
+        archivo.write(json.dumps({'archivos': archivos}) + '\n')
+        if sincronizar:
+            archivo.flush()
+            os.fsync(archivo.fileno())
+
+def leer_cambios(directorio=DIRECTORIO_DATOS, posicion=0):
+    """Lee el registro de cambios a partir del byte `posicion`.
+
+    Devuelve la generación, los archivos anotados desde esa posición y la
+    posición siguiente a la última línea completa.
+    """
+    try:
+        with open(os.path.join(directorio, ARCHIVO_CAMBIOS), 'rb') as archivo:
+            generacion = json.loads(archivo.readline())['generacion']
+            inicio = max(posicion, archivo.tell())
+            archivo.seek(inicio)
+            contenido = archivo.read()
+    except FileNotFoundError:
+        return None, [], 0
+
+    # Una línea sin salto final todavía se está escribiendo
+    completo = contenido[:contenido.rfind(b'\n') + 1]
+    archivos = []
+    for linea in completo.splitlines():
+        archivos.extend(json.loads(linea)['archivos'])
+    return generacion, archivos, inicio + len(completo)
+
+def registrar(almacen, registros, directorio=DIRECTORIO_DATOS):
+    """Aplica un lote de altas y modificaciones al almacén y lo persiste.
+
+    Los registros nuevos se agregan como archivos Parquet y las particiones
+    con registros modificados se reescriben. Devuelve los ids del lote.
+    """
+    cantidad_previa = len(almacen)
+    ids, particiones_modificadas = almacen.aplicar_cambios(registros)
+
+    nuevos = almacen.filas(slice(cantidad_previa, None))
+    claves_nuevas = clave_particion(
+        almacen.columna('entidad')[cantidad_previa:], meses_de(nuevos['fecha'].to_numpy())
+    )
+    en_particiones_modificadas = np.isin(claves_nuevas, particiones_modificadas)
+    escritos = guardar_registros(nuevos[~en_particiones_modificadas], directorio, recalcular=False)
+    escritos += reescribir_particiones(almacen, particiones_modificadas, directorio)
+    if escritos:
+        anotar_cambio(escritos, directorio)
+    return ids
+
+def _sincronizar_archivos(archivos, directorio):
+    """Hace fsync de los archivos indicados (rutas relativas a `directorio`)."""
+    for archivo in archivos:
+        with open(os.path.join(directorio, archivo), 'ab') as abierto:
+            os.fsync(abierto.fileno())
+
+def _sincronizar_directorio(directorio):
+    # Para que sobreviva el nombre de un archivo recién creado; en Windows no hace falta ni se puede
+    if os.name == 'nt':
+        return
+    descriptor = os.open(directorio, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+def iniciar_diario(directorio=DIRECTORIO_DATOS):
+    """Crea un diario vacío con un identificador nuevo, que reemplaza al anterior, y devuelve el identificador."""
+    os.makedirs(directorio, exist_ok=True)
+    identificador = uuid.uuid4().hex
+    ruta = os.path.join(directorio, ARCHIVO_DIARIO)
+    with open(ruta + '.tmp', 'wb') as archivo:
+        archivo.write(identificador.encode('ascii'))
+        archivo.flush()
+        os.fsync(archivo.fileno())
+    os.replace(ruta + '.tmp', ruta)
+    _sincronizar_directorio(directorio)
+    return identificador
+
+def anotar_diario(almacen, ids, particiones, posicion, directorio=DIRECTORIO_DATOS, secuencia=None):
+    """Agrega al diario el estado actual de los registros `ids` con una escritura y un fsync.
+
+    `particiones` son las claves que cambiaron además de las de esos
+    registros, por ejemplo la de origen de un registro que cambió de mes.
+    `posicion` es el final de la última entrada válida (ver `leer_diario`):
+    lo que siga, restos de una escritura interrumpida, se descarta. La
+    `secuencia` de sincronización, si hay, va en la misma entrada: queda
+    confirmada junto con los registros o no queda. Devuelve la posición
+    siguiente a la entrada.
+    """
+    posiciones = almacen.posiciones(np.unique(ids))
+    claves = np.union1d(
+        particiones,
+        clave_particion(almacen.columna('entidad')[posiciones], meses_de(almacen.columna('fecha')[posiciones]))
+    )
+    # Las particiones van por nombre de entidad: los códigos son propios de cada almacén
+    nombres = [[almacen.entidades[codigo], mes] for codigo, mes in map(separar_clave, claves)]
+    tabla = _tabla(almacen.filas(posiciones), recalcular=False)
+    metadatos = {'particiones': json.dumps(nombres)}
+    if secuencia is not None:
+        metadatos['secuencia'] = json.dumps(secuencia)
+    tabla = tabla.replace_schema_metadata(metadatos)
+    salida = pa.BufferOutputStream()
+    with pa.ipc.new_stream(salida, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+    cuerpo = salida.getvalue().to_pybytes()
+
+    with metricas.etapa('diario.anotar'):
+        with open(os.path.join(directorio, ARCHIVO_DIARIO), 'r+b') as archivo:
+            archivo.seek(posicion)
+            archivo.truncate()
+            archivo.write(_ENCABEZADO_ENTRADA.pack(len(cuerpo), zlib.crc32(cuerpo)) + cuerpo)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+    return posicion + _ENCABEZADO_ENTRADA.size + len(cuerpo)
+
+def leer_diario(directorio=DIRECTORIO_DATOS, posicion=0, identificador=None):
+    """Lee las entradas completas del diario a partir del byte `posicion`.
+
+    Si el diario ya no es el de `identificador` (se volcó y empezó otro) se
+    lee desde el principio. Devuelve el identificador, las filas como
+    DataFrame, las particiones que tocan como pares (entidad, mes) y la
+    posición siguiente a la última entrada válida. Una entrada cortada o con
+    otro CRC, de una escritura interrumpida, marca el final del diario.
+    """
+    actual, tabla, particiones, posicion = _leer_entradas_diario(directorio, posicion, identificador)
+    filas = tabla.set_column(1, 'entidad', tabla.column(1).dictionary_encode()).to_pandas()
+    return actual, filas, particiones, posicion
+
+def _entradas_diario(directorio, posicion, identificador):
+    """Devuelve el identificador del diario, los cuerpos de sus entradas válidas desde `posicion` y la posición final."""
+    try:
+        with open(os.path.join(directorio, ARCHIVO_DIARIO), 'rb') as archivo:
+            actual = archivo.read(LARGO_IDENTIFICADOR_DIARIO).decode('ascii')
+            inicio = max(posicion if actual == identificador else 0, LARGO_IDENTIFICADOR_DIARIO)
+            archivo.seek(inicio)
+            contenido = memoryview(archivo.read())
+    except FileNotFoundError:
+        return None, [], 0
+
+    cuerpos = []
+    leido = 0
+    while len(contenido) - leido >= _ENCABEZADO_ENTRADA.size:
+        largo, crc = _ENCABEZADO_ENTRADA.unpack_from(contenido, leido)
+        cuerpo = contenido[leido + _ENCABEZADO_ENTRADA.size:leido + _ENCABEZADO_ENTRADA.size + largo]
+        if len(cuerpo) < largo or zlib.crc32(cuerpo) != crc:
+            break
+        cuerpos.append(pa.py_buffer(cuerpo))
+        leido += _ENCABEZADO_ENTRADA.size + largo
+    return actual, cuerpos, inicio + leido
+
+def _leer_entradas_diario(directorio, posicion, identificador):
+    actual, cuerpos, posicion = _entradas_diario(directorio, posicion, identificador)
+    tablas = []
+    particiones = []
+    for cuerpo in cuerpos:
+        tabla = pa.ipc.open_stream(cuerpo).read_all()
+        particiones.extend(json.loads(tabla.schema.metadata[b'particiones']))
+        tablas.append(tabla.replace_schema_metadata(None))
+    tabla = pa.concat_tables(tablas) if tablas else ESQUEMA.empty_table()
+    return actual, tabla, particiones, posicion
+
+def secuencia_diario(directorio=DIRECTORIO_DATOS):
+    """Devuelve la última secuencia de sincronización confirmada en el diario, o None."""
+    _, cuerpos, _ = _entradas_diario(directorio, 0, None)
+    secuencias = [
+        json.loads(metadatos[b'secuencia'])
+        for metadatos in (pa.ipc.open_stream(cuerpo).schema.metadata for cuerpo in cuerpos)
+        if b'secuencia' in metadatos
+    ]
+    return max(secuencias, default=None)
+
+def registros_diario(directorio=DIRECTORIO_DATOS):
+    """Devuelve como tabla Arrow el último estado de cada registro del diario.
+
+    Es lo que las lecturas directas de Parquet tienen que superponer para
+    ver los lotes que todavía no se volcaron (ver `superponer_diario`).
+    """
+    _, tabla, _, _ = _leer_entradas_diario(directorio, 0, None)
+    if tabla.num_rows:
+        ids = tabla.column('id').to_numpy()
+        _, ultimas = np.unique(ids[::-1], return_index=True)
+        tabla = tabla.take(np.sort(len(ids) - 1 - ultimas))
+    return tabla
+
+def superponer_diario(tabla, diario):
+    """Reemplaza en `tabla`, leída de Parquet, las filas que el diario tiene más nuevas y agrega las que faltan."""
+    if diario.num_rows == 0:
+        return tabla
+    # Un registro que cambió de mes o de entidad sale de su partición anterior
+    tabla = tabla.filter(pc.invert(pc.is_in(tabla.column('id'), value_set=diario.column('id'))))
+    return pa.concat_tables([tabla, diario.cast(tabla.schema)])
+
+def volcar_diario(almacen, directorio=DIRECTORIO_DATOS):
+    """Pasa a Parquet, desde el almacén, las particiones que tocó el diario y empieza uno vacío.
+
+    Las particiones se reescriben enteras, así que si se corta antes de
+    vaciar el diario volcarlo de nuevo no repite filas. El diario se vacía
+    recién cuando los archivos, su anotación y la última secuencia de
+    sincronización están en el disco. Devuelve el identificador del diario
+    nuevo.
+    """
+    _, _, particiones, _ = leer_diario(directorio)
+    claves = [
+        clave_particion(almacen.codigo(entidad), mes)
+        for entidad, mes in particiones if almacen.codigo(entidad) is not None
+    ]
+    escritos = reescribir_particiones(almacen, claves, directorio)
+    if escritos:
+        _sincronizar_archivos(escritos, directorio)
+        anotar_cambio(escritos, directorio, sincronizar=True)
+    secuencia = secuencia_diario(directorio)
+    if secuencia is not None:
+        guardar_secuencia(secuencia, directorio)
+    return iniciar_diario(directorio)
+
+def registros_afectados(almacen, previas, nuevas):
+    """Devuelve las filas cuyos impuestos cambian al pasar de unas reglas a otras.
+
+    Solo se comparan las tasas vigentes por entidad y fecha: los registros
+    devueltos, con su id, se recalculan y persisten con `registrar`, que
+    ajusta los totales mensuales y reescribe solo sus particiones.
+    """
+    afectados = previas.afectados(
+        nuevas, almacen.entidades, almacen.columna('entidad'), almacen.columna('fecha')
+    )
+    return almacen.filas(np.flatnonzero(afectados))
+
+Instantanea = namedtuple('Instantanea', ['almacen', 'carpeta', 'generacion', 'posicion'])
+
+def guardar_instantanea(almacen, generacion, posicion, directorio=DIRECTORIO_DATOS):
+    """Guarda el almacén como arreglos .npy para que otros procesos lo mapeen en memoria.
+
+    `generacion` y `posicion` indican hasta dónde del registro de cambios
+    incluye la instantánea. Se escribe en una carpeta nueva y después se
+    apunta a ella, así quien la esté leyendo no ve archivos a medio escribir.
+    Devuelve el nombre de la carpeta.
+    """
+    carpeta = f'{PREFIJO_INSTANTANEA}{uuid.uuid4().hex}'
+    destino = os.path.join(directorio, carpeta)
+    os.makedirs(destino)
+    for nombre in ['id', 'fecha', 'entidad']:
+        np.save(os.path.join(destino, f'{nombre}.npy'), almacen.columna(nombre))
+    np.save(os.path.join(destino, 'bloque.npy'), almacen.bloque())
+    with open(os.path.join(destino, 'entidades.json'), 'w', encoding='utf-8') as archivo:
+        json.dump(almacen.entidades, archivo)
+
+    ruta = os.path.join(directorio, ARCHIVO_INSTANTANEA)
+    with open(ruta + '.tmp', 'w', encoding='utf-8') as archivo:
+        json.dump({'carpeta': carpeta, 'generacion': generacion, 'posicion': posicion}, archivo)
+    os.replace(ruta + '.tmp', ruta)
+
+    # Las anteriores siguen mapeadas en otros procesos hasta que recarguen;
+    # en Linux y macOS se pueden borrar igual, en Windows quedan para la próxima vez
+    for anterior in os.listdir(directorio):
+        if anterior.startswith(PREFIJO_INSTANTANEA) and anterior != carpeta:
+            shutil.rmtree(os.path.join(directorio, anterior), ignore_errors=True)
+    return carpeta
+
+def abrir_instantanea(directorio=DIRECTORIO_DATOS):
+    """Abre la última instantánea mapeando sus arreglos en memoria, sin copiarlos.
+
+    Las páginas mapeadas las comparte el sistema operativo entre todos los
+    procesos que abren la misma instantánea. Devuelve None si no hay ninguna.
+    """
+    try:
+        with open(os.path.join(directorio, ARCHIVO_INSTANTANEA), encoding='utf-8') as archivo:
+            puntero = json.load(archivo)
+        origen = os.path.join(directorio, puntero['carpeta'])
+        with open(os.path.join(origen, 'entidades.json'), encoding='utf-8') as archivo:
+            nombres = json.load(archivo)
+        arreglos = [
+            np.asarray(np.load(os.path.join(origen, f'{nombre}.npy'), mmap_mode='r'))
+            for nombre in ['id', 'fecha', 'entidad', 'bloque']
+        ]
+    except FileNotFoundError:
+        return None
+    if arreglos[3].dtype != np.int64:
+        # Instantánea de antes de guardar los montos en centavos: se recarga desde Parquet
+        return None
+    almacen = AlmacenColumnar.desde_arreglos(*arreglos, nombres)
+    return Instantanea(almacen, puntero['carpeta'], puntero['generacion'], puntero['posicion'])
+
+def dataset_registros(directorio=DIRECTORIO_DATOS, particiones=PARTICIONES):
+    """Devuelve el dataset Arrow de los registros guardados en Parquet, sin el diario, con lecturas mapeadas."""
+    return ds.dataset(
+        directorio,
+        schema=ESQUEMA_PARTICIONADO,
+        format='parquet',
+        partitioning=particiones,
+        filesystem=pafs.LocalFileSystem(use_mmap=True)
+    )
+
+def migrar_particiones(directorio=DIRECTORIO_DATOS):
+    """Mueve los datos guardados antes de existir las entidades a la entidad predeterminada."""
+    if not os.path.isdir(directorio):
+        return
+
+    anteriores = [nombre for nombre in os.listdir(directorio) if nombre.startswith('anio=')]
+    if not anteriores:
+        return
+    destino = _directorio_entidad(directorio, ENTIDAD_PREDETERMINADA)
+    os.makedirs(destino, exist_ok=True)
+    for nombre in anteriores:
+        os.replace(os.path.join(directorio, nombre), os.path.join(destino, nombre))
+
+def leer_datos(directorio=DIRECTORIO_DATOS, diario=True):
+    """Lee todos los registros guardados usando lecturas mapeadas en memoria.
+
+    Con `diario` se incluyen los lotes del diario de escritura que todavía
+    no se volcaron a Parquet. Mientras otro proceso escribe, conviene leer
+    con el bloqueo del almacén (ver `compartido.AlmacenCompartido.bloqueo`).
+    """
+    # El diario antes que Parquet: si mientras tanto se vuelca, sus filas ya están en los archivos
+    diario = registros_diario(directorio) if diario else ESQUEMA.empty_table()
+    migrar_particiones(directorio)
+    if os.path.isdir(directorio):
+        tabla = dataset_registros(directorio).to_table(columns=ESQUEMA.names)
+    else:
+        tabla = ESQUEMA.empty_table()
+    tabla = superponer_diario(tabla, diario)
+    # Como Categorical, sin un objeto str por fila
+    return tabla.set_column(1, 'entidad', tabla.column(1).dictionary_encode()).to_pandas()
+
+def leer_archivos(archivos, directorio=DIRECTORIO_DATOS):
+    """Lee como DataFrame los archivos indicados (rutas relativas a `directorio`).
+
+    Los archivos que ya no existen, porque su partición se reescribió después,
+    se omiten: sus filas vuelven a aparecer en los archivos más nuevos.
+    """
+    rutas = [ruta for ruta in (os.path.join(directorio, archivo) for archivo in archivos) if os.path.exists(ruta)]
+    if not rutas:
+        return ESQUEMA.empty_table().to_pandas()
+    dataset = ds.dataset(
+        rutas,
+        schema=ESQUEMA_PARTICIONADO,
+        format='parquet',
+        partitioning=PARTICIONES,
+        partition_base_dir=directorio,
+        filesystem=pafs.LocalFileSystem(use_mmap=True)
+    )
+    tabla = dataset.to_table(columns=ESQUEMA.names)
+    return tabla.set_column(1, 'entidad', tabla.column(1).dictionary_encode()).to_pandas()
+
+def cargar_almacen(directorio=DIRECTORIO_DATOS, diario=True):
+    """Carga los datos guardados en un almacén columnar al iniciar la aplicación.
+
+    Sin `diario` se cargan solo los archivos Parquet, para quien aplica el
+    diario por su cuenta.
+    """
+    df = leer_datos(directorio, diario=diario)
+    almacen = AlmacenColumnar(capacidad=max(1024, len(df)))
+    if not df.empty:
+        df = df.sort_values('id', kind='stable')
+        # Una reescritura de particiones cortada deja filas repetidas (ver
+        # `reescribir_particiones`); las filas sin id reciben uno al agregarlas
+        ids = df['id'].to_numpy()
+        repetidas = np.zeros(len(ids), dtype=bool)
+        repetidas[:-1] = (ids[:-1] == ids[1:]) & (ids[:-1] != SIN_ID)
+        if repetidas.any():
+            df = df[~repetidas]
+        almacen.agregar(df, recalcular=False)
+    return almacen
+
+def completar_ids(directorio=DIRECTORIO_DATOS):
+    """Reescribe con sus ids las particiones con filas guardadas sin id, de antes de que los registros los tuvieran.
+
+    Las filas reciben los ids que les da `cargar_almacen`, los mismos con
+    que el diario las nombra: las lecturas directas superponen el diario
+    por id (ver `superponer_diario`). Después deja `ARCHIVO_IDS`, así la
+    carpeta se revisa una sola vez.
+    """
+    marca = os.path.join(directorio, ARCHIVO_IDS)
+    if os.path.exists(marca):
+        return
+    migrar_particiones(directorio)
+    os.makedirs(directorio, exist_ok=True)
+    sin_id = dataset_registros(directorio).to_table(columns=['entidad', 'fecha'], filter=ds.field('id') == SIN_ID)
+    if sin_id.num_rows == 0:
+        open(marca, 'w').close()
+        return
+
+    almacen = cargar_almacen(directorio, diario=False)
+    nombres, indices = np.unique(sin_id.column('entidad').to_numpy(zero_copy_only=False), return_inverse=True)
+    codigos = np.array([almacen.codigo(nombre) for nombre in nombres], dtype=np.int64)[indices]
+    claves = clave_particion(codigos, meses_de(sin_id.column('fecha').to_numpy()))
+    escritos = reescribir_particiones(almacen, claves, directorio)
+    _sincronizar_archivos(escritos, directorio)
+    anotar_cambio(escritos, directorio, sincronizar=True)
+    open(marca, 'w').close()
@@ -0,0 +1,112 @@
+import io
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+import data_manager as dm
+
+TAMANIO_BLOQUE = 50_000
+TAMANIO_LECTURA = 1024 * 1024
+
+FORMATOS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'excel': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+class _Sumidero(io.RawIOBase):
+    """Archivo de solo escritura que acumula bytes hasta que se retiran."""
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def retirar(self):
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
+
+def _bloques(datos, tamanio_bloque, formatear=None):
+    """Recorre los registros en bloques sin materializar el conjunto completo.
+
+    Siempre se produce al menos un bloque para que la exportación tenga
+    encabezados. Si se indica, `formatear` transforma cada bloque, por
+    ejemplo para escribir los montos como texto (ver `utils.formatear_montos`).
+    """
+    total = len(datos)
+    for inicio in range(0, max(total, 1), tamanio_bloque):
+        fin = min(inicio + tamanio_bloque, total)
+        if isinstance(datos, dm.AlmacenColumnar):
+            bloque = datos.filas(slice(inicio, fin))
+        else:
+            bloque = datos.iloc[inicio:fin]
+        yield bloque if formatear is None else formatear(bloque)
+
+def exportar_csv(datos, tamanio_bloque=TAMANIO_BLOQUE, formatear=None):
+    """Genera el CSV por bloques, empezando por la fila de encabezados."""
+    encabezado = True
+    for bloque in _bloques(datos, tamanio_bloque, formatear):
+        yield bloque.to_csv(index=False, header=encabezado).encode('utf-8')
+        encabezado = False
+
+def exportar_parquet(datos, tamanio_bloque=TAMANIO_BLOQUE, formatear=None):
+    """Genera el archivo Parquet emitiendo cada grupo de filas apenas se escribe."""
+    sumidero = _Sumidero()
+    escritor = None
+    for bloque in _bloques(datos, tamanio_bloque, formatear):
+        tabla = pa.Table.from_pandas(bloque, preserve_index=False)
+        if escritor is None:
+            escritor = pq.ParquetWriter(sumidero, tabla.schema)
+        escritor.write_table(tabla)
+        yield sumidero.retirar()
+
+    if escritor is not None:
+        escritor.close()
+        yield sumidero.retirar()
+
+def exportar_excel(datos, tamanio_bloque=TAMANIO_BLOQUE, formatear=None):
+    """Genera el archivo Excel en modo de solo escritura a través de un archivo temporal.
+
+    El formato xlsx es un zip que recién queda completo al cerrarse, por lo que
+    los bytes se emiten al final, pero las filas nunca se acumulan en memoria.
+    """
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet('datos_financieros')
+    encabezado = True
+    for bloque in _bloques(datos, tamanio_bloque, formatear):
+        if encabezado:
+            hoja.append(list(bloque.columns))
+            encabezado = False
+        for fila in bloque.itertuples(index=False):
+            hoja.append(list(fila))
+
+    with tempfile.TemporaryFile() as archivo:
+        libro.save(archivo)
+        archivo.seek(0)
+        while True:
+            parte = archivo.read(TAMANIO_LECTURA)
+            if not parte:
+                break
+            yield parte
+
+def exportar(datos, formato='csv', tamanio_bloque=TAMANIO_BLOQUE, formatear=None):
+    """Devuelve un generador de bytes con los datos en el formato indicado."""
+    if formato == 'csv':
+        return exportar_csv(datos, tamanio_bloque, formatear)
+    elif formato == 'parquet':
+        return exportar_parquet(datos, tamanio_bloque, formatear)
+    elif formato == 'excel':
+        return exportar_excel(datos, tamanio_bloque, formatear)
+    raise ValueError(f"Formato de exportación desconocido: {formato}")
@@ -0,0 +1,213 @@
+import argparse
+import io
+import time
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import compartido
+import comprobantes
+import data_manager as dm
+import utils
+
+TAMANIO_BLOQUE = 100_000
+MAXIMO_ERRORES = 20
+
+FORMATOS = ['registros', 'afip']
+
+# Nombres de columnas de las distintas versiones de "Mis Comprobantes"
+ALIAS_AFIP = {
+    'Fecha de Emisión': 'Fecha',
+    'Tipo de Comprobante': 'Tipo',
+    'Tipo Cambio': 'Tipo de Cambio',
+}
+
+ResultadoImportacion = namedtuple('ResultadoImportacion', [
+    'filas_leidas', 'filas_invalidas', 'registros', 'ids', 'segundos', 'filas_por_segundo', 'errores'
+])
+
+def _es_excel(fuente, tipo_archivo):
+    if tipo_archivo is not None:
+        return tipo_archivo == 'excel'
+    nombre = fuente if isinstance(fuente, str) else getattr(fuente, 'name', '')
+    return nombre.lower().endswith(('.xlsx', '.xls'))
+
+def _fila_encabezado_afip(fuente):
+    """Busca la fila de encabezados, ya que AFIP agrega un título sobre la tabla."""
+    primeras = pd.read_excel(fuente, header=None, nrows=10)
+    if hasattr(fuente, 'seek'):
+        fuente.seek(0)
+    for indice, fila in primeras.iterrows():
+        if fila.isin(['Fecha', 'Fecha de Emisión']).any():
+            return indice
+    return 0
+
+def leer_bloques(fuente, formato='registros', tipo_archivo=None, tamanio_bloque=TAMANIO_BLOQUE):
+    """Lee un archivo CSV o Excel en bloques de filas."""
+    if _es_excel(fuente, tipo_archivo):
+        # Excel no admite lectura por bloques: se lee una vez y se recorre en bloques
+        encabezado = _fila_encabezado_afip(fuente) if formato == 'afip' else 0
+        df = pd.read_excel(fuente, header=encabezado)
+        # Los errores se informan con el número de fila de la planilla, debajo del título de AFIP
+        df.index += encabezado
+        for inicio in range(0, len(df), tamanio_bloque):
+            yield df.iloc[inicio:inicio + tamanio_bloque]
+        return
+
+    opciones = {'sep': ';', 'decimal': ',', 'thousands': '.'} if formato == 'afip' else {}
+    yield from pd.read_csv(fuente, chunksize=tamanio_bloque, **opciones)
+
+def _registrar_errores(errores, bloque, invalidas, motivo):
+    for fila in bloque.index[invalidas][:MAXIMO_ERRORES - len(errores)]:
+        errores.append(f"Fila {fila + 2}: {motivo}")
+
+def _validar_montos(bloque, columnas, errores, validas):
+    """Valida las columnas de montos de las filas `validas` y devuelve la máscara actualizada.
+
+    Cada fila se informa una sola vez, con el primer error que tenga.
+    """
+    validas = validas.copy()
+    for columna in columnas:
+        if columna not in bloque:
+            continue
+        positivas = utils.validar_numeros_positivos(bloque[columna].to_numpy())
+        _registrar_errores(errores, bloque, ~positivas & validas, f"'{columna}' no es un número positivo")
+        validas &= positivas
+    return validas
+
+def _procesar_registros(bloque, errores):
+    """Convierte un bloque con el esquema propio de la aplicación en registros."""
+    fechas = pd.to_datetime(bloque['fecha'], errors='coerce')
+    validas = fechas.notna().to_numpy(copy=True)
+    _registrar_errores(errores, bloque, ~validas, "fecha inválida")
+    validas = _validar_montos(bloque, dm.COLUMNAS_BASE, errores, validas)
+
+    registros = pd.DataFrame({'fecha': fechas[validas]})
+    if 'entidad' in bloque:
+        registros['entidad'] = bloque['entidad'][validas]
+    for columna in dm.COLUMNAS_BASE:
+        if columna in bloque:
+            registros[columna] = pd.to_numeric(bloque[columna][validas])
+    return registros, int((~validas).sum())
+
+def _procesar_afip(bloque, errores, almacen_comprobantes, entidad=None):
+    """Agrega los comprobantes válidos de un bloque de "Mis Comprobantes" al almacén de comprobantes."""
+    bloque = bloque.rename(columns=ALIAS_AFIP)
+    fechas = pd.to_datetime(bloque['Fecha'], errors='coerce', dayfirst=True)
+    codigos = pd.to_numeric(
+        bloque['Tipo'].astype(str).str.extract(r'^\s*(\d+)', expand=False), errors='coerce'
+    )
+    validas = (fechas.notna() & codigos.notna()).to_numpy(copy=True)
+    _registrar_errores(errores, bloque, ~validas, "fecha o tipo de comprobante inválido")
+    admitidos = np.isin(codigos.to_numpy(), comprobantes.CODIGOS_ADMITIDOS)
+    _registrar_errores(errores, bloque, validas & ~admitidos, "tipo de comprobante no admitido")
+    validas &= admitidos
+
+    # Sin neto gravado se usa el total, que entonces se valida una sola vez
+    columna_neto = 'Imp. Neto Gravado' if 'Imp. Neto Gravado' in bloque else 'Imp. Total'
+    columnas_montos = [columna_neto] if columna_neto == 'Imp. Total' else [columna_neto, 'Imp. Total']
+    validas = _validar_montos(bloque, columnas_montos, errores, validas)
+
+    neto = pd.to_numeric(bloque[columna_neto], errors='coerce').fillna(0.0).to_numpy()
+    total = pd.to_numeric(bloque['Imp. Total'], errors='coerce').fillna(0.0).to_numpy()
+    if 'Tipo de Cambio' in bloque:
+        cambio = pd.to_numeric(bloque['Tipo de Cambio'], errors='coerce').fillna(1.0).to_numpy()
+        neto, total = neto * cambio, total * cambio
+
+    codigos = codigos.to_numpy()
+    # Los comprobantes C no discriminan IVA, por eso se toma el importe total
+    importe = np.where(np.isin(codigos, comprobantes.CODIGOS_AFIP['facturacion_c']), total, neto)
+    almacen_comprobantes.agregar(
+        fechas.to_numpy(dtype='datetime64[ns]')[validas],
+        codigos[validas].astype(np.int64),
+        dm.a_centavos(importe[validas]),
+        entidad
+    )
+    return int((~validas).sum())
+
+def importar(fuente, almacen, formato='registros', tipo_archivo=None,
+             tamanio_bloque=TAMANIO_BLOQUE, directorio=dm.DIRECTORIO_DATOS, entidad=None):
+    """Importa un archivo completo validando por bloques y agregándolo en un solo lote.
+
+    `entidad` se asigna a las filas que no traen la suya, por ejemplo a todo
+    un archivo de "Mis Comprobantes" de una empresa. `almacen` puede ser un
+    `compartido.AlmacenCompartido`, que guarda en su propia carpeta.
+
+    Los comprobantes de AFIP se guardan uno por uno en el almacén de
+    comprobantes (ver `comprobantes.AlmacenComprobantes`) a medida que se
+    leen los bloques, y al almacén de registros llega un registro por
+    entidad y mes con sus sumas.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de importación desconocido: {formato}")
+
+    inicio = time.perf_counter()
+    almacen_comprobantes = comprobantes.AlmacenComprobantes() if formato == 'afip' else None
+    partes = []
+    errores = []
+    filas_leidas = 0
+    filas_invalidas = 0
+    for bloque in leer_bloques(fuente, formato, tipo_archivo, tamanio_bloque):
+        if almacen_comprobantes is not None:
+            invalidas = _procesar_afip(bloque, errores, almacen_comprobantes, entidad)
+        else:
+            registros, invalidas = _procesar_registros(bloque, errores)
+            partes.append(registros)
+        filas_leidas += len(bloque)
+        filas_invalidas += invalidas
+
+    if almacen_comprobantes is not None:
+        registros = almacen_comprobantes.acumulador.vaciar(almacen_comprobantes.entidades)
+    else:
+        registros = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=['fecha'])
+        if entidad is not None:
+            registros['entidad'] = registros['entidad'].fillna(entidad) if 'entidad' in registros else entidad
+
+    destino = almacen.directorio if isinstance(almacen, compartido.AlmacenCompartido) else directorio
+    if not len(registros):
+        ids = np.array([], dtype=np.int64)
+    elif isinstance(almacen, compartido.AlmacenCompartido):
+        ids = almacen.registrar(registros)
+    else:
+        ids = dm.registrar(almacen, registros, directorio)
+    # Los comprobantes se guardan recién cuando sus sumas ya están registradas
+    if almacen_comprobantes is not None:
+        comprobantes.guardar_comprobantes(almacen_comprobantes, destino)
+    segundos = time.perf_counter() - inicio
+    return ResultadoImportacion(
+        filas_leidas=filas_leidas,
+        filas_invalidas=filas_invalidas,
+        registros=len(registros),
+        ids=ids,
+        segundos=segundos,
+        filas_por_segundo=filas_leidas / segundos if segundos > 0 else 0.0,
+        errores=errores
+    )
+
+def importar_bytes(contenido, almacen, formato='registros', tipo_archivo='csv',
+                   directorio=dm.DIRECTORIO_DATOS, entidad=None):
+    """Importa un archivo recibido en memoria, por ejemplo desde la API."""
+    return importar(io.BytesIO(contenido), almacen, formato, tipo_archivo, directorio=directorio, entidad=entidad)
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa registros financieros desde CSV, Excel o AFIP.")
+    parser.add_argument('archivo', help="Archivo CSV o Excel a importar")
+    parser.add_argument('--formato', choices=FORMATOS, default='registros')
+    parser.add_argument('--directorio', default=dm.DIRECTORIO_DATOS, help="Carpeta de datos")
+    parser.add_argument('--bloque', type=int, default=TAMANIO_BLOQUE, help="Filas por bloque")
+    parser.add_argument('--entidad', help="Entidad de las filas que no indican la suya")
+    args = parser.parse_args()
+
+    almacen = compartido.AlmacenCompartido(args.directorio)
+    resultado = importar(
+        args.archivo, almacen, args.formato, tamanio_bloque=args.bloque,
+        directorio=args.directorio, entidad=args.entidad
+    )
+    print(f"Filas leídas: {resultado.filas_leidas}")
+    print(f"Filas inválidas: {resultado.filas_invalidas}")
+    print(f"Registros agregados: {resultado.registros}")
+    print(f"Tiempo: {resultado.segundos:.2f} s ({resultado.filas_por_segundo:,.0f} filas/s)")
+    for error in resultado.errores:
+        print(f"  {error}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+import numpy as np
+
+TASA_IVA = 0.21
+TASA_INGRESOS_BRUTOS = 0.035
+
+# Concepto de cada regla y la columna sobre la que se aplica su tasa
+CONCEPTOS = {
+    'iva_a': 'facturacion_a',
+    'iva_b': 'facturacion_b',
+    'iva_credito': 'gastos_operativos',
+    'ingresos_brutos': 'facturacion'
+}
+
+# Las reglas se guardan en la carpeta de datos (la de data_manager.DIRECTORIO_DATOS,
+# que no se importa porque usa este módulo); el guion bajo las deja fuera del
+# dataset de registros y `reemplazar_registros` las conserva
+NOMBRE_ARCHIVO_REGLAS = '_impuestos.json'
+ARCHIVO_REGLAS = os.environ.get(
+    'FACTURACION_IMPUESTOS', os.path.join(os.environ.get('FACTURACION_DATOS', 'datos'), NOMBRE_ARCHIVO_REGLAS)
+)
+# Ubicación anterior, en la carpeta de trabajo: se lee mientras no se guarden reglas nuevas
+ARCHIVO_REGLAS_ANTERIOR = 'impuestos.json'
+
+# Las reglas sin 'desde' rigen desde siempre
+_SIEMPRE = -(2 ** 31) + 1
+_DESPLAZAMIENTO = 2 ** 31
+
+REGLAS_PREDETERMINADAS = {
+    'reglas': [
+        {'concepto': 'iva_a', 'tasa': TASA_IVA},
+        {'concepto': 'iva_b', 'tasa': TASA_IVA},
+        {'concepto': 'iva_credito', 'tasa': TASA_IVA},
+        {'concepto': 'ingresos_brutos', 'tasa': TASA_INGRESOS_BRUTOS}
+    ],
+    'jurisdicciones': {}
+}
+
+def _dias(fechas):
+    return np.asarray(fechas).astype('datetime64[D]').astype(np.int64)
+
+def _claves(codigos, dias):
+    """Combina códigos de entidad y días en claves enteras ordenables."""
+    return (np.asarray(codigos, dtype=np.int64) << 32) + (np.asarray(dias, dtype=np.int64) + _DESPLAZAMIENTO)
+
+def _vigentes(cortes, tasas, dias):
+    """Evalúa una función escalonada: la tasa del último corte anterior o igual a cada día (NaN si no hay)."""
+    indices = np.searchsorted(cortes, dias, side='right') - 1
+    return np.where(indices >= 0, tasas[np.maximum(indices, 0)] if len(tasas) else np.nan, np.nan)
+
+class ReglasImpuestos:
+    """Tabla de tasas con vigencia por fecha para IVA e ingresos brutos.
+
+    Cada regla tiene un `concepto` (ver `CONCEPTOS`), una `tasa` y
+    opcionalmente la fecha `desde` la que rige y la `entidad` o la
+    `jurisdiccion` a la que se limita. `jurisdicciones` asigna a cada entidad
+    su jurisdicción (por ejemplo la provincia para ingresos brutos). Para
+    cada fecha vale la regla más específica vigente: la de la entidad, la de
+    su jurisdicción o la general.
+    """
+
+    def __init__(self, reglas, jurisdicciones=None):
+        self.reglas = [self._validar(regla) for regla in reglas]
+        self.jurisdicciones = dict(jurisdicciones or {})
+        self._lineas = {}
+        self._bloqueo = threading.Lock()
+
+        # Cortes y tasas por (concepto, nivel, nombre), ordenados por fecha
+        self._niveles = {}
+        for regla in self.reglas:
+            if 'entidad' in regla:
+                clave = (regla['concepto'], 'entidad', regla['entidad'])
+            elif 'jurisdiccion' in regla:
+                clave = (regla['concepto'], 'jurisdiccion', regla['jurisdiccion'])
+            else:
+                clave = (regla['concepto'], 'general', None)
+            desde = _SIEMPRE if regla.get('desde') is None else int(_dias(np.datetime64(regla['desde'], 'D')))
+            self._niveles.setdefault(clave, {})[desde] = float(regla['tasa'])
+        for clave, tasas in self._niveles.items():
+            cortes = np.array(sorted(tasas), dtype=np.int64)
+            self._niveles[clave] = (cortes, np.array([tasas[c] for c in cortes], dtype=np.float64))
+
+    @staticmethod
+    def _validar(regla):
+        if regla.get('concepto') not in CONCEPTOS:
+            raise ValueError(f"Concepto de impuesto desconocido: {regla.get('concepto')}")
+        tasa = regla.get('tasa')
+        if isinstance(tasa, bool) or not isinstance(tasa, (int, float)) or not 0 <= tasa <= 1:
+            raise ValueError(f"Tasa inválida para {regla['concepto']}: {tasa}")
+        if 'entidad' in regla and 'jurisdiccion' in regla:
+            raise ValueError("Una regla se aplica a una entidad o a una jurisdicción, no a ambas")
+        regla = dict(regla)
+        if regla.get('desde') is not None:
+            import pandas as pd
+
+            regla['desde'] = pd.Timestamp(regla['desde']).strftime('%Y-%m-%d')
+        return regla
+
+    @classmethod
+    def desde_dict(cls, datos):
+        return cls(datos.get('reglas', []), datos.get('jurisdicciones'))
+
+    def a_dict(self):
+        return {'reglas': self.reglas, 'jurisdicciones': self.jurisdicciones}
+
+    def linea(self, concepto, entidad):
+        """Devuelve la tasa vigente para una entidad como función escalonada (cortes en días, tasas)."""
+        clave = (concepto, entidad)
+        linea = self._lineas.get(clave)
+        if linea is not None:
+            return linea
+
+        niveles = [
+            self._niveles.get((concepto, 'entidad', entidad)),
+            self._niveles.get((concepto, 'jurisdiccion', self.jurisdicciones.get(entidad))),
+            self._niveles.get((concepto, 'general', None))
+        ]
+        niveles = [nivel for nivel in niveles if nivel is not None]
+        if not niveles:
+            linea = (np.array([_SIEMPRE], dtype=np.int64), np.zeros(1))
+        else:
+            cortes = np.unique(np.concatenate([[_SIEMPRE]] + [c for c, _ in niveles]))
+            tasas = np.zeros(len(cortes))
+            pendientes = np.ones(len(cortes), dtype=bool)
+            # El nivel más específico vigente en cada corte gana
+            for cortes_nivel, tasas_nivel in niveles:
+                vigentes = _vigentes(cortes_nivel, tasas_nivel, cortes)
+                usar = pendientes & ~np.isnan(vigentes)
+                tasas[usar] = vigentes[usar]
+                pendientes &= ~usar
+            linea = (cortes, tasas)
+        with self._bloqueo:
+            self._lineas[clave] = linea
+        return linea
+
+    def tasas(self, concepto, entidades, fechas):
+        """Devuelve la tasa de cada registro según su entidad (Categorical de nombres) y su fecha."""
+        lineas = [self.linea(concepto, nombre) for nombre in entidades.categories]
+        codigos = entidades.codes
+        if all(len(cortes) == 1 for cortes, _ in lineas):
+            # Tasas constantes: basta con una tasa por entidad
+            return np.array([tasas[0] for _, tasas in lineas])[codigos]
+
+        cortes = np.concatenate([_claves(np.full(len(c), i), c) for i, (c, _) in enumerate(lineas)])
+        tasas = np.concatenate([t for _, t in lineas])
+        claves = _claves(codigos, _dias(fechas))
+        return tasas[np.searchsorted(cortes, claves, side='right') - 1]
+
+    def cambios(self, otras, entidades):
+        """Compara con otras reglas y devuelve, por entidad, los tramos en que cambia alguna tasa.
+
+        El resultado son claves de inicio de tramo (ver `_claves`, con el
+        código de cada entidad según su posición en `entidades`) y una marca
+        por tramo que indica si alguna tasa difiere.
+        """
+        inicios, marcas = [], []
+        for codigo, nombre in enumerate(entidades):
+            lineas = [(self.linea(c, nombre), otras.linea(c, nombre)) for c in CONCEPTOS]
+            cortes = np.unique(np.concatenate([np.concatenate([a[0], b[0]]) for a, b in lineas]))
+            distintos = np.zeros(len(cortes), dtype=bool)
+            for (cortes_a, tasas_a), (cortes_b, tasas_b) in lineas:
+                distintos |= _vigentes(cortes_a, tasas_a, cortes) != _vigentes(cortes_b, tasas_b, cortes)
+            inicios.append(_claves(np.full(len(cortes), codigo), cortes))
+            marcas.append(distintos)
+        if not inicios:
+            return np.array([], dtype=np.int64), np.array([], dtype=bool)
+        return np.concatenate(inicios), np.concatenate(marcas)
+
+    def afectados(self, otras, entidades, codigos, fechas):
+        """Marca los registros (códigos de entidad y fechas) cuya tasa cambia con otras reglas."""
+        inicios, marcas = self.cambios(otras, entidades)
+        if not marcas.any():
+            return np.zeros(len(codigos), dtype=bool)
+        indices = np.searchsorted(inicios, _claves(codigos, _dias(fechas)), side='right') - 1
+        return marcas[indices]
+
+_cache = {'firma': None, 'reglas': None}
+_bloqueo_cache = threading.Lock()
+
+def _firma(ruta):
+    try:
+        estado = os.stat(ruta)
+    except FileNotFoundError:
+        return None
+    return estado.st_ino, estado.st_size, estado.st_mtime_ns
+
+def reglas_vigentes(ruta=ARCHIVO_REGLAS):
+    """Devuelve las reglas del archivo, o las predeterminadas si no existe; se releen solo si cambió."""
+    firma = _firma(ruta)
+    if firma is None and ruta == ARCHIVO_REGLAS and 'FACTURACION_IMPUESTOS' not in os.environ:
+        anterior = _firma(ARCHIVO_REGLAS_ANTERIOR)
+        if anterior is not None:
+            ruta, firma = ARCHIVO_REGLAS_ANTERIOR, anterior
+    with _bloqueo_cache:
+        if _cache['reglas'] is not None and _cache['firma'] == (ruta, firma):
+            return _cache['reglas']
+    if firma is None:
+        reglas = ReglasImpuestos.desde_dict(REGLAS_PREDETERMINADAS)
+    else:
+        with open(ruta, encoding='utf-8') as archivo:
+            reglas = ReglasImpuestos.desde_dict(json.load(archivo))
+    with _bloqueo_cache:
+        _cache['firma'], _cache['reglas'] = (ruta, firma), reglas
+    return reglas
+
+def guardar_reglas(reglas, ruta=ARCHIVO_REGLAS):
+    """Guarda las reglas de forma atómica; las demás instancias las releen al notar el cambio."""
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    with open(ruta + '.tmp', 'w', encoding='utf-8') as archivo:
+        json.dump(reglas.a_dict(), archivo, ensure_ascii=False, indent=2)
+    os.replace(ruta + '.tmp', ruta)
+    with _bloqueo_cache:
+        _cache['firma'], _cache['reglas'] = (ruta, _firma(ruta)), reglas
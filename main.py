@@ -1,9 +1,12 @@
 import streamlit as st
 import pandas as pd
+import time
 from datetime import datetime
 import data_manager as dm
-import visualizations as viz
+import compartido
+import importacion
 import utils
+import ventanas
 import logging
 
 # Configuración de logging
@@ -22,20 +25,75 @@ except Exception as e:
     logger.error(f"Error en la configuración de página: {str(e)}")
     st.error("Error al configurar la página")
 
-# Inicialización del estado de la sesión
+# Un solo almacén para todas las sesiones, compartido con la API a través
+# de la carpeta de datos
+@st.cache_resource(show_spinner=False)
+def almacen_compartido():
+    inicio = time.perf_counter()
+    almacen = compartido.AlmacenCompartido()
+    logger.info(
+        f"Almacén de datos inicializado en {time.perf_counter() - inicio:.2f} s "
+        f"({almacen.recuperados} registros recuperados del diario de escritura)"
+    )
+    return almacen
+
 try:
-    if 'datos_financieros' not in st.session_state:
-        st.session_state.datos_financieros = pd.DataFrame(columns=[
-            'fecha', 'facturacion_a', 'facturacion_b', 'facturacion_c',
-            'gastos_operativos', 'otros_gastos', 'retenciones',
-            'iva_debito', 'iva_credito', 'iva_total',
-            'ingresos_brutos', 'utilidad'
-        ])
-        logger.info("Estado de sesión inicializado correctamente")
+    almacen_compartido()
 except Exception as e:
-    logger.error(f"Error al inicializar el estado de sesión: {str(e)}")
+    logger.error(f"Error al inicializar el almacén de datos: {str(e)}")
     st.error("Error al inicializar los datos")
 
+# Caché entre reejecuciones: la clave es la versión del almacén más los
+# parámetros de la vista, así que cualquier escritura la invalida. El
+# almacén se pasa con guion bajo para que Streamlit no lo hashee.
+@st.cache_data(max_entries=32, show_spinner=False)
+def analisis_mensual_cacheado(_almacen, version, entidad=None):
+    """Devuelve el análisis mensual junto con las etiquetas de los meses."""
+    df_mensual = dm.analisis_mensual(_almacen, entidad)
+    return df_mensual, df_mensual.index.strftime('%B %Y').tolist()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def agrupar_por_periodo_cacheado(_almacen, version, periodo, entidad=None):
+    return dm.agrupar_por_periodo(_almacen, periodo, entidad)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def estadisticas_cacheadas(_almacen, version, entidad=None):
+    return dm.calcular_estadisticas(_almacen, entidad=entidad)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def ventanas_cacheadas(_almacen, version, meses, periodos, entidad=None):
+    return ventanas.analisis_ventanas(_almacen, entidad, meses, periodos)
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def graficos_cacheados(_df, version, vista):
+    """Construye una sola vez los cuatro gráficos de una vista.
+
+    Se guardan las figuras y no su JSON porque Streamlit vuelve a validar
+    los diccionarios, lo que resulta más lento que armarlas de nuevo. Las
+    figuras no se modifican al mostrarlas, por lo que se pueden compartir.
+    """
+    # Plotly se carga recién en la primera página con gráficos
+    import visualizations as viz
+
+    series = viz.preparar_series(_df)
+    return {
+        'lineas': viz.grafico_lineas_temporales(series),
+        'facturacion': viz.grafico_barras_comparativo(series),
+        'gastos': viz.grafico_barras_gastos(series),
+        'impuestos': viz.grafico_impuestos(series)
+    }
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def graficos_ventanas_cacheados(_df, version, periodos, vista):
+    import visualizations as viz
+
+    return {
+        'totales': viz.grafico_totales_moviles(_df),
+        'promedios': viz.grafico_promedios_moviles(_df, periodos),
+        'interanual': viz.grafico_variacion_interanual(_df),
+        'acumulada': viz.grafico_utilidad_acumulada(_df)
+    }
+
 def main():
     try:
         st.title("📊 Sistema de Gestión Financiera")
@@ -44,17 +102,29 @@ def main():
         # Sidebar para navegación
         menu = st.sidebar.selectbox(
             "Menú Principal",
-            ["Ingreso de Datos", "Análisis Mensual", "Análisis Temporal", "Estadísticas"]
+            ["Ingreso de Datos", "Análisis Mensual", "Análisis Temporal", "Tendencias", "Estadísticas"]
         )
 
+        # Filtro por entidad (empresa, sucursal o CUIT) para los análisis
+        entidad = None
+        entidades = almacen_compartido().actualizar().entidades
+        if menu != "Ingreso de Datos" and len(entidades) > 1:
+            entidad = st.sidebar.selectbox(
+                "Entidad",
+                [None] + entidades,
+                format_func=lambda e: "Todas" if e is None else e
+            )
+
         if menu == "Ingreso de Datos":
             mostrar_ingreso_datos()
         elif menu == "Análisis Mensual":
-            mostrar_analisis_mensual()
+            mostrar_analisis_mensual(entidad)
         elif menu == "Análisis Temporal":
-            mostrar_analisis_temporal()
+            mostrar_analisis_temporal(entidad)
+        elif menu == "Tendencias":
+            mostrar_tendencias(entidad)
         else:
-            mostrar_estadisticas()
+            mostrar_estadisticas(entidad)
 
     except Exception as e:
         logger.error(f"Error en la función principal: {str(e)}")
@@ -92,7 +162,8 @@ def mostrar_ingreso_datos():
             gastos_operativos = st.number_input(
                 "Gastos Operativos ($)",
                 min_value=0.0,
-                format="%f",
+                step=0.01,
+                format="%.2f",
                 help="Ingrese el total de gastos operativos"
             )
 
@@ -104,7 +175,8 @@ def mostrar_ingreso_datos():
             facturacion_a = st.number_input(
                 "Facturación A ($)",
                 min_value=0.0,
-                format="%f",
+                step=0.01,
+                format="%.2f",
                 help="Ingrese el monto de facturación tipo A"
             )
 
@@ -112,7 +184,8 @@ def mostrar_ingreso_datos():
             facturacion_b = st.number_input(
                 "Facturación B ($)",
                 min_value=0.0,
-                format="%f",
+                step=0.01,
+                format="%.2f",
                 help="Ingrese el monto de facturación tipo B"
             )
 
@@ -120,7 +193,8 @@ def mostrar_ingreso_datos():
             facturacion_c = st.number_input(
                 "Facturación C ($)",
                 min_value=0.0,
-                format="%f",
+                step=0.01,
+                format="%.2f",
                 help="Ingrese el monto de facturación tipo C"
             )
 
@@ -132,7 +206,8 @@ def mostrar_ingreso_datos():
             otros_gastos = st.number_input(
                 "Otros Gastos ($)",
                 min_value=0.0,
-                format="%f",
+                step=0.01,
+                format="%.2f",
                 help="Ingrese otros gastos no operativos"
             )
 
@@ -140,10 +215,18 @@ def mostrar_ingreso_datos():
             retenciones = st.number_input(
                 "Retenciones ($)",
                 min_value=0.0,
-                format="%f",
+                step=0.01,
+                format="%.2f",
                 help="Ingrese el monto total de retenciones"
             )
 
+        with col3:
+            entidad = st.text_input(
+                "Entidad",
+                value=dm.ENTIDAD_PREDETERMINADA,
+                help="Empresa, sucursal o CUIT al que corresponde el registro"
+            )
+
         submitted = st.form_submit_button("Guardar Datos")
 
         if submitted:
@@ -152,6 +235,8 @@ def mostrar_ingreso_datos():
             fecha = pd.Timestamp(año, mes_num, 1)
 
             datos = {
+                'fecha': fecha,
+                'entidad': entidad.strip() or dm.ENTIDAD_PREDETERMINADA,
                 'facturacion_a': facturacion_a,
                 'facturacion_b': facturacion_b,
                 'facturacion_c': facturacion_c,
@@ -161,38 +246,76 @@ def mostrar_ingreso_datos():
             }
 
             try:
-                nuevo_registro = dm.agregar_registro(
-                    st.session_state.datos_financieros,
-                    fecha,
-                    datos
-                )
-                st.session_state.datos_financieros = nuevo_registro
+                almacen_compartido().registrar([datos])
                 st.success("✅ Datos guardados exitosamente!")
                 logger.info("Datos guardados correctamente")
             except Exception as e:
                 logger.error(f"Error al guardar los datos: {str(e)}")
                 st.error("Error al guardar los datos")
 
+    st.markdown("### Importación masiva")
+    with st.form("formulario_importacion"):
+        archivo = st.file_uploader(
+            "Archivo CSV o Excel",
+            type=["csv", "xlsx", "xls"],
+            help="Registros con el esquema de la aplicación o exportaciones de 'Mis Comprobantes' de AFIP"
+        )
+        formato = st.radio(
+            "Formato",
+            importacion.FORMATOS,
+            format_func=lambda f: {"registros": "Registros mensuales", "afip": "AFIP Mis Comprobantes"}[f],
+            horizontal=True
+        )
+        entidad_importacion = st.text_input(
+            "Entidad",
+            help="Se asigna a las filas que no indican su entidad (opcional)"
+        )
+        importar = st.form_submit_button("Importar")
+
+        if importar and archivo is not None:
+            try:
+                resultado = importacion.importar(
+                    archivo, almacen_compartido(), formato,
+                    entidad=entidad_importacion.strip() or None
+                )
+                st.success(
+                    f"✅ {resultado.registros} registros importados de {resultado.filas_leidas} filas "
+                    f"({resultado.filas_por_segundo:,.0f} filas/s)"
+                )
+                if resultado.filas_invalidas:
+                    st.warning(f"⚠️ Se descartaron {resultado.filas_invalidas} filas inválidas")
+                    for error in resultado.errores:
+                        st.text(error)
+                logger.info(f"Importación completada en {resultado.segundos:.2f} s")
+            except Exception as e:
+                logger.error(f"Error al importar el archivo: {str(e)}")
+                st.error("Error al importar el archivo")
+
 
-def mostrar_analisis_mensual():
+def mostrar_analisis_mensual(entidad=None):
     st.header("📅 Análisis Mensual")
 
-    if st.session_state.datos_financieros.empty:
+    almacen = almacen_compartido().actualizar()
+    if almacen.empty:
         st.warning("⚠️ No hay datos disponibles para analizar")
         return
 
     # Obtener análisis mensual
     try:
-        df_mensual = dm.analisis_mensual(st.session_state.datos_financieros)
+        df_mensual, meses = analisis_mensual_cacheado(almacen, almacen.version, entidad)
+        graficos = graficos_cacheados(df_mensual, almacen.version, f'analisis_mensual:{entidad}')
     except Exception as e:
         logger.error(f"Error al generar el análisis mensual: {str(e)}")
         st.error("Error al generar el análisis mensual")
         return
 
+    if df_mensual.empty:
+        st.warning("⚠️ No hay datos disponibles para analizar")
+        return
+
     # Selector de mes
-    meses = df_mensual.index.strftime('%B %Y').tolist()
     mes_seleccionado = st.selectbox("Seleccione el mes", meses)
-    df_mes = df_mensual.loc[df_mensual.index.strftime('%B %Y') == mes_seleccionado]
+    df_mes = df_mensual.iloc[[meses.index(mes_seleccionado)]]
 
     # Mostrar resumen del mes
     col1, col2, col3 = st.columns(3)
@@ -220,28 +343,29 @@ def mostrar_analisis_mensual():
 
     with col1:
         st.plotly_chart(
-            viz.grafico_barras_comparativo(df_mensual),
+            graficos['facturacion'],
             use_container_width=True
         )
         st.plotly_chart(
-            viz.grafico_impuestos(df_mensual),
+            graficos['impuestos'],
             use_container_width=True
         )
 
     with col2:
         st.plotly_chart(
-            viz.grafico_barras_gastos(df_mensual),
+            graficos['gastos'],
             use_container_width=True
         )
         st.plotly_chart(
-            viz.grafico_lineas_temporales(df_mensual),
+            graficos['lineas'],
             use_container_width=True
         )
 
-def mostrar_analisis_temporal():
+def mostrar_analisis_temporal(entidad=None):
     st.header("📈 Análisis Temporal")
 
-    if st.session_state.datos_financieros.empty:
+    almacen = almacen_compartido().actualizar()
+    if almacen.empty:
         st.warning("⚠️ No hay datos disponibles para analizar")
         return
 
@@ -251,10 +375,8 @@ def mostrar_analisis_temporal():
     )
 
     try:
-        df_analisis = dm.agrupar_por_periodo(
-            st.session_state.datos_financieros,
-            periodo
-        )
+        df_analisis = agrupar_por_periodo_cacheado(almacen, almacen.version, periodo, entidad)
+        graficos = graficos_cacheados(df_analisis, almacen.version, f'periodo:{periodo}:{entidad}')
     except Exception as e:
         logger.error(f"Error al generar el análisis temporal: {str(e)}")
         st.error("Error al generar el análisis temporal")
@@ -264,33 +386,112 @@ def mostrar_analisis_temporal():
 
     with col1:
         st.plotly_chart(
-            viz.grafico_lineas_temporales(df_analisis),
+            graficos['lineas'],
             use_container_width=True
         )
         st.plotly_chart(
-            viz.grafico_impuestos(df_analisis),
+            graficos['impuestos'],
             use_container_width=True
         )
 
     with col2:
         st.plotly_chart(
-            viz.grafico_barras_comparativo(df_analisis),
+            graficos['facturacion'],
             use_container_width=True
         )
         st.plotly_chart(
-            viz.grafico_barras_gastos(df_analisis),
+            graficos['gastos'],
             use_container_width=True
         )
 
-def mostrar_estadisticas():
+    st.subheader("Detalle por período")
+    tabla = df_analisis.copy()
+    tabla.index = tabla.index.strftime('%m/%Y')
+    st.dataframe(utils.formatear_montos(tabla), use_container_width=True)
+
+def mostrar_tendencias(entidad=None):
+    st.header("📉 Tendencias")
+
+    almacen = almacen_compartido().actualizar()
+    if almacen.empty:
+        st.warning("⚠️ No hay datos disponibles para analizar")
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        meses = st.slider("Meses a mostrar", min_value=12, max_value=120, value=24, step=12)
+    with col2:
+        periodos = st.selectbox("Meses del promedio móvil", [3, 6, 12])
+
+    try:
+        df_ventanas = ventanas_cacheadas(almacen, almacen.version, meses, periodos, entidad)
+        graficos = graficos_ventanas_cacheados(
+            df_ventanas, almacen.version, periodos, f'ventanas:{meses}:{periodos}:{entidad}'
+        )
+    except Exception as e:
+        logger.error(f"Error al calcular las tendencias: {str(e)}")
+        st.error("Error al calcular las tendencias")
+        return
+
+    if df_ventanas.empty:
+        st.warning("⚠️ No hay datos disponibles para analizar")
+        return
+
+    # Indicadores del último mes con datos
+    ultimo = df_ventanas.iloc[-1]
+    st.caption(f"Últimos 12 meses hasta {df_ventanas.index[-1].strftime('%m/%Y')}")
+    col1, col2, col3, col4 = st.columns(4)
+    for columna, titulo, medida in [
+        (col1, "Facturación", 'facturacion_total'),
+        (col2, "Gastos", 'gastos_totales'),
+        (col3, "Utilidad", 'utilidad')
+    ]:
+        variacion = ultimo[f'{medida}_interanual']
+        with columna:
+            st.metric(
+                titulo,
+                utils.formato_moneda(ultimo[f'{medida}_12m']),
+                delta=None if pd.isna(variacion) else f"{variacion:+.1%} interanual".replace('.', ','),
+                delta_color="inverse" if medida == 'gastos_totales' else "normal",
+                help="La variación compara el último mes con el mismo mes del año anterior"
+            )
+    with col4:
+        st.metric("Utilidad Acumulada", utils.formato_moneda(ultimo['utilidad_acumulado']))
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.plotly_chart(
+            graficos['totales'],
+            use_container_width=True
+        )
+        st.plotly_chart(
+            graficos['interanual'],
+            use_container_width=True
+        )
+
+    with col2:
+        st.plotly_chart(
+            graficos['promedios'],
+            use_container_width=True
+        )
+        st.plotly_chart(
+            graficos['acumulada'],
+            use_container_width=True
+        )
+
+def mostrar_estadisticas(entidad=None):
     st.header("📊 Estadísticas Financieras")
 
-    if st.session_state.datos_financieros.empty:
+    almacen = almacen_compartido().actualizar()
+    if almacen.empty:
         st.warning("⚠️ No hay datos disponibles para analizar")
         return
 
     try:
-        stats = dm.calcular_estadisticas(st.session_state.datos_financieros)
+        stats = estadisticas_cacheadas(almacen, almacen.version, entidad)
+        df_mensual, _ = analisis_mensual_cacheado(almacen, almacen.version, entidad)
+        graficos = graficos_cacheados(df_mensual, almacen.version, f'analisis_mensual:{entidad}')
     except Exception as e:
         logger.error(f"Error al calcular las estadísticas: {str(e)}")
         st.error("Error al calcular las estadísticas")
@@ -319,13 +520,24 @@ def mostrar_estadisticas():
 
     with col2:
         st.plotly_chart(
-            viz.grafico_lineas_temporales(st.session_state.datos_financieros),
+            graficos['lineas'],
             use_container_width=True
         )
 
+    formato = st.selectbox(
+        "Formato de exportación",
+        ["csv", "parquet", "excel"],
+        format_func=lambda f: {"csv": "CSV", "parquet": "Parquet", "excel": "Excel"}[f]
+    )
+
+    montos_con_formato = formato != "parquet" and st.checkbox(
+        "Montos con formato de moneda ($1.234,56)",
+        help="Para leer el archivo directamente; desactivar si se va a procesar en otra herramienta"
+    )
+
     if st.button("Exportar Datos"):
         try:
-            utils.exportar_datos(st.session_state.datos_financieros)
+            utils.exportar_datos(almacen, formato, montos_con_formato)
             logger.info("Datos exportados correctamente")
         except Exception as e:
             logger.error(f"Error al exportar los datos: {str(e)}")
@@ -0,0 +1,253 @@
+import bisect
+import collections
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Límites de los histogramas de duración, en segundos
+LIMITES_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Con FACTURACION_PERFILAR_LENTOS (segundos) se perfila cada pedido por
+# muestreo y se guardan las pilas de los que tardan más que ese umbral
+UMBRAL_PERFIL = os.environ.get('FACTURACION_PERFILAR_LENTOS')
+UMBRAL_PERFIL = float(UMBRAL_PERFIL) if UMBRAL_PERFIL else None
+DIRECTORIO_PERFILES = os.environ.get('FACTURACION_PERFILES', 'perfiles')
+INTERVALO_MUESTREO = 0.005
+
+_registro = []
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _etiquetas(nombres, valores, extra=None):
+    pares = list(zip(nombres, valores))
+    if extra is not None:
+        pares.append(extra)
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in pares) + '}'
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor))
+
+class Histograma:
+    """Distribución de valores (por ejemplo duraciones) por combinación de etiquetas."""
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LIMITES_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.limites = tuple(limites)
+        self._series = {}
+        self._bloqueo = threading.Lock()
+        _registro.append(self)
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(etiquetas[e] for e in self.etiquetas)
+        posicion = bisect.bisect_left(self.limites, valor)
+        with self._bloqueo:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.limites) + 1), 0.0]
+            serie[0][posicion] += 1
+            serie[1] += valor
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        """Observa la duración del bloque, aunque termine con una excepción."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def exponer(self):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} histogram']
+        with self._bloqueo:
+            series = [(clave, list(conteos), suma) for clave, (conteos, suma) in self._series.items()]
+        for clave, conteos, suma in sorted(series):
+            acumulado = 0
+            for limite, conteo in zip(self.limites + (float('inf'),), conteos):
+                acumulado += conteo
+                etiquetas = _etiquetas(self.etiquetas, clave, ('le', _numero(limite)))
+                lineas.append(f'{self.nombre}_bucket{etiquetas} {acumulado}')
+            etiquetas = _etiquetas(self.etiquetas, clave)
+            lineas.append(f'{self.nombre}_sum{etiquetas} {_numero(suma)}')
+            lineas.append(f'{self.nombre}_count{etiquetas} {acumulado}')
+        return lineas
+
+class Indicador:
+    """Valor instantáneo (por ejemplo un tamaño) por combinación de etiquetas."""
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._bloqueo = threading.Lock()
+        _registro.append(self)
+
+    def fijar(self, valor, **etiquetas):
+        clave = tuple(etiquetas[e] for e in self.etiquetas)
+        with self._bloqueo:
+            self._valores[clave] = valor
+
+    def exponer(self):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} gauge']
+        with self._bloqueo:
+            valores = sorted(self._valores.items())
+        for clave, valor in valores:
+            lineas.append(f'{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}')
+        return lineas
+
+PEDIDOS = Histograma(
+    'facturacion_api_pedido_segundos', "Duración de los pedidos a la API", ['endpoint', 'metodo', 'estado']
+)
+ETAPAS = Histograma('facturacion_etapa_segundos', "Duración de las etapas internas de cálculo", ['etapa'])
+RETRASO_BUCLE = Histograma(
+    'facturacion_bucle_eventos_retraso_segundos', "Demora del bucle de eventos en retomar una tarea programada"
+)
+REGISTROS = Indicador('facturacion_registros', "Registros en memoria por entidad", ['entidad'])
+MESES = Indicador('facturacion_meses', "Meses con datos en memoria")
+BYTES = Indicador('facturacion_memoria_bytes', "Bytes de los arreglos del almacén en memoria")
+ARRANQUE = Indicador('facturacion_arranque_segundos', "Duración de cada etapa del arranque del proceso", ['etapa'])
+LOTES_DIARIO = Histograma(
+    'facturacion_diario_lotes', "Lotes confirmados con cada fsync del diario de escritura",
+    limites=(1, 2, 4, 8, 16, 32, 64)
+)
+BYTES_DIARIO = Indicador('facturacion_diario_bytes', "Bytes del diario de escritura pendientes de volcar a Parquet")
+
+def etapa(nombre):
+    """Mide la duración de una etapa interna; uso: `with metricas.etapa('estadisticas.resumen'):`."""
+    return ETAPAS.medir(etapa=nombre)
+
+@contextmanager
+def arranque(nombre):
+    """Mide una etapa del arranque (importaciones, carga de datos, precalentado) para el informe."""
+    inicio = time.perf_counter()
+    yield
+    ARRANQUE.fijar(time.perf_counter() - inicio, etapa=nombre)
+
+def informe_arranque():
+    """Devuelve los segundos de cada etapa del arranque medida hasta ahora."""
+    with ARRANQUE._bloqueo:
+        return {clave[0]: round(segundos, 4) for clave, segundos in ARRANQUE._valores.items()}
+
+def exponer():
+    """Devuelve todas las métricas en el formato de texto de Prometheus."""
+    lineas = []
+    for metrica in _registro:
+        lineas.extend(metrica.exponer())
+    return '\n'.join(lineas) + '\n'
+
+# Archivos de la biblioteca estándar donde esperan los hilos ociosos
+_ESPERAS = ('threading.py', 'selectors.py', 'queue.py', 'thread.py')
+
+class Muestreador:
+    """Perfilador por muestreo: anota periódicamente la pila de los hilos que se le indican.
+
+    Un solo hilo muestrea a todos los pedidos perfilados y cada hilo seguido
+    suma sus pilas en las de su pedido, en formato "plegado" (funciones
+    separadas por ';' y la cantidad de muestras), que leen flamegraph.pl y
+    speedscope. Mientras no sigue a ningún hilo, espera sin despertarse.
+    """
+
+    def __init__(self, intervalo=INTERVALO_MUESTREO):
+        self.intervalo = intervalo
+        self._seguidos = {}
+        self._bloqueo = threading.Lock()
+        self._hay_seguidos = threading.Event()
+        self._hilo = None
+
+    def seguir(self, hilo, pilas):
+        """Empieza a sumar en `pilas` (un Counter) las muestras del hilo `hilo`."""
+        with self._bloqueo:
+            self._seguidos[hilo] = pilas
+            self._hay_seguidos.set()
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._muestrear, name='muestreador', daemon=True)
+                self._hilo.start()
+
+    def dejar(self, hilo):
+        with self._bloqueo:
+            self._seguidos.pop(hilo, None)
+            if not self._seguidos:
+                self._hay_seguidos.clear()
+
+    def _muestrear(self):
+        while True:
+            self._hay_seguidos.wait()
+            time.sleep(self.intervalo)
+            with self._bloqueo:
+                seguidos = list(self._seguidos.items())
+            marcos = sys._current_frames()
+            for hilo, pilas in seguidos:
+                marco = marcos.get(hilo)
+                if marco is None or os.path.basename(marco.f_code.co_filename) in _ESPERAS:
+                    continue
+                pila = []
+                while marco is not None:
+                    pila.append(f'{marco.f_code.co_name} ({os.path.basename(marco.f_code.co_filename)})')
+                    marco = marco.f_back
+                with self._bloqueo:
+                    # Si el hilo ya terminó su pedido, la muestra no es de ese pedido
+                    if self._seguidos.get(hilo) is pilas:
+                        pilas[';'.join(reversed(pila))] += 1
+
+MUESTREADOR = Muestreador()
+
+# Pilas del pedido que se está perfilando; pasa a los hilos del pool junto con el contexto
+_pilas_pedido = contextvars.ContextVar('pilas_pedido', default=None)
+
+def _guardar_pilas(pilas, ruta):
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        for pila, muestras in pilas.most_common():
+            archivo.write(f'{pila} {muestras}\n')
+
+@contextmanager
+def perfilar_si_lento(nombre, umbral=None):
+    """Perfila el bloque si está activado y guarda las pilas solo si supera el umbral.
+
+    Sin umbral (ni FACTURACION_PERFILAR_LENTOS) no hace nada. Se muestrean
+    solo los hilos que trabajan para el bloque (ver `hilo_del_pedido`), no
+    los de otros pedidos. Las pilas se guardan en DIRECTORIO_PERFILES como
+    '<fecha>-<nombre>.folded'.
+    """
+    umbral = UMBRAL_PERFIL if umbral is None else umbral
+    if umbral is None:
+        yield
+        return
+
+    pilas = collections.Counter()
+    marca = _pilas_pedido.set(pilas)
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        _pilas_pedido.reset(marca)
+        if time.perf_counter() - inicio >= umbral and pilas:
+            nombre = ''.join(c if c.isalnum() else '_' for c in nombre).strip('_') or 'pedido'
+            momento = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}"
+            _guardar_pilas(pilas, os.path.join(DIRECTORIO_PERFILES, f'{momento}-{nombre}-{os.getpid()}.folded'))
+
+def hilo_del_pedido(funcion):
+    """Decora una función que corre en un hilo del pool para muestrear ese hilo con el pedido que la llamó."""
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        pilas = _pilas_pedido.get()
+        if pilas is None:
+            return funcion(*args, **kwargs)
+        hilo = threading.get_ident()
+        MUESTREADOR.seguir(hilo, pilas)
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            MUESTREADOR.dejar(hilo)
+    return envoltura
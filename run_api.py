@@ -1,7 +1,42 @@
+import argparse
+import os
 import uvicorn
-from api import api
 
-import uvicorn
+def preparar_instantanea():
+    """Deja al día la instantánea mapeada para que todos los procesos compartan los datos."""
+    import compartido
+
+    compartido.AlmacenCompartido().compactar()
+
+def main():
+    parser = argparse.ArgumentParser(description="Inicia la API financiera para Power BI.")
+    parser.add_argument('--produccion', action='store_true',
+                        help="Varios procesos, sin recarga automática y con cierre ordenado")
+    parser.add_argument('--host', help="Dirección de escucha (localhost, o 0.0.0.0 en producción)")
+    parser.add_argument('--puerto', type=int, default=8000)
+    parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1,
+                        help="Cantidad de procesos en producción (por omisión, uno por núcleo)")
+    parser.add_argument('--espera-cierre', type=int, default=30,
+                        help="Segundos para terminar los pedidos en curso al detenerse")
+    args = parser.parse_args()
+
+    if not args.produccion:
+        uvicorn.run("api:api", host=args.host or "localhost", port=args.puerto, reload=True)
+        return
+
+    preparar_instantanea()
+    # loop y http en 'auto' usan uvloop y httptools cuando están instalados (uvicorn[standard]).
+    # SIGHUP reinicia los procesos de a uno y SIGTERM espera a los pedidos en curso.
+    uvicorn.run(
+        "api:api",
+        host=args.host or "0.0.0.0",
+        port=args.puerto,
+        workers=args.procesos,
+        loop='auto',
+        http='auto',
+        timeout_graceful_shutdown=args.espera_cierre,
+        access_log=False
+    )
 
 if __name__ == "__main__":
-    uvicorn.run("api:api", host="localhost", port=8000, reload=True)
\ No newline at end of file
+    main()
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos del proyecto están en la raíz del repositorio y el generador de datos, en benchmarks
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, 'benchmarks'))
+
+@pytest.fixture
+def cliente(tmp_path, monkeypatch):
+    """Cliente de la API sobre un almacén vacío en una carpeta temporal."""
+    from fastapi.testclient import TestClient
+    import api
+    import compartido
+
+    monkeypatch.setattr(api, '_almacen_compartido', compartido.AlmacenCompartido(str(tmp_path / 'datos')))
+    monkeypatch.setattr(api, '_cache_respuestas', {})
+    return TestClient(api.api)
@@ -0,0 +1,204 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+import api
+
+def _registrar(entidad='Norte'):
+    api.almacen_compartido().registrar([
+        {'fecha': pd.Timestamp(2024, 1, 1), 'entidad': entidad, 'facturacion_a': 1000.0, 'gastos_operativos': 200.0}
+    ])
+
+def test_estadisticas_de_entidad_desconocida(cliente):
+    _registrar()
+    for parametros in ['?entidad=Sur', '?entidad=Sur&percentiles=50']:
+        respuesta = cliente.get(f'/datos/estadisticas{parametros}')
+        assert respuesta.status_code == 200
+        assert respuesta.json() == {}
+
+    respuesta = cliente.get('/datos/estadisticas?entidad=Norte')
+    assert respuesta.status_code == 200
+    assert respuesta.json()['facturacion_total'] == 1000.0
+
+def test_delta_con_cuerpo_invalido(cliente):
+    registro = {'fecha': '2024-01-01', 'facturacion_a': 100.0}
+    for cuerpo in [
+        {'secuencia': None, 'registros': [registro]},
+        {'secuencia': '1', 'registros': [registro]},
+        {'secuencia': 1, 'registros': registro},
+        {'secuencia': 1, 'registros': 'nada'},
+        {'registros': [registro]},
+        [registro],
+    ]:
+        respuesta = cliente.post('/actualizar_datos/delta', json=cuerpo)
+        assert respuesta.status_code == 400, cuerpo
+
+    respuesta = cliente.post('/actualizar_datos/delta', json={'secuencia': 1, 'registros': [registro]})
+    assert respuesta.status_code == 200
+    assert respuesta.json()['secuencia'] == 1
+
+def test_etag_vale_entre_procesos(cliente, monkeypatch):
+    import compartido
+
+    _registrar()
+    etag = cliente.get('/datos/mensuales').headers['etag']
+
+    # Otro worker abre la misma carpeta: la misma ETag le sirve
+    otro = compartido.AlmacenCompartido(api.almacen_compartido().directorio)
+    monkeypatch.setattr(api, '_almacen_compartido', otro)
+    monkeypatch.setattr(api, '_cache_respuestas', {})
+    assert cliente.get('/datos/mensuales', headers={'If-None-Match': etag}).status_code == 304
+
+    # Lo que escribe el segundo cambia la ETag del primero
+    _registrar('Sur')
+    respuesta = cliente.get('/datos/mensuales', headers={'If-None-Match': etag})
+    assert respuesta.status_code == 200
+    assert respuesta.headers['etag'] != etag
+
+def _delta(cliente, secuencia, registros):
+    return cliente.post('/actualizar_datos/delta', json={'secuencia': secuencia, 'registros': registros})
+
+def test_delta_fuera_de_secuencia(cliente):
+    registro = {'fecha': '2024-01-01', 'facturacion_a': 100.0}
+    for secuencia in [0, 2]:
+        respuesta = _delta(cliente, secuencia, [registro])
+        assert respuesta.status_code == 409
+        assert respuesta.json()['detail']['secuencia_actual'] == 0
+
+    assert _delta(cliente, 1, [registro]).status_code == 200
+    # Un reintento del mismo envío no se aplica dos veces
+    assert _delta(cliente, 1, [registro]).status_code == 409
+    assert cliente.get('/actualizar_datos/secuencia').json() == {'secuencia': 1}
+    assert len(api.almacen_compartido().almacen) == 1
+
+def test_delta_reemplaza_por_id_y_agrega_los_nuevos(cliente):
+    respuesta = _delta(cliente, 1, [
+        {'fecha': '2024-01-01', 'entidad': 'Norte', 'facturacion_a': 100.0},
+        {'fecha': '2024-02-01', 'entidad': 'Norte', 'facturacion_a': 200.0},
+    ])
+    ids = respuesta.json()['ids']
+    assert len(ids) == 2
+
+    respuesta = _delta(cliente, 2, [
+        {'id': ids[1], 'fecha': '2024-03-01', 'entidad': 'Sur', 'facturacion_a': 250.0},
+        {'fecha': '2024-04-01', 'entidad': 'Norte', 'facturacion_a': 50.0},
+    ])
+    assert respuesta.json()['ids'][0] == ids[1]
+    filas = api.almacen_compartido().almacen.filas().set_index('id')
+    assert len(filas) == 3
+    assert filas.loc[ids[1], 'facturacion_a'] == 250.0 and filas.loc[ids[1], 'entidad'] == 'Sur'
+
+    # Un id desconocido rechaza el lote entero y no avanza la secuencia
+    assert _delta(cliente, 3, [{'id': 999, 'fecha': '2024-01-01'}]).status_code == 422
+    assert cliente.get('/actualizar_datos/secuencia').json() == {'secuencia': 2}
+
+def test_delta_en_arrow(cliente):
+    import pyarrow as pa
+
+    tabla = pa.table({'fecha': pa.array([pd.Timestamp(2024, 1, 1)]), 'facturacion_b': [300.0]})
+    cuerpo = pa.BufferOutputStream()
+    with pa.ipc.new_stream(cuerpo, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+    respuesta = cliente.post(
+        '/actualizar_datos/delta', content=cuerpo.getvalue().to_pybytes(),
+        headers={'Content-Type': api.TIPO_ARROW, 'X-Secuencia': '1'}
+    )
+    assert respuesta.status_code == 200
+    assert api.almacen_compartido().almacen.filas()['facturacion_b'].tolist() == [300.0]
+
+    # Sin la secuencia en el encabezado el cuerpo es inválido
+    respuesta = cliente.post('/actualizar_datos/delta', content=b'', headers={'Content-Type': api.TIPO_ARROW})
+    assert respuesta.status_code == 400
+
+def test_reemplazo_completo_fija_la_secuencia(cliente):
+    _delta(cliente, 1, [{'fecha': '2024-01-01', 'facturacion_a': 1.0}])
+    respuesta = cliente.post('/actualizar_datos', json={
+        'secuencia': 10, 'datos': [{'fecha': '2024-05-01', 'facturacion_a': 7.0}, {'fecha': '2024-06-01'}]
+    })
+    assert respuesta.status_code == 200
+    assert cliente.get('/actualizar_datos/secuencia').json() == {'secuencia': 10}
+    assert len(api.almacen_compartido().almacen) == 2
+    assert _delta(cliente, 11, [{'fecha': '2024-07-01'}]).status_code == 200
+
+def test_respuestas_cacheadas_hasta_que_cambian_los_datos(cliente, monkeypatch):
+    import data_manager as dm
+
+    llamadas = []
+    analisis_mensual = dm.analisis_mensual
+    monkeypatch.setattr(dm, 'analisis_mensual', lambda *args: llamadas.append(args) or analisis_mensual(*args))
+    _registrar()
+
+    primera = cliente.get('/datos/mensuales')
+    segunda = cliente.get('/datos/mensuales')
+    assert len(llamadas) == 1 and primera.content == segunda.content
+    assert primera.headers['etag'] == segunda.headers['etag']
+    # Cada consulta distinta tiene su propia ETag
+    assert cliente.get('/datos/mensuales?formato=columnas').headers['etag'] != primera.headers['etag']
+
+    respuesta = cliente.get('/datos/mensuales', headers={'If-None-Match': primera.headers['etag']})
+    assert respuesta.status_code == 304 and respuesta.content == b''
+
+    _registrar()
+    respuesta = cliente.get('/datos/mensuales', headers={'If-None-Match': primera.headers['etag']})
+    assert respuesta.status_code == 200
+    assert respuesta.json()[0]['facturacion_a'] == 2000.0
+
+def test_datos_mensuales_filtrados_y_paginados(cliente):
+    from generador import generar_datos
+
+    api.almacen_compartido().registrar(generar_datos(500, entidades=2))
+    registros = cliente.get('/datos/mensuales').json()
+    columnas = cliente.get('/datos/mensuales?formato=columnas').json()
+    referencia = api.almacen_compartido().almacen.mensual.a_dataframe()
+
+    assert [r['fecha'] for r in registros] == columnas['fecha']
+    assert columnas['fecha'] == [f.strftime('%Y-%m-%d') for f in referencia.index]
+    assert columnas['utilidad'] == pytest.approx(referencia['utilidad'].tolist())
+    assert [r['facturacion_total'] for r in registros] == columnas['facturacion_total']
+
+    # Los filtros toman meses completos, aunque la fecha caiga a mitad de mes
+    desde, hasta = columnas['fecha'][3], columnas['fecha'][8]
+    filtrados = cliente.get(f'/datos/mensuales?desde={desde[:8]}15&hasta={hasta[:8]}01').json()
+    assert filtrados == registros[3:9]
+    pagina = cliente.get(f'/datos/mensuales?desde={desde}&desplazamiento=2&limite=3').json()
+    assert pagina == registros[5:8]
+    assert cliente.get('/datos/mensuales?limite=0').status_code == 422
+
+def test_entidades_y_filtro_por_entidad(cliente):
+    _registrar('Norte')
+    _registrar('Norte')
+    _registrar('Sur')
+    assert cliente.get('/datos/entidades').json() == [
+        {'entidad': 'Norte', 'registros': 2}, {'entidad': 'Sur', 'registros': 1}
+    ]
+    norte = cliente.get('/datos/mensuales?entidad=Norte').json()
+    todas = cliente.get('/datos/mensuales').json()
+    assert norte[0]['facturacion_a'] == 2000.0 and todas[0]['facturacion_a'] == 3000.0
+    assert cliente.get('/datos/categorias?entidad=Sur').json()['facturacion']['A'] == 1000.0
+
+def test_importar_la_api_no_carga_los_modulos_de_datos():
+    codigo = (
+        "import sys, api; "
+        "print(sorted(m for m in ['pandas', 'pyarrow', 'data_manager', 'compartido', 'plotly'] if m in sys.modules))"
+    )
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    resultado = subprocess.run([sys.executable, '-c', codigo], cwd=raiz, capture_output=True, text=True, check=True)
+    assert resultado.stdout.strip() == '[]'
+
+def test_listo_despues_de_precalentar(cliente):
+    from fastapi.testclient import TestClient
+
+    _registrar()
+    respuesta = cliente.get('/listo')
+    assert respuesta.status_code == 503 and respuesta.json()['listo'] is False
+
+    # Al entrar se ejecuta el ciclo de vida, que precalienta antes de atender
+    with TestClient(api.api) as precalentado:
+        respuesta = precalentado.get('/listo')
+        assert respuesta.status_code == 200
+        assert {'modulos', 'datos', 'respuestas'} <= set(respuesta.json()['arranque'])
+        assert ('/datos/mensuales', '') in api._cache_respuestas
+    assert cliente.get('/listo').status_code == 503
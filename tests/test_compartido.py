@@ -0,0 +1,176 @@
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import compartido
+import data_manager as dm
+from generador import generar_datos
+
+def _filas(almacen):
+    return almacen.filas().astype({'entidad': str}).reset_index(drop=True)
+
+def test_escrituras_sobre_instantanea_no_copian_la_base(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    escritor = compartido.AlmacenCompartido(directorio)
+    escritor.reemplazar(generar_datos(5000, entidades=3))
+    escritor.compactar()
+
+    lector = compartido.AlmacenCompartido(directorio)
+    base = lector.almacen._base
+    assert base is not None
+
+    escritor.registrar(generar_datos(20, entidades=3, semilla=1))
+    modificados = escritor.almacen.filas([3, 4999, 5010]).assign(facturacion_a=1.0, entidad='Otra')
+    escritor.registrar(modificados)
+
+    almacen = lector.actualizar()
+    # La base sigue siendo la instantánea mapeada; lo nuevo está en la cola y el parche
+    assert almacen._base is base
+    assert almacen._cola == 20
+    assert len(almacen._parche.posiciones) == 2
+
+    referencia = dm.AlmacenColumnar.desde_dataframe(almacen.filas())
+    pd.testing.assert_frame_equal(_filas(almacen), _filas(referencia))
+    pd.testing.assert_frame_equal(dm.analisis_mensual(almacen), dm.analisis_mensual(referencia))
+    assert np.array_equal(almacen.bloque('Otra'), referencia.bloque('Otra'))
+    pd.testing.assert_frame_equal(_filas(almacen), _filas(compartido.AlmacenCompartido(directorio).almacen))
+
+def test_los_lectores_remapean_la_instantanea_nueva(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    escritor = compartido.AlmacenCompartido(directorio)
+    escritor.reemplazar(generar_datos(1000, entidades=3))
+    escritor.compactar()
+    lector = compartido.AlmacenCompartido(directorio)
+
+    escritor.registrar(generar_datos(10, entidades=3, semilla=2))
+    assert lector.actualizar()._cola == 10
+    escritor.compactar()
+    almacen = lector.actualizar()
+    assert almacen._cola == 0 and len(almacen) == 1010
+
+def test_reemplazo_cortado_conserva_los_datos_anteriores(tmp_path, monkeypatch):
+    directorio = str(tmp_path / 'datos')
+    almacen = compartido.AlmacenCompartido(directorio)
+    almacen.reemplazar(generar_datos(100, entidades=2))
+    antes = _filas(almacen.almacen)
+
+    # Se corta después de apartar los datos anteriores y antes de poner los nuevos
+    reemplazar = os.replace
+    def cortar(origen, destino):
+        if os.path.basename(origen).startswith('datos.tmp-'):
+            raise OSError('corte')
+        reemplazar(origen, destino)
+    with monkeypatch.context() as m:
+        m.setattr(dm.os, 'replace', cortar)
+        with pytest.raises(OSError):
+            almacen.reemplazar(generar_datos(10, entidades=2, semilla=1))
+    assert not os.path.isdir(directorio)
+
+    reabierto = compartido.AlmacenCompartido(directorio)
+    pd.testing.assert_frame_equal(_filas(reabierto.almacen), antes)
+    assert sorted(os.listdir(tmp_path)) == ['datos', 'datos.bloqueo']
+
+    reabierto.reemplazar(generar_datos(10, entidades=2, semilla=1))
+    assert len(compartido.AlmacenCompartido(directorio).almacen) == 10
+    assert sorted(os.listdir(tmp_path)) == ['datos', 'datos.bloqueo']
+
+ESCRIBIR_EN_OTRO_PROCESO = """
+import sys
+sys.path[:0] = sys.argv[2:]
+import compartido
+from generador import generar_datos
+
+almacen = compartido.AlmacenCompartido(sys.argv[1])
+almacen.registrar(generar_datos(300, entidades=2, semilla=5))
+almacen.registrar(almacen.almacen.filas([0]).assign(facturacion_a=7.0))
+"""
+
+def test_lo_escrito_por_otro_proceso_se_ve_sin_recargar(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    lector = compartido.AlmacenCompartido(directorio)
+    lector.registrar(generar_datos(50, entidades=2))
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run(
+        [sys.executable, '-c', ESCRIBIR_EN_OTRO_PROCESO, directorio, raiz, os.path.join(raiz, 'benchmarks')],
+        check=True, timeout=120
+    )
+
+    almacen = lector.actualizar()
+    assert len(almacen) == 350 and almacen.filas([0])['facturacion_a'].item() == 7.0
+    pd.testing.assert_frame_equal(_filas(almacen), _filas(compartido.AlmacenCompartido(directorio).almacen))
+
+    # Un reemplazo completo desde otra instancia se vuelve a cargar entero
+    compartido.AlmacenCompartido(directorio).reemplazar(generar_datos(10, entidades=1), secuencia=4)
+    assert len(lector.actualizar()) == 10 and dm.leer_secuencia(directorio) == 4
+
+def test_las_instantaneas_no_cambian_con_las_escrituras_posteriores():
+    original = dm.AlmacenColumnar.desde_dataframe(generar_datos(100, entidades=2))
+    antes = _filas(original)
+    mensual = dm.analisis_mensual(original)
+
+    copia = original.copia()
+    copia.agregar(generar_datos(30, entidades=3, semilla=1))
+    copia.aplicar_cambios(copia.filas([0, 5]).assign(facturacion_a=1.0, entidad='Otra'))
+    otra = original.copia()
+    otra.agregar(generar_datos(5, entidades=1, semilla=2))
+
+    pd.testing.assert_frame_equal(_filas(original), antes)
+    pd.testing.assert_frame_equal(dm.analisis_mensual(original), mensual)
+    assert len(copia) == 130 and len(otra) == 105
+    assert copia.filas([0])['facturacion_a'].item() == 1.0
+    assert 'Otra' not in original.entidades and 'Otra' not in otra.entidades
+
+def test_altas_concurrentes_desde_varios_hilos(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    almacen = compartido.AlmacenCompartido(directorio)
+    registros = generar_datos(160, entidades=4).to_dict('records')
+    vistas, ids = [], []
+
+    def registrar(parte):
+        for registro in parte:
+            ids.extend(almacen.registrar([registro]))
+            vistas.append(almacen.almacen)
+
+    hilos = [threading.Thread(target=registrar, args=(registros[i::8],)) for i in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert sorted(ids) == list(range(1, 161))
+    assert len(almacen.almacen) == 160
+    # Cada instantánea vista durante las altas es coherente con su propia tabla mensual
+    for vista in vistas[::20]:
+        assert vista.mensual.a_dataframe()['facturacion_a'].sum() == pytest.approx(vista.filas()['facturacion_a'].sum())
+    pd.testing.assert_frame_equal(_filas(compartido.AlmacenCompartido(directorio).almacen), _filas(almacen.almacen))
+
+def test_actualizar_no_espera_a_un_escritor(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    escritor = compartido.AlmacenCompartido(directorio)
+    escritor.registrar(generar_datos(10, entidades=1))
+    escritor.volcar()
+    bloqueado, liberar = threading.Event(), threading.Event()
+
+    def escribir():
+        with escritor.bloqueo():
+            bloqueado.set()
+            liberar.wait()
+
+    hilo = threading.Thread(target=escribir)
+    hilo.start()
+    bloqueado.wait()
+    try:
+        # Otro proceso agregó datos, pero mientras se escribe se entrega la instantánea vigente
+        anterior = escritor.almacen
+        nuevos = generar_datos(5, entidades=1, semilla=3).assign(id=range(100, 105))
+        dm.anotar_cambio(dm.guardar_registros(nuevos, directorio), directorio)
+        assert escritor.actualizar() is anterior
+    finally:
+        liberar.set()
+        hilo.join()
+    assert len(escritor.actualizar()) == 15 and len(anterior) == 10
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+import comprobantes
+
+def _comprobantes_al_azar(cantidad, semilla=0):
+    generador = np.random.default_rng(semilla)
+    return pd.DataFrame({
+        'fecha': pd.Timestamp('2023-01-01') + pd.to_timedelta(generador.integers(0, 730, cantidad), unit='D'),
+        # Incluye un tipo que no suma a la facturación (recibo)
+        'tipo': generador.choice(comprobantes.CODIGOS_ADMITIDOS + [15, 4, 99], cantidad),
+        'entidad': generador.choice(['Norte', 'Sur', 'Oeste'], cantidad),
+        'importe': generador.integers(1, 10 ** 8, cantidad),
+    })
+
+def _mensual_de_referencia(df):
+    letras = {codigo: columna for columna, codigos in comprobantes.CODIGOS_AFIP.items() for codigo in codigos}
+    df = df[df['tipo'].isin(list(letras))]
+    signos = np.where(df['tipo'].isin(comprobantes.NOTAS_CREDITO_AFIP), -1, 1)
+    df = df.assign(
+        mes=df['fecha'].dt.to_period('M').dt.to_timestamp(), columna=df['tipo'].map(letras), importe=df['importe'] * signos
+    )
+    tabla = df.pivot_table(index=['mes', 'entidad'], columns='columna', values='importe', aggfunc='sum', fill_value=0)
+    tabla = tabla.reindex(columns=comprobantes.COLUMNAS_FACTURACION, fill_value=0) / 100
+    return tabla.reset_index().rename(columns={'mes': 'fecha'}).rename_axis(columns=None)
+
+def _ordenado(df):
+    return df.astype({'entidad': str}).sort_values(['fecha', 'entidad'], ignore_index=True)
+
+def test_el_acumulador_coincide_con_los_comprobantes_guardados():
+    datos = _comprobantes_al_azar(5000)
+    almacen = comprobantes.AlmacenComprobantes(capacidad=16)
+    for inicio in range(0, len(datos), 700):
+        lote = datos.iloc[inicio:inicio + 700]
+        almacen.agregar(lote['fecha'].to_numpy(), lote['tipo'], lote['importe'], pd.Categorical(lote['entidad']))
+
+    assert len(almacen) == 5000 and almacen.nbytes == 15 * 5000
+    referencia = _ordenado(_mensual_de_referencia(datos))
+    pd.testing.assert_frame_equal(_ordenado(almacen.mensual()), referencia, check_dtype=False)
+    pd.testing.assert_frame_equal(_ordenado(almacen.acumulador.vaciar(almacen.entidades)), referencia, check_dtype=False)
+    assert len(almacen.acumulador) == 0
+
+def test_guardar_y_leer_con_filtros(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    datos = _comprobantes_al_azar(3000, semilla=1)
+    for inicio in [0, 1000]:
+        lote = datos.iloc[inicio:inicio + 1000]
+        almacen = comprobantes.AlmacenComprobantes()
+        almacen.agregar(lote['fecha'].to_numpy(), lote['tipo'], lote['importe'], lote['entidad'])
+        comprobantes.guardar_comprobantes(almacen, directorio)
+
+    leidos = comprobantes.leer_comprobantes(directorio)
+    guardados = datos.iloc[:2000]
+    tabla = leidos.a_tabla().to_pandas()
+    assert leidos.a_tabla().schema == comprobantes.ESQUEMA_COMPROBANTES
+    assert sorted(zip(pd.to_datetime(tabla['fecha']), tabla['tipo'], tabla['entidad'].astype(str), tabla['importe'])) == (
+        sorted(zip(guardados['fecha'], guardados['tipo'], guardados['entidad'], guardados['importe']))
+    )
+    filtrados = comprobantes.leer_comprobantes(directorio, 'Sur', '2023-06-01', '2023-12-31')
+    esperados = guardados[
+        (guardados['entidad'] == 'Sur') & (guardados['fecha'] >= '2023-06-01') & (guardados['fecha'] <= '2023-12-31')
+    ]
+    assert len(filtrados) == len(esperados)
+    assert {filtrados.entidades[codigo] for codigo in filtrados.columna('entidad')} == {'Sur'}
+    assert sorted(filtrados.columna('importe').tolist()) == sorted(esperados['importe'].tolist())
+    assert comprobantes.guardar_comprobantes(comprobantes.AlmacenComprobantes(), directorio) is None
@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import consultas
+import data_manager as dm
+from generador import generar_datos
+
+MEDIDAS = ['facturacion_total', 'promedio:gastos_operativos', 'maximo:utilidad', 'cantidad:retenciones']
+
+def _referencia(filas, frecuencia):
+    """La misma consulta con un groupby de pandas."""
+    filas = filas.assign(
+        entidad=filas['entidad'].astype(str),
+        fecha=filas['fecha'].dt.to_period(frecuencia).dt.to_timestamp(how='end').dt.normalize(),
+        facturacion_total=filas[['facturacion_a', 'facturacion_b', 'facturacion_c']].sum(axis=1)
+    )
+    grupos = filas.groupby(['entidad', 'fecha'])
+    return pd.DataFrame({
+        'facturacion_total': grupos['facturacion_total'].sum(),
+        'promedio_gastos_operativos': grupos['gastos_operativos'].mean(),
+        'maximo_utilidad': grupos['utilidad'].max(),
+        'cantidad_retenciones': grupos['retenciones'].count(),
+    }).reset_index()
+
+@pytest.mark.parametrize('granularidad, frecuencia', [('mensual', 'M'), ('trimestral', 'Q'), ('anual', 'Y')])
+def test_consulta_coincide_con_pandas_en_memoria_y_en_la_carpeta(tmp_path, granularidad, frecuencia):
+    directorio = str(tmp_path / 'datos')
+    almacen = dm.AlmacenColumnar()
+    dm.registrar(almacen, generar_datos(2000, entidades=3), directorio)
+    referencia = _referencia(almacen.filas(), frecuencia)
+
+    for fuente in [almacen, directorio]:
+        resultado = consultas.consultar(fuente, ['entidad', 'fecha'], MEDIDAS, granularidad=granularidad)
+        resultado['entidad'] = resultado['entidad'].astype(str)
+        pd.testing.assert_frame_equal(resultado, referencia, check_dtype=False)
+
+def test_filtros_por_fecha_y_entidad(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    almacen = dm.AlmacenColumnar()
+    dm.registrar(almacen, generar_datos(2000, entidades=3), directorio)
+    entidad = almacen.entidades[2]
+    filas = almacen.filas()
+    filas = filas[(filas['fecha'] >= '2019-03-01') & (filas['fecha'] <= '2021-06-30') & (filas['entidad'] == entidad)]
+
+    for fuente in [almacen, directorio]:
+        resultado = consultas.consultar(
+            fuente, [], ['utilidad', 'cantidad:utilidad'], desde='2019-03-01', hasta='2021-06-30', entidades=[entidad]
+        )
+        assert resultado['cantidad_utilidad'].item() == len(filas)
+        assert resultado['utilidad'].item() == pytest.approx(filas['utilidad'].sum())
+
+def test_las_particiones_de_otros_anios_no_se_leen(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    dm.registrar(dm.AlmacenColumnar(), generar_datos(500, entidades=1), directorio)
+    # Un archivo ilegible en un año fuera del rango no molesta, porque su carpeta se descarta
+    for raiz, _, archivos in os.walk(directorio):
+        if f'{os.sep}anio=2016' in raiz:
+            for archivo in archivos:
+                with open(os.path.join(raiz, archivo), 'wb') as salida:
+                    salida.write(b'no es parquet')
+
+    resultado = consultas.consultar(directorio, [], ['cantidad:utilidad'], desde='2020-01-01')
+    assert resultado['cantidad_utilidad'].item() > 0
+    with pytest.raises(pa.ArrowInvalid):
+        consultas.consultar(directorio, [], ['cantidad:utilidad'])
+
+def test_ventanas_por_entidad_con_meses_sin_datos():
+    almacen = dm.AlmacenColumnar.desde_dataframe(pd.DataFrame({
+        'fecha': pd.to_datetime(['2024-01-10', '2024-02-10', '2024-04-10', '2024-01-20', '2024-02-20']),
+        'entidad': ['A', 'A', 'A', 'B', 'B'],
+        'facturacion_a': [100.0, 200.0, 400.0, 10.0, 0.0],
+    }))
+    resultado = consultas.consultar(
+        almacen, ['entidad', 'fecha'], ['facturacion_a'],
+        ventanas=['acumulado', 'promedio_movil', 'variacion'], periodos=2
+    )
+    assert resultado['entidad'].tolist() == ['A', 'A', 'A', 'B', 'B']
+    assert resultado['facturacion_a_acumulado'].tolist() == [100.0, 300.0, 700.0, 10.0, 10.0]
+    # Marzo no tiene datos y cuenta como cero
+    assert resultado['facturacion_a_promedio_movil'].tolist() == [50.0, 150.0, 200.0, 5.0, 5.0]
+    variacion = resultado['facturacion_a_variacion'].tolist()
+    assert np.isnan(variacion[0]) and variacion[1] == 1.0 and np.isnan(variacion[2])
+    assert variacion[4] == -1.0
+
+@pytest.mark.parametrize('parametros', [
+    'medidas=nada', 'medidas=mediana:utilidad', 'dimensiones=mes', 'granularidad=semanal',
+    'ventanas=acumulado&dimensiones=entidad', 'ventanas=otra', 'periodos=0'
+])
+def test_consulta_invalida(cliente, parametros):
+    assert cliente.get(f'/datos/consulta?{parametros}').status_code == 422
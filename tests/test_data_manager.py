@@ -0,0 +1,232 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_manager as dm
+from generador import generar_datos
+
+REGISTRO = {'fecha': '2024-03-15', 'entidad': 'Norte', 'facturacion_a': 1000.5, 'gastos_operativos': 200.0}
+
+@pytest.mark.parametrize('registro', [
+    REGISTRO,
+    {**REGISTRO, 'entidad': None},
+    {**REGISTRO, 'entidad': ''},
+    {**REGISTRO, 'entidad': 7},
+    {clave: valor for clave, valor in REGISTRO.items() if clave != 'entidad'},
+    {**REGISTRO, 'facturacion_b': None, 'otros_gastos': np.nan, 'retenciones': '12.5'},
+    {**REGISTRO, 'fecha': pd.Timestamp(2024, 3, 15, 10, 30), 'id': 42},
+    {**REGISTRO, 'id': None},
+])
+@pytest.mark.parametrize('recalcular', [True, False])
+def test_un_registro_se_normaliza_igual_que_un_lote(registro, recalcular):
+    if not recalcular:
+        registro = {**registro, **{columna: 1.0 for columna in dm.COLUMNAS_DERIVADAS}}
+    rapido = dm.normalizar_registros([registro], recalcular)
+    lote = dm.normalizar_registros(pd.DataFrame([registro]), recalcular)
+
+    assert np.array_equal(rapido.fechas, lote.fechas)
+    assert np.array_equal(rapido.ids, lote.ids)
+    assert list(np.asarray(rapido.entidades)) == list(np.asarray(lote.entidades))
+    assert rapido.valores.keys() == lote.valores.keys()
+    for columna, valores in lote.valores.items():
+        assert np.array_equal(rapido.valores[columna], valores), columna
+
+def test_un_registro_sin_fecha():
+    with pytest.raises(ValueError):
+        dm.normalizar_registros([{'facturacion_a': 1.0}])
+
+def test_agregar_de_a_uno_equivale_a_un_lote():
+    datos = generar_datos(3000, entidades=3)
+    almacen = dm.AlmacenColumnar(capacidad=4)
+    for registro in datos.to_dict('records'):
+        dm.agregar_registros(almacen, [registro])
+    lote = dm.AlmacenColumnar.desde_dataframe(datos)
+
+    assert len(almacen) == 3000
+    assert np.array_equal(almacen.columna('id'), np.arange(1, 3001))
+    pd.testing.assert_frame_equal(almacen.a_dataframe(), lote.a_dataframe())
+
+    # La tabla materializada se renueva con la próxima escritura
+    anterior = almacen.a_dataframe()
+    dm.agregar_registro(almacen, pd.Timestamp(2024, 1, 1), {'facturacion_a': 10.0})
+    assert len(almacen.a_dataframe()) == 3001 and len(anterior) == 3000
+
+def test_agregar_a_un_dataframe_calcula_igual_que_el_almacen():
+    datos = generar_datos(50, entidades=2)
+    df = dm.agregar_registros(pd.DataFrame(), datos.head(20))
+    df = dm.agregar_registros(df, datos.iloc[20:])
+    almacen = dm.AlmacenColumnar.desde_dataframe(datos)
+    pd.testing.assert_frame_equal(
+        df.astype({'entidad': str}), almacen.a_dataframe().drop(columns='id').astype({'entidad': str})
+    )
+
+def test_ids_nuevos_deben_ser_crecientes():
+    almacen = dm.AlmacenColumnar()
+    almacen.agregar([{'fecha': '2024-01-01', 'id': 5}])
+    for ids in [[5], [7, 6]]:
+        with pytest.raises(ValueError):
+            almacen.agregar(pd.DataFrame({'fecha': ['2024-02-01'] * len(ids), 'id': ids}))
+    assert list(almacen.agregar([{'fecha': '2024-02-01'}])) == [6]
+
+def _mensual_de_referencia(almacen, regla='ME'):
+    filas = almacen.a_dataframe().set_index('fecha')[dm.COLUMNAS_NUMERICAS]
+    return filas.resample(regla).sum()
+
+def test_la_tabla_mensual_se_mantiene_con_cada_lote():
+    datos = generar_datos(2000, entidades=3).sample(frac=1, random_state=1)
+    almacen = dm.AlmacenColumnar()
+    # Lotes desordenados: algunos agregan meses antes del primero y después del último
+    for inicio in range(0, len(datos), 150):
+        dm.agregar_registros(almacen, datos.iloc[inicio:inicio + 150])
+    dm.agregar_registro(almacen, pd.Timestamp(2035, 1, 10), {'facturacion_a': 5.0})
+
+    pd.testing.assert_frame_equal(
+        almacen.mensual.a_dataframe(), _mensual_de_referencia(almacen), check_freq=False, check_names=False
+    )
+    for periodo, regla in [('Bimestral', '2ME'), ('Trimestral', 'QE'), ('Anual', 'YE')]:
+        pd.testing.assert_frame_equal(
+            dm.agrupar_por_periodo(almacen, periodo), _mensual_de_referencia(almacen, regla),
+            check_freq=False, check_names=False
+        )
+
+    primero, ultimo = almacen.mensual.rango()
+    referencia = dm.a_centavos(_mensual_de_referencia(almacen)['utilidad'].cumsum().to_numpy())
+    assert np.array_equal(almacen.mensual.acumulado('utilidad', np.arange(primero, ultimo + 1)), referencia)
+
+def test_la_tabla_mensual_sigue_a_los_registros_modificados():
+    almacen = dm.AlmacenColumnar.desde_dataframe(generar_datos(500, entidades=2))
+    modificados = almacen.filas([0, 1, 499]).assign(fecha=pd.Timestamp(2031, 3, 1), entidad='Otra')
+    almacen.aplicar_cambios(modificados)
+
+    referencia = dm.AlmacenColumnar.desde_dataframe(almacen.filas())
+    for entidad in [None, 'Otra'] + list(referencia.entidades):
+        pd.testing.assert_frame_equal(dm.analisis_mensual(almacen, entidad), dm.analisis_mensual(referencia, entidad))
+
+def _ordenadas(almacen):
+    return almacen.filas().astype({'entidad': str}).sort_values('id', ignore_index=True)
+
+def test_lo_registrado_se_vuelve_a_cargar_desde_parquet(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    almacen = dm.AlmacenColumnar()
+    dm.registrar(almacen, generar_datos(300, entidades=3), directorio)
+    dm.registrar(almacen, [{'fecha': '2024-05-01', 'entidad': 'Sucursal/Norte', 'facturacion_a': 10.0}], directorio)
+    # Un registro cambia de entidad y de mes: se reescriben las dos particiones
+    dm.registrar(almacen, almacen.filas([0]).assign(fecha=pd.Timestamp(2031, 1, 1), entidad='Sucursal/Norte'), directorio)
+
+    pd.testing.assert_frame_equal(_ordenadas(dm.cargar_almacen(directorio)), _ordenadas(almacen))
+    assert os.path.isdir(os.path.join(directorio, 'entidad=Sucursal%2FNorte', 'anio=2031', 'mes=1'))
+    assert not dm.leer_datos(directorio)['id'].duplicated().any()
+
+def test_las_filas_repetidas_de_una_reescritura_cortada_se_descartan(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    almacen = dm.AlmacenColumnar()
+    dm.registrar(almacen, generar_datos(50, entidades=2), directorio)
+    # Como si se hubieran escrito los archivos nuevos de una partición sin borrar los anteriores
+    dm.guardar_registros(almacen.filas([3, 4]), directorio, recalcular=False)
+
+    assert len(dm.leer_datos(directorio)) == 52
+    pd.testing.assert_frame_equal(_ordenadas(dm.cargar_almacen(directorio)), _ordenadas(almacen))
+
+def test_estadisticas_de_una_pasada_coinciden_con_pandas():
+    almacen = dm.AlmacenColumnar.desde_dataframe(generar_datos(1000, entidades=3))
+    filas = almacen.filas()
+    estadisticas = dm.calcular_estadisticas(almacen, percentiles=[10, 50, 90])
+
+    facturacion = filas[['facturacion_a', 'facturacion_b', 'facturacion_c']].sum(axis=1)
+    assert estadisticas['facturacion_total'] == pytest.approx(facturacion.sum())
+    assert estadisticas['promedio_facturacion'] == pytest.approx(facturacion.mean())
+    assert estadisticas['utilidad_total'] == pytest.approx(filas['utilidad'].sum())
+    for columna in dm.COLUMNAS_NUMERICAS:
+        detalle = estadisticas['detalle'][columna]
+        assert detalle['minimo'] == filas[columna].min() and detalle['maximo'] == filas[columna].max()
+        assert detalle['media'] == pytest.approx(filas[columna].mean())
+        assert detalle['desvio'] == pytest.approx(filas[columna].std())
+        assert detalle['p50'] == pytest.approx(filas[columna].quantile(0.5))
+
+    entidad = almacen.entidades[1]
+    categorias = dm.calcular_categorias(almacen, entidad)
+    de_la_entidad = filas[filas['entidad'] == entidad]
+    assert categorias['facturacion']['B'] == pytest.approx(de_la_entidad['facturacion_b'].sum())
+    assert categorias['impuestos']['iva'] == pytest.approx(de_la_entidad['iva_total'].sum())
+
+def test_estadisticas_parciales_combinadas():
+    bloque = dm.AlmacenColumnar.desde_dataframe(generar_datos(300, entidades=1)).bloque()
+    completas = dm.EstadisticasParciales.desde_bloque(bloque)
+    vacias = dm.EstadisticasParciales.desde_bloque(bloque[:, :0])
+    combinadas = (
+        dm.EstadisticasParciales.desde_bloque(bloque[:, :100])
+        .combinar(vacias)
+        .combinar(dm.EstadisticasParciales.desde_bloque(bloque[:, 100:]))
+    )
+    assert combinadas.n == 300 and np.array_equal(combinadas.sumas, completas.sumas)
+    for columna, detalle in completas.detalle().items():
+        assert combinadas.detalle()[columna] == pytest.approx(detalle), columna
+
+    # Sin registros no hay promedios ni detalle, en lugar de NaN
+    vacio = dm.calcular_estadisticas(dm.AlmacenColumnar(), detalle=True)
+    assert vacio['promedio_gastos'] is None and vacio['facturacion_total'] == 0.0
+    assert vacio['detalle']['utilidad'] == {'minimo': None, 'maximo': None, 'media': None, 'desvio': None}
+
+def test_analisis_por_entidad():
+    datos = generar_datos(1500, entidades=3)
+    almacen = dm.AlmacenColumnar.desde_dataframe(datos)
+    consolidado = dm.analisis_mensual(almacen)
+
+    suma = None
+    for entidad in almacen.entidades:
+        de_la_entidad = almacen.filas()[almacen.filas()['entidad'] == entidad]
+        referencia = de_la_entidad.set_index('fecha')[dm.COLUMNAS_NUMERICAS].resample('ME').sum()
+        mensual = dm.analisis_mensual(almacen, entidad)
+        columnas = [columna for columna in mensual if columna in referencia]
+        pd.testing.assert_frame_equal(
+            mensual[columnas], referencia[columnas], check_freq=False, check_names=False
+        )
+        suma = mensual if suma is None else suma.add(mensual, fill_value=0)
+    pd.testing.assert_frame_equal(suma, consolidado, check_freq=False)
+
+    # Un DataFrame se filtra igual que el almacén, y una entidad desconocida no tiene datos
+    pd.testing.assert_frame_equal(
+        dm.analisis_mensual(almacen.a_dataframe(), almacen.entidades[0]),
+        dm.analisis_mensual(almacen, almacen.entidades[0]), check_freq=False
+    )
+    assert dm.analisis_mensual(almacen, 'Ninguna').empty
+
+def test_los_datos_sin_entidad_pasan_a_la_principal(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    datos = generar_datos(40, entidades=1).drop(columns='entidad')
+    dm.guardar_registros(dm.AlmacenColumnar.desde_dataframe(datos).filas(), directorio)
+    # Como los guardaba la versión anterior: anio=/mes= directamente en la carpeta
+    principal = os.path.join(directorio, f'entidad={dm.ENTIDAD_PREDETERMINADA}')
+    for nombre in os.listdir(principal):
+        os.replace(os.path.join(principal, nombre), os.path.join(directorio, nombre))
+    os.rmdir(principal)
+
+    almacen = dm.cargar_almacen(directorio)
+    assert len(almacen) == 40 and list(almacen.entidades) == [dm.ENTIDAD_PREDETERMINADA]
+    assert os.path.isdir(principal)
+    assert not [nombre for nombre in os.listdir(directorio) if nombre.startswith('anio=')]
+
+def test_redondeo_al_centavo_con_las_mitades_lejos_de_cero():
+    centavos = [100.5, -100.5, 100.49999999999999, 0.5, -0.5, 2.4, -2.6]
+    assert dm.redondear(centavos).tolist() == [101, -101, 101, 1, -1, 2, -3]
+    assert dm.a_centavos([0.1 + 0.2, 1.005, -0.015]).tolist() == [30, 101, -2]
+
+def test_los_totales_son_sumas_exactas_de_centavos():
+    almacen = dm.AlmacenColumnar.desde_dataframe(pd.DataFrame({
+        'fecha': pd.date_range('2024-01-01', periods=10, freq='D'),
+        'facturacion_a': [0.1] * 9 + [0.5],
+        'gastos_operativos': [0.2] * 10,
+    }))
+    filas = almacen.filas()
+    # El IVA de 0,50 es 0,105 y se redondea por registro a 0,11
+    assert filas['iva_debito'].tolist() == [0.02] * 9 + [0.11]
+    assert filas['iva_credito'].tolist() == [0.04] * 10
+
+    estadisticas = dm.calcular_estadisticas(almacen)
+    assert estadisticas['facturacion_total'] == 1.4
+    assert estadisticas['gastos_totales'] == 2.0
+    mensual = dm.analisis_mensual(almacen)
+    assert mensual['facturacion_a'].item() == 1.4
+    assert mensual['utilidad'].item() == round(filas['utilidad'].sum(), 2)
@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import compartido
+import consultas
+import data_manager as dm
+from generador import generar_datos
+
+def _filas(almacen):
+    return almacen.filas().astype({'entidad': str}).sort_values('id', ignore_index=True)
+
+def _almacen_con_diario(directorio):
+    """Almacén con datos en Parquet y lotes sin volcar, uno de ellos con registros que cambian de mes y de entidad."""
+    almacen = compartido.AlmacenCompartido(directorio, intervalo_volcado=None)
+    almacen.reemplazar(generar_datos(500, entidades=3))
+    almacen.registrar(generar_datos(30, entidades=4, semilla=1))
+    modificados = almacen.almacen.filas([0, 10, 520]).assign(
+        fecha=pd.Timestamp(2030, 6, 1), entidad='Nueva', facturacion_a=1.0
+    )
+    almacen.registrar(modificados)
+    assert almacen.bytes_diario > 0
+    return almacen
+
+def test_las_lecturas_de_la_carpeta_incluyen_el_diario(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    almacen = _almacen_con_diario(directorio).almacen
+
+    pd.testing.assert_frame_equal(_filas(dm.cargar_almacen(directorio)), _filas(almacen))
+    assert len(dm.cargar_almacen(directorio, diario=False)) == 500
+
+    df = dm.leer_datos(directorio)
+    assert len(df) == 530 and not df['id'].duplicated().any()
+    nuevos = df[df['entidad'] == 'Nueva']
+    assert len(nuevos) == 3 and (nuevos['facturacion_a'] == 1.0).all()
+
+    for parametros in [{}, {'dimensiones': ['entidad', 'fecha'], 'desde': '2020-01-01'}]:
+        pd.testing.assert_frame_equal(
+            consultas.consultar(directorio, **parametros), consultas.consultar(almacen, **parametros)
+        )
+
+def test_al_abrir_se_aplica_el_diario(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    almacen = _almacen_con_diario(directorio).almacen
+
+    reabierto = compartido.AlmacenCompartido(directorio, intervalo_volcado=None)
+    assert reabierto.recuperados == 33
+    pd.testing.assert_frame_equal(_filas(reabierto.almacen), _filas(almacen))
+
+@pytest.mark.parametrize('danio', ['cortada', 'crc'])
+def test_una_entrada_incompleta_cierra_el_diario(tmp_path, danio):
+    directorio = str(tmp_path / 'datos')
+    almacen = compartido.AlmacenCompartido(directorio, intervalo_volcado=None)
+    almacen.registrar(generar_datos(5, entidades=2))
+    antes = _filas(almacen.almacen)
+    almacen.registrar(generar_datos(5, entidades=2, semilla=1))
+
+    # La segunda entrada quedó a medio escribir o con otro contenido
+    ruta = os.path.join(directorio, dm.ARCHIVO_DIARIO)
+    with open(ruta, 'r+b') as archivo:
+        if danio == 'cortada':
+            archivo.truncate(os.path.getsize(ruta) - 10)
+        else:
+            archivo.seek(-10, os.SEEK_END)
+            byte = archivo.read(1)
+            archivo.seek(-10, os.SEEK_END)
+            archivo.write(bytes([byte[0] ^ 0xFF]))
+
+    reabierto = compartido.AlmacenCompartido(directorio, intervalo_volcado=None)
+    assert reabierto.recuperados == 5
+    pd.testing.assert_frame_equal(_filas(reabierto.almacen), antes)
+
+    # Lo que se escribe después reemplaza a la entrada dañada
+    reabierto.registrar(generar_datos(3, entidades=2, semilla=2))
+    assert len(compartido.AlmacenCompartido(directorio).almacen) == 8
+
+def test_volcar_de_nuevo_despues_de_un_corte(tmp_path, monkeypatch):
+    directorio = str(tmp_path / 'datos')
+    almacen = _almacen_con_diario(directorio).almacen
+
+    # Se corta después de escribir las particiones y antes de vaciar el diario
+    def cortar(directorio):
+        raise OSError('corte')
+    with monkeypatch.context() as m:
+        m.setattr(dm, 'iniciar_diario', cortar)
+        with pytest.raises(OSError):
+            compartido.AlmacenCompartido(directorio, intervalo_volcado=None).volcar()
+
+    reabierto = compartido.AlmacenCompartido(directorio, intervalo_volcado=None)
+    pd.testing.assert_frame_equal(_filas(reabierto.almacen), _filas(almacen))
+    reabierto.volcar()
+    reabierto.volcar()
+    assert reabierto.bytes_diario == 0
+
+    # En Parquet quedó cada registro una sola vez y con su último estado
+    df = dm.leer_datos(directorio, diario=False)
+    assert not df['id'].duplicated().any()
+    pd.testing.assert_frame_equal(_filas(dm.cargar_almacen(directorio, diario=False)), _filas(almacen))
+
+def test_la_secuencia_se_confirma_con_el_lote(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    almacen = compartido.AlmacenCompartido(directorio, intervalo_volcado=None)
+    almacen.registrar(generar_datos(3, entidades=2), secuencia=1)
+    # Un lote grande con secuencia también va al diario, en la misma entrada
+    almacen.registrar(generar_datos(compartido.MAXIMO_REGISTROS_DIARIO + 1, entidades=2, semilla=1), secuencia=2)
+    assert not os.path.exists(os.path.join(directorio, dm.ARCHIVO_SINCRONIZACION))
+    assert dm.secuencia_diario(directorio) == 2
+
+    # Un lote que no se aplica no avanza la secuencia
+    with pytest.raises(ValueError):
+        almacen.registrar([{'id': 10**9, 'fecha': '2024-01-01'}], secuencia=3)
+    assert dm.leer_secuencia(directorio) == 2
+
+    # Al volcar pasa al archivo de sincronización antes de vaciar el diario
+    almacen.volcar()
+    assert dm.secuencia_diario(directorio) is None
+    assert dm.leer_secuencia(directorio) == 2
+    assert len(compartido.AlmacenCompartido(directorio).almacen) == compartido.MAXIMO_REGISTROS_DIARIO + 4
@@ -0,0 +1,42 @@
+import json
+import os
+import subprocess
+import sys
+
+EJECUTAR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'ejecutar.py')
+CASO = 'data_manager.agregar_registros'
+
+def _medicion(latencia, memoria):
+    return {
+        'latencia_mediana_s': latencia, 'latencia_minima_s': latencia, 'repeticiones': 5,
+        'memoria_pico_mb': memoria, 'asignaciones_netas': 0
+    }
+
+def _ejecutar(tmp_path, linea_base, *argumentos):
+    return subprocess.run(
+        [sys.executable, EJECUTAR, '--tamanios', '1k', '--filtro', 'agregar_registros',
+         '--linea-base', str(linea_base), *argumentos],
+        cwd=tmp_path, capture_output=True, text=True, timeout=300
+    )
+
+def test_guardar_la_linea_base_conserva_los_otros_casos(tmp_path):
+    linea_base = tmp_path / 'linea_base.json'
+    anteriores = {
+        '1k': {CASO: _medicion(99.0, 99.0), 'otro caso': _medicion(1.0, 1.0)},
+        '100k': {CASO: _medicion(2.0, 2.0)},
+    }
+    linea_base.write_text(json.dumps(anteriores))
+
+    assert _ejecutar(tmp_path, linea_base, '--guardar-linea-base').returncode == 0
+    guardada = json.loads(linea_base.read_text())
+    assert guardada['1k']['otro caso'] == anteriores['1k']['otro caso']
+    assert guardada['100k'] == anteriores['100k']
+    assert guardada['1k'][CASO]['latencia_mediana_s'] < 99.0
+
+    # Contra una línea base imposible de igualar se informa la regresión y se sale con error
+    guardada['1k'][CASO] = _medicion(1e-9, 1e-9)
+    linea_base.write_text(json.dumps(guardada))
+    resultado = _ejecutar(tmp_path, linea_base)
+    assert resultado.returncode == 1
+    assert f'1k {CASO}: latencia_mediana_s' in resultado.stdout
+    assert f'1k {CASO}: memoria_pico_mb' in resultado.stdout
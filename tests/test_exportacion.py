@@ -0,0 +1,55 @@
+import io
+
+import pandas as pd
+import pytest
+
+import data_manager as dm
+import exportacion
+import utils
+from generador import generar_datos
+
+LECTORES = {'csv': pd.read_csv, 'parquet': pd.read_parquet, 'excel': pd.read_excel}
+
+def _leer(formato, partes):
+    return LECTORES[formato](io.BytesIO(b''.join(partes)))
+
+@pytest.mark.parametrize('formato', list(LECTORES))
+def test_exportar_por_bloques_conserva_los_registros(formato):
+    almacen = dm.AlmacenColumnar.desde_dataframe(generar_datos(50, entidades=3))
+    leidos = _leer(formato, exportacion.exportar(almacen, formato, tamanio_bloque=7))
+
+    esperados = almacen.filas()
+    assert list(leidos.columns) == list(esperados.columns)
+    assert leidos['id'].tolist() == esperados['id'].tolist()
+    assert leidos['entidad'].astype(str).tolist() == esperados['entidad'].astype(str).tolist()
+    assert pd.to_datetime(leidos['fecha']).tolist() == esperados['fecha'].tolist()
+    pd.testing.assert_frame_equal(leidos[dm.COLUMNAS_NUMERICAS], esperados[dm.COLUMNAS_NUMERICAS])
+
+def test_parquet_emite_cada_bloque_apenas_se_escribe():
+    almacen = dm.AlmacenColumnar.desde_dataframe(generar_datos(50, entidades=2))
+    partes = list(exportacion.exportar_parquet(almacen, tamanio_bloque=10))
+    # Un grupo de filas por bloque más el cierre con los metadatos
+    assert len(partes) == 6 and all(partes[1:5])
+    assert len(_leer('parquet', partes)) == 50
+
+def test_exportar_sin_registros_deja_los_encabezados():
+    partes = list(exportacion.exportar(dm.AlmacenColumnar(), 'csv'))
+    assert b''.join(partes).decode().strip() == ','.join(['id', 'entidad'] + dm.COLUMNAS)
+    with pytest.raises(ValueError):
+        exportacion.exportar(dm.AlmacenColumnar(), 'json')
+
+def test_montos_con_formato_de_moneda():
+    df = pd.DataFrame({'fecha': ['2024-01-31'], 'facturacion_a': [1234.5], 'retenciones': [-0.05]})
+    leidos = _leer('csv', exportacion.exportar(df, 'csv', formatear=utils.formatear_montos))
+    assert leidos.loc[0, 'facturacion_a'] == '$1.234,50'
+    assert leidos.loc[0, 'retenciones'] == '$-0,05'
+    assert leidos.loc[0, 'fecha'] == '2024-01-31'
+
+def test_endpoint_de_exportacion(cliente):
+    import api
+
+    api.almacen_compartido().registrar(generar_datos(20, entidades=2))
+    respuesta = cliente.get('/datos/exportar?formato=parquet')
+    assert respuesta.status_code == 200
+    assert respuesta.headers['content-disposition'] == 'attachment; filename="datos_financieros.parquet"'
+    assert len(pd.read_parquet(io.BytesIO(respuesta.content))) == 20
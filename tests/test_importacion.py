@@ -0,0 +1,125 @@
+import io
+
+import pandas as pd
+import pytest
+
+import compartido
+import comprobantes
+import data_manager as dm
+import importacion
+
+COMPROBANTES_AFIP = pd.DataFrame({
+    'Fecha': ['01/02/2024', '15/02/2024', '03/03/2024', 'x', '10/03/2024'],
+    'Tipo': ['1 - Factura A', '3 - Nota de Crédito A', '11 - Factura C', '6 - Factura B', '19 - Factura E'],
+    'Imp. Neto Gravado': [1000.0, 100.0, 0.0, 5.0, 300.0],
+    'Imp. Total': [1210.0, 121.0, 500.0, 6.05, 300.0],
+})
+
+def _csv_afip():
+    contenido = io.BytesIO()
+    COMPROBANTES_AFIP.to_csv(contenido, sep=';', decimal=',', index=False)
+    return contenido.getvalue()
+
+def test_tipo_de_comprobante_no_admitido(tmp_path):
+    almacen = compartido.AlmacenCompartido(str(tmp_path / 'datos'))
+    resultado = importacion.importar_bytes(_csv_afip(), almacen, 'afip', entidad='Norte')
+
+    assert resultado.filas_leidas == 5 and resultado.filas_invalidas == 2
+    assert resultado.errores == [
+        'Fila 5: fecha o tipo de comprobante inválido',
+        'Fila 6: tipo de comprobante no admitido',
+    ]
+    guardados = comprobantes.leer_comprobantes(almacen.directorio)
+    assert len(guardados) == 3 and 19 not in guardados.tipos
+
+def test_filas_de_excel_debajo_del_titulo(tmp_path):
+    contenido = io.BytesIO()
+    with pd.ExcelWriter(contenido) as escritor:
+        pd.DataFrame([['Mis Comprobantes Emitidos']]).to_excel(escritor, index=False, header=False)
+        COMPROBANTES_AFIP.to_excel(escritor, startrow=2, index=False)
+
+    almacen = compartido.AlmacenCompartido(str(tmp_path / 'datos'))
+    resultado = importacion.importar_bytes(contenido.getvalue(), almacen, 'afip', 'excel', entidad='Norte')
+    # El encabezado está en la fila 3 de la planilla, así que el cuarto comprobante queda en la 7
+    assert resultado.errores == [
+        'Fila 7: fecha o tipo de comprobante inválido',
+        'Fila 8: tipo de comprobante no admitido',
+    ]
+
+def test_comprobantes_mensuales_coinciden_con_lo_importado(cliente):
+    respuesta = cliente.post('/importar?formato=afip&entidad=Norte', content=_csv_afip())
+    assert respuesta.status_code == 200
+
+    mensuales = cliente.get('/comprobantes/mensuales').json()
+    assert mensuales == [
+        {'fecha': '2024-02-01', 'entidad': 'Norte', 'facturacion_a': 900.0, 'facturacion_b': 0.0, 'facturacion_c': 0.0},
+        {'fecha': '2024-03-01', 'entidad': 'Norte', 'facturacion_a': 0.0, 'facturacion_b': 0.0, 'facturacion_c': 500.0},
+    ]
+    registrados = cliente.get('/datos/consulta?dimensiones=fecha&medidas=facturacion_a&medidas=facturacion_c').json()
+    assert [r['facturacion_a'] for r in registrados] == [900.0, 0.0]
+    assert [r['facturacion_c'] for r in registrados] == [0.0, 500.0]
+
+    assert cliente.get('/comprobantes/mensuales?desde=2024-03-01').json() == mensuales[1:]
+    assert cliente.get('/comprobantes/mensuales?entidad=Sur').json() == []
+
+REGISTROS_CSV = """fecha,entidad,facturacion_a,gastos_operativos,otros_gastos
+2024-01-15,Norte,1000,200,10
+no es fecha,Norte,1000,200,10
+2024-02-15,,500,-5,0
+2024-02-20,Sur,abc,0,0
+2024-03-01,Sur,300,,
+2024-03-05,,50.5,1,1
+"""
+
+@pytest.mark.parametrize('tamanio_bloque', [2, 100])
+def test_importar_registros_valida_por_bloques(tmp_path, tamanio_bloque):
+    almacen = dm.AlmacenColumnar()
+    resultado = importacion.importar(
+        io.StringIO(REGISTROS_CSV), almacen, directorio=str(tmp_path / 'datos'),
+        tamanio_bloque=tamanio_bloque, entidad='General'
+    )
+    # Una celda de monto vacía es inválida, igual que en el formulario
+    assert resultado.filas_leidas == 6 and resultado.filas_invalidas == 4 and resultado.registros == 2
+    assert sorted(resultado.errores) == [
+        'Fila 3: fecha inválida',
+        "Fila 4: 'gastos_operativos' no es un número positivo",
+        "Fila 5: 'facturacion_a' no es un número positivo",
+        "Fila 6: 'gastos_operativos' no es un número positivo",
+    ]
+    filas = almacen.filas()
+    assert filas['entidad'].astype(str).tolist() == ['Norte', 'General']
+    assert filas['facturacion_a'].tolist() == [1000.0, 50.5]
+    assert len(dm.cargar_almacen(str(tmp_path / 'datos'))) == 2
+
+def test_sin_entidad_se_usa_la_indicada(tmp_path):
+    almacen = compartido.AlmacenCompartido(str(tmp_path / 'datos'))
+    contenido = b'fecha,facturacion_b\n2024-01-01,10\n2024-01-02,20\n'
+    resultado = importacion.importar_bytes(contenido, almacen, entidad='Oeste')
+    assert len(resultado.ids) == 2
+    assert almacen.almacen.filas()['entidad'].astype(str).tolist() == ['Oeste', 'Oeste']
+
+def test_afip_suma_por_mes_y_letra(tmp_path):
+    afip = pd.DataFrame({
+        'Fecha de Emisión': ['05/01/2024', '20/01/2024', '25/01/2024', '02/02/2024'],
+        'Tipo de Comprobante': ['1 - Factura A', '3 - Nota de Crédito A', '6 - Factura B', '11 - Factura C'],
+        'Imp. Neto Gravado': [1000.0, 100.0, 50.0, 0.0],
+        'Imp. Total': [1210.0, 121.0, 60.5, 80.0],
+        'Tipo Cambio': [1.0, 1.0, 2.0, 1.0],
+    })
+    contenido = io.BytesIO()
+    afip.to_csv(contenido, sep=';', decimal=',', index=False)
+    almacen = compartido.AlmacenCompartido(str(tmp_path / 'datos'))
+    resultado = importacion.importar_bytes(contenido.getvalue(), almacen, 'afip')
+
+    # Un registro por mes: la nota de crédito resta, el tipo de cambio convierte y la C toma el total
+    assert resultado.registros == 2 and resultado.filas_invalidas == 0
+    filas = almacen.almacen.filas()
+    assert filas[['facturacion_a', 'facturacion_b', 'facturacion_c']].values.tolist() == [
+        [900.0, 100.0, 0.0], [0.0, 0.0, 80.0]
+    ]
+
+def test_importar_desde_la_api(cliente):
+    respuesta = cliente.post('/importar', content=b'fecha,facturacion_a\n2024-01-01,10\n')
+    assert respuesta.status_code == 200 and respuesta.json()['registros'] == 1
+    assert cliente.post('/importar', content=b'monto\n10\n').status_code == 422
+    assert cliente.post('/importar?formato=otro', content=b'').status_code == 422
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import compartido
+import data_manager as dm
+import impuestos
+from generador import generar_datos
+
+@pytest.mark.parametrize('tasa', [True, False, '0.21', None, -0.1, 1.5])
+def test_tasa_invalida(tasa):
+    with pytest.raises(ValueError):
+        impuestos.ReglasImpuestos.desde_dict({'reglas': [{'concepto': 'iva_a', 'tasa': tasa}]})
+
+def test_las_reglas_sobreviven_al_reemplazo_de_los_datos(tmp_path):
+    directorio = str(tmp_path / 'datos')
+    ruta = os.path.join(directorio, impuestos.NOMBRE_ARCHIVO_REGLAS)
+    reglas = impuestos.ReglasImpuestos.desde_dict({'reglas': [{'concepto': 'iva_a', 'tasa': 0.105}]})
+    impuestos.guardar_reglas(reglas, ruta)
+
+    dm.reemplazar_registros(generar_datos(10, entidades=2), directorio)
+    assert impuestos.reglas_vigentes(ruta).a_dict() == reglas.a_dict()
+    # Las reglas no se leen como una partición de registros
+    assert len(dm.leer_datos(directorio)) == 10
+
+def test_se_lee_el_archivo_de_la_ubicacion_anterior(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('FACTURACION_IMPUESTOS', raising=False)
+    ruta = impuestos.ARCHIVO_REGLAS
+    assert not os.path.isabs(ruta) and not os.path.exists(ruta)
+
+    anteriores = impuestos.ReglasImpuestos.desde_dict({'reglas': [{'concepto': 'iva_b', 'tasa': 0.27}]})
+    impuestos.guardar_reglas(anteriores, impuestos.ARCHIVO_REGLAS_ANTERIOR)
+    assert impuestos.reglas_vigentes(ruta).a_dict() == anteriores.a_dict()
+
+    # Al guardar se pasan a la carpeta de datos
+    nuevas = impuestos.ReglasImpuestos.desde_dict({'reglas': [{'concepto': 'iva_b', 'tasa': 0.21}]})
+    impuestos.guardar_reglas(nuevas, ruta)
+    assert impuestos.reglas_vigentes(ruta).a_dict() == nuevas.a_dict()
+
+REGLAS = {
+    'reglas': [
+        {'concepto': 'iva_a', 'tasa': 0.21},
+        {'concepto': 'iva_a', 'tasa': 0.27, 'desde': '2024-01-01'},
+        {'concepto': 'iva_a', 'tasa': 0.10, 'desde': '2023-06-01', 'jurisdiccion': 'CABA'},
+        {'concepto': 'iva_a', 'tasa': 0.05, 'desde': '2024-06-01', 'entidad': 'Norte'},
+    ],
+    'jurisdicciones': {'Norte': 'CABA', 'Sur': 'CABA'}
+}
+
+def test_vale_la_regla_mas_especifica_vigente():
+    reglas = impuestos.ReglasImpuestos.desde_dict(REGLAS)
+    casos = [
+        ('Oeste', '2023-12-31', 0.21), ('Oeste', '2024-01-01', 0.27),
+        ('Sur', '2023-05-31', 0.21), ('Sur', '2023-06-01', 0.10), ('Sur', '2025-01-01', 0.10),
+        ('Norte', '2024-05-31', 0.10), ('Norte', '2024-06-01', 0.05),
+    ]
+    entidades = pd.Categorical([e for e, _, _ in casos], categories=['Norte', 'Oeste', 'Sur'])
+    fechas = pd.to_datetime([f for _, f, _ in casos]).to_numpy()
+    assert reglas.tasas('iva_a', entidades, fechas).tolist() == [t for _, _, t in casos]
+    # Un concepto sin reglas no cobra nada
+    assert reglas.tasas('iva_b', entidades, fechas).tolist() == [0.0] * len(casos)
+
+def _ordenadas(filas):
+    return filas.astype({'entidad': str}).sort_values('id', ignore_index=True)
+
+def test_cambiar_reglas_recalcula_solo_los_registros_afectados(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('FACTURACION_IMPUESTOS', raising=False)
+    almacen = compartido.AlmacenCompartido(os.path.dirname(impuestos.ARCHIVO_REGLAS))
+    almacen.registrar(generar_datos(600, entidades=3))
+    antes = almacen.almacen.filas()
+    entidad = almacen.almacen.entidades[1]
+
+    nuevas = impuestos.ReglasImpuestos.desde_dict({'reglas': impuestos.REGLAS_PREDETERMINADAS['reglas'] + [
+        {'concepto': 'iva_a', 'tasa': 0.105, 'desde': '2020-01-01', 'entidad': entidad}
+    ]})
+    afectados = (antes['entidad'] == entidad) & (antes['fecha'] >= '2020-01-01')
+    assert almacen.cambiar_reglas(nuevas) == afectados.sum()
+
+    despues = almacen.almacen.filas()
+    pd.testing.assert_frame_equal(despues[~afectados], antes[~afectados])
+    esperado = dm.redondear(dm.a_centavos(antes['facturacion_a'][afectados].to_numpy()) * 0.105)
+    esperado += dm.redondear(dm.a_centavos(antes['facturacion_b'][afectados].to_numpy()) * 0.21)
+    assert np.array_equal(dm.a_centavos(despues['iva_debito'][afectados].to_numpy()), esperado)
+    # Lo recalculado coincide con calcular todo de nuevo, y queda guardado
+    referencia = dm.AlmacenColumnar.desde_dataframe(antes[['id', 'fecha', 'entidad'] + dm.COLUMNAS_BASE])
+    guardados = compartido.AlmacenCompartido(almacen.directorio).almacen
+    for otro in [referencia, guardados]:
+        pd.testing.assert_frame_equal(_ordenadas(otro.filas()), _ordenadas(despues))
@@ -0,0 +1,45 @@
+import pytest
+
+import compartido
+import data_manager as dm
+from generador import generar_datos
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    """La aplicación de Streamlit importada en una carpeta vacía, con las cachés limpias."""
+    monkeypatch.chdir(tmp_path)
+    import streamlit as st
+    import main
+
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    return main
+
+def test_el_analisis_se_recalcula_solo_cuando_cambia_la_version(main, tmp_path, monkeypatch):
+    almacen_compartido = compartido.AlmacenCompartido(str(tmp_path / 'otros'))
+    almacen_compartido.registrar(generar_datos(200, entidades=2))
+    almacen = almacen_compartido.actualizar()
+    llamadas = []
+    original = dm.analisis_mensual
+    monkeypatch.setattr(dm, 'analisis_mensual', lambda *args: llamadas.append(args) or original(*args))
+
+    for _ in range(3):
+        df_mensual, meses = main.analisis_mensual_cacheado(almacen, almacen.version)
+    assert len(llamadas) == 1 and len(meses) == len(df_mensual)
+
+    main.analisis_mensual_cacheado(almacen, almacen.version, 'Otra')
+    almacen_compartido.registrar([{'fecha': '2024-06-01', 'facturacion_a': 10.0}])
+    almacen = almacen_compartido.actualizar()
+    main.analisis_mensual_cacheado(almacen, almacen.version)
+    assert len(llamadas) == 3
+
+def test_las_figuras_se_comparten_entre_reejecuciones(main, tmp_path):
+    almacen_compartido = compartido.AlmacenCompartido(str(tmp_path / 'otros'))
+    almacen_compartido.registrar(generar_datos(200, entidades=2))
+    almacen = almacen_compartido.actualizar()
+    df_mensual, _ = main.analisis_mensual_cacheado(almacen, almacen.version)
+
+    graficos = main.graficos_cacheados(df_mensual, almacen.version, 'analisis_mensual:None')
+    assert set(graficos) == {'lineas', 'facturacion', 'gastos', 'impuestos'}
+    assert main.graficos_cacheados(df_mensual, almacen.version, 'analisis_mensual:None') is graficos
+    assert main.graficos_cacheados(df_mensual, almacen.version + 1, 'analisis_mensual:None') is not graficos
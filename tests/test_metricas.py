@@ -0,0 +1,87 @@
+import contextvars
+import threading
+import time
+
+import metricas
+
+def _ocupar(segundos):
+    fin = time.perf_counter() + segundos
+    while time.perf_counter() < fin:
+        pass
+
+def pedido_lento():
+    _ocupar(0.3)
+
+def otro_pedido(fin):
+    while not fin.is_set():
+        _ocupar(0.01)
+
+def test_el_perfil_solo_muestrea_los_hilos_del_pedido(tmp_path, monkeypatch):
+    monkeypatch.setattr(metricas, 'DIRECTORIO_PERFILES', str(tmp_path))
+    fin = threading.Event()
+    otro = threading.Thread(target=otro_pedido, args=(fin,))
+    otro.start()
+    try:
+        for _ in range(2):
+            with metricas.perfilar_si_lento('GET /lento', umbral=0.1):
+                # Como el pool de FastAPI, el hilo de trabajo recibe el contexto del pedido
+                contexto = contextvars.copy_context()
+                hilo = threading.Thread(target=contexto.run, args=(metricas.hilo_del_pedido(pedido_lento),))
+                hilo.start()
+                hilo.join()
+    finally:
+        fin.set()
+        otro.join()
+
+    perfiles = list(tmp_path.iterdir())
+    assert len(perfiles) == 2
+    for perfil in perfiles:
+        pilas = perfil.read_text()
+        assert 'pedido_lento' in pilas and 'otro_pedido' not in pilas
+    assert [h.name for h in threading.enumerate()].count('muestreador') == 1
+
+def test_sin_pedido_perfilado_no_se_sigue_el_hilo():
+    metricas.hilo_del_pedido(pedido_lento)()
+    assert not metricas.MUESTREADOR._seguidos
+
+def test_histograma_en_formato_prometheus(monkeypatch):
+    monkeypatch.setattr(metricas, '_registro', [])
+    histograma = metricas.Histograma('prueba_segundos', "Duraciones de prueba", ['ruta'], limites=(0.1, 1.0))
+    for valor in [0.05, 0.1, 0.5, 3.0]:
+        histograma.observar(valor, ruta='/a"b')
+    indicador = metricas.Indicador('prueba_bytes', "Tamaño de prueba")
+    indicador.fijar(2048)
+
+    assert metricas.exponer().splitlines() == [
+        '# HELP prueba_segundos Duraciones de prueba',
+        '# TYPE prueba_segundos histogram',
+        'prueba_segundos_bucket{ruta="/a\\"b",le="0.1"} 2',
+        'prueba_segundos_bucket{ruta="/a\\"b",le="1.0"} 3',
+        'prueba_segundos_bucket{ruta="/a\\"b",le="+Inf"} 4',
+        'prueba_segundos_sum{ruta="/a\\"b"} 3.65',
+        'prueba_segundos_count{ruta="/a\\"b"} 4',
+        '# HELP prueba_bytes Tamaño de prueba',
+        '# TYPE prueba_bytes gauge',
+        'prueba_bytes 2048.0',
+    ]
+
+def _valor(texto, serie):
+    for linea in texto.splitlines():
+        if linea.startswith(serie + ' '):
+            return float(linea.split()[-1])
+    return 0.0
+
+def test_endpoint_de_metricas(cliente):
+    import api
+
+    api.almacen_compartido().registrar([{'fecha': '2024-01-01', 'entidad': 'Norte', 'facturacion_a': 10.0}])
+    serie = 'facturacion_api_pedido_segundos_count{endpoint="/datos/mensuales",metodo="GET",estado="200"}'
+    antes = _valor(cliente.get('/metrics').text, serie)
+    cliente.get('/datos/mensuales')
+    cliente.get('/datos/mensuales?desde=2024-01-01')
+
+    respuesta = cliente.get('/metrics')
+    assert respuesta.headers['content-type'].startswith('text/plain; version=0.0.4')
+    assert _valor(respuesta.text, serie) == antes + 2
+    assert _valor(respuesta.text, 'facturacion_registros{entidad="Norte"}') == 1.0
+    assert _valor(respuesta.text, 'facturacion_meses') == 1.0
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+import utils
+
+def _formato_de_referencia(centavos):
+    signo = '-' if centavos < 0 else ''
+    enteros, decimales = divmod(abs(centavos), 100)
+    return f"${signo}{enteros:,}".replace(',', '.') + f",{decimales:02d}"
+
+def test_formato_centavos_coincide_con_el_formato_de_a_uno():
+    generador = np.random.default_rng(0)
+    centavos = np.concatenate([
+        [0, 1, -1, 99, 100, -100, 99999, 100000, 123456789, -123456789012, 2 ** 62],
+        generador.integers(-10 ** 12, 10 ** 12, size=500)
+    ])
+    formateados = utils.formato_centavos(centavos)
+    assert formateados.tolist() == [_formato_de_referencia(int(c)) for c in centavos]
+    assert utils.formato_centavos([[150, -5], [0, 100000]]).tolist() == [['$1,50', '$-0,05'], ['$0,00', '$1.000,00']]
+    assert utils.formato_centavos([]).shape == (0,)
+
+def test_formato_monedas_equivale_al_de_cada_valor():
+    valores = pd.Series([1234.5, 0.005, -0.015, 1234.5, np.nan, 'x', 1e9, None], index=list('abcdefgh'), name='monto')
+    formateados = utils.formato_monedas(valores)
+
+    assert formateados.index.equals(valores.index) and formateados.name == 'monto'
+    assert formateados.tolist() == ['$1.234,50', '$0,01', '$-0,02', '$1.234,50', '', '', '$1.000.000.000,00', '']
+    for valor, formateado in zip(valores, formateados):
+        if formateado:
+            assert utils.formato_moneda(valor) == formateado
+    assert utils.formato_moneda('x') == '$x'
+    assert utils.formato_moneda([1.0, 2.0]).tolist() == ['$1,00', '$2,00']
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_manager as dm
+import ventanas
+from generador import generar_datos
+
+def _referencia(almacen, entidad, meses, periodos, hasta):
+    """Los mismos indicadores con rolling y shift de pandas sobre la serie mensual completa."""
+    filas = dm.filtrar_entidad(almacen.filas(), entidad).set_index('fecha')
+    mensual = pd.DataFrame({
+        'facturacion_total': filas[['facturacion_a', 'facturacion_b', 'facturacion_c']].sum(axis=1),
+        'gastos_totales': filas[['gastos_operativos', 'otros_gastos']].sum(axis=1),
+        'utilidad': filas['utilidad'],
+    }).resample('ME').sum()
+    if hasta is not None:
+        # El mes de `hasta` entra completo
+        mensual = mensual[mensual.index.to_period('M') <= pd.Period(hasta, 'M')]
+
+    referencia = pd.DataFrame(index=mensual.index)
+    for medida in ventanas.MEDIDAS:
+        referencia[medida] = mensual[medida]
+    for medida in ventanas.MEDIDAS:
+        referencia[f'{medida}_12m'] = mensual[medida].rolling(12, min_periods=1).sum()
+    for medida in ventanas.MEDIDAS:
+        anterior = mensual[medida].shift(12)
+        referencia[f'{medida}_interanual'] = (mensual[medida] / anterior - 1).where(anterior != 0)
+    for medida in ventanas.MEDIDAS_PROMEDIO:
+        referencia[f'{medida}_promedio_movil'] = mensual[medida].rolling(periodos, min_periods=1).sum() / periodos
+    referencia['utilidad_acumulado'] = mensual['utilidad'].cumsum()
+    return referencia.tail(meses)
+
+@pytest.mark.parametrize('entidad, meses, periodos, hasta', [
+    (None, 12, 3, None),
+    (None, 200, 6, None),
+    ('Sucursal 2', 24, 1, '2020-07-15'),
+])
+def test_ventanas_coinciden_con_rolling_de_pandas(entidad, meses, periodos, hasta):
+    almacen = dm.AlmacenColumnar.desde_dataframe(generar_datos(3000, entidades=3))
+    resultado = ventanas.analisis_ventanas(almacen, entidad, meses, periodos, hasta)
+    referencia = _referencia(almacen, entidad, meses, periodos, hasta)
+
+    assert list(resultado.columns) == ventanas.COLUMNAS
+    pd.testing.assert_frame_equal(resultado, referencia, check_freq=False, check_names=False)
+
+    resumen = ventanas.resumen_ventanas(almacen, entidad, periodos, hasta)
+    assert resumen['fecha'] == referencia.index[-1].strftime('%Y-%m-%d')
+    for columna in ventanas.COLUMNAS:
+        assert resumen[columna] == pytest.approx(referencia[columna].iloc[-1], nan_ok=True)
+
+def test_ventanas_sin_datos():
+    almacen = dm.AlmacenColumnar.desde_dataframe(generar_datos(100, entidades=1))
+    assert ventanas.analisis_ventanas(almacen, 'Ninguna').empty
+    assert ventanas.analisis_ventanas(almacen, hasta='2000-01-01').empty
+    assert ventanas.resumen_ventanas(dm.AlmacenColumnar()) == {}
+    with pytest.raises(ValueError):
+        ventanas.analisis_ventanas(almacen, periodos=0)
+    # Sin un año de historia la variación interanual no está definida
+    primer_mes = ventanas.analisis_ventanas(almacen, meses=1, hasta=almacen.filas()['fecha'].min())
+    assert np.isnan(primer_mes['utilidad_interanual'].item())
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+import data_manager as dm
+import visualizations as vis
+from generador import generar_datos
+
+def _registros(n):
+    return dm.AlmacenColumnar.desde_dataframe(generar_datos(n, entidades=2)).a_dataframe().set_index('fecha')
+
+def test_lttb_conserva_los_extremos_y_los_picos():
+    x = pd.date_range('2020-01-01', periods=20_000, freq='h').to_numpy()
+    y = np.sin(np.linspace(0, 20, 20_000))
+    y[12_345] = 50.0
+    indices = vis.indices_lttb(x, y, 500)
+
+    assert len(indices) == 500 and indices[0] == 0 and indices[-1] == 19_999
+    assert np.all(np.diff(indices) > 0)
+    assert 12_345 in indices
+    assert np.array_equal(vis.indices_lttb(x[:300], y[:300], 500), np.arange(300))
+
+def test_min_max_comparte_los_puntos_de_todas_las_series():
+    generador = np.random.default_rng(0)
+    columnas = [generador.normal(size=10_000) for _ in range(3)]
+    indices = vis.indices_min_max(columnas, 600)
+
+    assert len(indices) <= 600 + 2 and np.all(np.diff(indices) > 0)
+    assert indices[0] == 0 and indices[-1] == 9_999
+    for y in columnas:
+        assert np.argmin(y) in indices and np.argmax(y) in indices
+
+def test_las_series_se_ordenan_por_fecha():
+    registros = _registros(200)
+    desordenados = registros.sample(frac=1, random_state=3)
+    series, ordenadas = vis.preparar_series(desordenados), vis.preparar_series(registros.sort_index(kind='stable'))
+
+    assert np.array_equal(series['x'], ordenadas['x'])
+    for nombre in ['facturacion_total', 'gastos_totales', 'iva_total']:
+        assert np.allclose(np.sort(series[nombre]), np.sort(ordenadas[nombre]))
+    assert np.allclose(series['facturacion_total'].sum(), registros[['facturacion_a', 'facturacion_b', 'facturacion_c']].values.sum())
+
+def test_series_largas_se_reducen_y_usan_webgl():
+    registros = _registros(20_000)
+    for figura in [vis.grafico_lineas_temporales(registros), vis.grafico_impuestos(registros)]:
+        for traza in figura.data:
+            assert isinstance(traza, go.Scattergl)
+            assert len(traza.x) == len(traza.y) <= vis.MAXIMO_PUNTOS + 2
+
+    # Con pocos puntos se dibujan todos, sin WebGL
+    pocos = vis.preparar_series(_registros(100))
+    figura = vis.grafico_lineas_temporales(pocos)
+    assert all(type(traza) is go.Scatter and len(traza.y) == 100 for traza in figura.data)
+    assert np.array_equal(figura.data[0].y, pocos['facturacion_total'])
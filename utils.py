@@ -1,12 +1,77 @@
-import streamlit as st
+import functools
+import numpy as np
 import pandas as pd
+import data_manager as dm
+
+_DECIMALES = np.array([f',{i:02d}' for i in range(100)])
+
+def formato_centavos(centavos):
+    """Formatea un arreglo de montos en centavos enteros como pesos argentinos ($1.234,56).
+
+    Trabaja sobre el arreglo completo con operaciones de NumPy: los miles se
+    separan alineando las partes enteras a un ancho múltiplo de 3 y
+    partiéndolas en grupos, sin recorrer los valores uno por uno.
+    """
+    centavos = np.asarray(centavos, dtype=np.int64)
+    forma = centavos.shape
+    centavos = centavos.ravel()
+    if len(centavos) == 0:
+        return np.array([], dtype=str).reshape(forma)
+
+    absolutos = np.abs(centavos)
+    enteros = (absolutos // dm.CENTAVOS).astype(str)
+    grupos = -(-np.char.str_len(enteros).max() // 3)
+    digitos = np.char.rjust(enteros, 3 * grupos).view('U1').reshape(len(centavos), grupos, 3)
+    separadores = np.full((len(centavos), grupos, 1), '.')
+    caracteres = np.ascontiguousarray(np.concatenate([separadores, digitos], axis=2).reshape(len(centavos), -1)[:, 1:])
+    enteros = np.char.lstrip(caracteres.view(f'U{4 * grupos - 1}').ravel(), ' .')
+
+    decimales = _DECIMALES[absolutos % dm.CENTAVOS]
+    signos = np.where(centavos < 0, '$-', '$')
+    return np.char.add(np.char.add(signos, enteros), decimales).reshape(forma)
+
+@functools.lru_cache(maxsize=4096)
+def _formato_centavos_cacheado(centavos):
+    return str(formato_centavos(centavos))
 
 def formato_moneda(valor):
-    """Formatea un valor numérico como moneda en pesos argentinos."""
+    """Formatea un valor numérico como moneda en pesos argentinos, redondeado al centavo como AFIP.
+
+    Con una Series, un arreglo o una lista formatea todos los valores juntos
+    (ver `formato_monedas`). Los valores no numéricos se muestran tal cual.
+    """
+    if isinstance(valor, (pd.Series, np.ndarray, list)):
+        return formato_monedas(valor)
     try:
-        return f"${valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except:
+        numero = float(valor)
+    except (TypeError, ValueError):
         return f"${valor}"
+    if not np.isfinite(numero):
+        return f"${valor}"
+    return _formato_centavos_cacheado(int(dm.a_centavos(numero)))
+
+def formato_monedas(valores):
+    """Formatea una Series o un arreglo de montos en pesos de una sola vez.
+
+    Cada monto distinto se formatea una única vez, lo que rinde en tablas con
+    valores repetidos. Los faltantes y no numéricos quedan como texto vacío.
+    Devuelve una Series con el mismo índice, o un arreglo si se pasó otra cosa.
+    """
+    serie = valores if isinstance(valores, pd.Series) else pd.Series(valores)
+    numeros = pd.to_numeric(serie, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    validos = np.isfinite(numeros)
+    resultado = np.full(len(numeros), '', dtype=object)
+    if validos.any():
+        unicos, posiciones = np.unique(dm.a_centavos(numeros[validos]), return_inverse=True)
+        resultado[validos] = formato_centavos(unicos).astype(object)[posiciones]
+    if isinstance(valores, pd.Series):
+        return pd.Series(resultado, index=valores.index, name=valores.name)
+    return resultado
+
+def formatear_montos(df):
+    """Devuelve una copia del DataFrame con las columnas de montos formateadas como moneda."""
+    montos = [c for c in df.columns if c in dm.COLUMNAS_NUMERICAS or c in dm.COLUMNAS_TOTALES]
+    return df.assign(**{c: formato_monedas(df[c]) for c in montos})
 
 def validar_numero_positivo(valor):
     """Valida que un valor sea un número positivo."""
@@ -16,12 +81,30 @@ def validar_numero_positivo(valor):
     except ValueError:
         return False
 
-def exportar_datos(df):
-    """Exporta los datos a un archivo CSV."""
-    csv = df.to_csv(index=False)
+def validar_numeros_positivos(valores):
+    """Valida una columna completa con el mismo criterio que validar_numero_positivo.
+
+    Devuelve una máscara booleana con True en los valores numéricos no negativos.
+    """
+    numeros = pd.to_numeric(pd.Series(valores), errors='coerce')
+    return (numeros >= 0).to_numpy()
+
+def exportar_datos(df, formato='csv', montos_con_formato=False):
+    """Exporta los datos a un archivo CSV, Parquet o Excel generado por bloques.
+
+    El archivo se genera recién cuando el usuario hace clic en el botón. Con
+    `montos_con_formato` los montos se escriben como texto ($1.234,56).
+    """
+    # Se importan acá para que la API, que usa este módulo al importar
+    # archivos, no cargue Streamlit ni el escritor de Parquet al arrancar
+    import streamlit as st
+    import exportacion
+
+    mime, extension = exportacion.FORMATOS[formato]
+    formatear = formatear_montos if montos_con_formato else None
     st.download_button(
-        label="📥 Descargar CSV",
-        data=csv,
-        file_name="datos_financieros.csv",
-        mime="text/csv"
+        label=f"📥 Descargar {extension.upper()}",
+        data=lambda: b''.join(exportacion.exportar(df, formato, formatear=formatear)),
+        file_name=f"datos_financieros.{extension}",
+        mime=mime
     )
\ No newline at end of file
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import data_manager as dm
+
+# Meses de la ventana anual: totales móviles y variación interanual
+MESES_ANIO = 12
+PERIODOS_PROMEDIO = 3
+
+# Medidas de los indicadores móviles y las que además tienen promedio móvil
+MEDIDAS = ['facturacion_total', 'gastos_totales', 'utilidad']
+MEDIDAS_PROMEDIO = ['facturacion_total', 'gastos_totales']
+
+COLUMNAS = (
+    MEDIDAS
+    + [f'{medida}_12m' for medida in MEDIDAS]
+    + [f'{medida}_interanual' for medida in MEDIDAS]
+    + [f'{medida}_promedio_movil' for medida in MEDIDAS_PROMEDIO]
+    + ['utilidad_acumulado']
+)
+
+def _mes(fecha):
+    return int(dm.meses_de(np.array([fecha], dtype='datetime64[D]'))[0])
+
+def _vacio():
+    return pd.DataFrame(columns=COLUMNAS, index=pd.DatetimeIndex([], name='fecha'), dtype=np.float64)
+
+def _variacion(actual, anterior):
+    """Variación relativa (0.1 es un 10 % más); NaN si el valor anterior es cero."""
+    variacion = np.full(len(actual), np.nan)
+    validos = anterior != 0
+    variacion[validos] = actual[validos] / anterior[validos] - 1
+    return variacion
+
+def analisis_ventanas(df, entidad=None, meses=MESES_ANIO, periodos=PERIODOS_PROMEDIO, hasta=None):
+    """Calcula los indicadores móviles de los últimos `meses` meses hasta `hasta` (por omisión, el último con datos).
+
+    Para facturación, gastos y utilidad da el total del mes, el de los
+    últimos 12 meses y la variación contra el mismo mes del año anterior;
+    para facturación y gastos, el promedio móvil de `periodos` meses (los
+    meses sin datos cuentan como cero); y la utilidad acumulada desde el
+    primer mes. Todo sale de las sumas acumuladas de la tabla mensual, así que
+    el tiempo depende de `meses` y no de la longitud de la historia.
+    """
+    if meses < 1 or periodos < 1:
+        raise ValueError("La cantidad de meses y de períodos debe ser al menos 1")
+
+    agregado = dm.agregado_mensual(df, entidad)
+    rango = agregado.rango()
+    if rango is None:
+        return _vacio()
+    primero, ultimo = rango
+    if hasta is not None:
+        ultimo = min(ultimo, _mes(hasta))
+    if ultimo < primero:
+        return _vacio()
+
+    meses_tabla = np.arange(max(ultimo - meses + 1, primero), ultimo + 1)
+    datos = {}
+    for medida in MEDIDAS:
+        # Suma acumulada hasta cada mes y hasta una cantidad de meses antes
+        hasta_mes = {
+            desfase: agregado.acumulado(medida, meses_tabla - desfase)
+            for desfase in {0, 1, periodos, MESES_ANIO, MESES_ANIO + 1}
+        }
+        datos[medida] = hasta_mes[0] - hasta_mes[1]
+        datos[f'{medida}_12m'] = hasta_mes[0] - hasta_mes[MESES_ANIO]
+        datos[f'{medida}_interanual'] = _variacion(datos[medida], hasta_mes[MESES_ANIO] - hasta_mes[MESES_ANIO + 1])
+        if medida in MEDIDAS_PROMEDIO:
+            datos[f'{medida}_promedio_movil'] = (hasta_mes[0] - hasta_mes[periodos]) / periodos
+        if medida == 'utilidad':
+            datos['utilidad_acumulado'] = hasta_mes[0]
+
+    # Los montos pasan de centavos a pesos al final; las variaciones no son montos
+    for columna, valores in datos.items():
+        if not columna.endswith('_interanual'):
+            datos[columna] = dm.a_pesos(valores)
+    return pd.DataFrame(datos, columns=COLUMNAS, index=dm.fin_de_mes(meses_tabla))
+
+def resumen_ventanas(df, entidad=None, periodos=PERIODOS_PROMEDIO, hasta=None):
+    """Devuelve los indicadores móviles del último mes (o del mes de `hasta`), o un diccionario vacío sin datos."""
+    tabla = analisis_ventanas(df, entidad, 1, periodos, hasta)
+    if tabla.empty:
+        return {}
+    fila = tabla.iloc[-1]
+    resumen = {'fecha': tabla.index[-1].strftime('%Y-%m-%d')}
+    resumen.update({c: None if np.isnan(v) else float(v) for c, v in fila.items()})
+    return resumen
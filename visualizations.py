@@ -1,33 +1,139 @@
+import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
 import pandas as pd
 
-def grafico_lineas_temporales(df):
+# Por encima de esta cantidad de puntos las líneas se dibujan con WebGL
+UMBRAL_WEBGL = 5_000
+# Cantidad máxima de puntos por línea que se envían al navegador
+MAXIMO_PUNTOS = 2_000
+
+COLUMNAS_GRAFICOS = [
+    'facturacion_a', 'facturacion_b', 'facturacion_c',
+    'gastos_operativos', 'otros_gastos', 'retenciones',
+    'iva_total', 'ingresos_brutos', 'utilidad'
+]
+
+def preparar_series(df):
+    """Calcula una sola vez las series que usan los cuatro gráficos.
+
+    Devuelve un diccionario con el eje 'x' ordenado y un arreglo por columna,
+    incluidos los totales de facturación y gastos, que se puede pasar a
+    cualquiera de las funciones de este módulo en lugar del DataFrame.
+    """
+    x = df.index.to_numpy()
+    orden = None if df.index.is_monotonic_increasing else np.argsort(x, kind='stable')
+
+    def columna(nombre):
+        valores = df[nombre].to_numpy(dtype=np.float64)
+        return valores if orden is None else valores[orden]
+
+    series = {'x': x if orden is None else x[orden]}
+    for nombre in COLUMNAS_GRAFICOS:
+        series[nombre] = columna(nombre)
+
+    # El análisis mensual ya trae los totales; solo se calculan si faltan
+    if 'facturacion_total' in df:
+        series['facturacion_total'] = columna('facturacion_total')
+    else:
+        series['facturacion_total'] = series['facturacion_a'] + series['facturacion_b'] + series['facturacion_c']
+    if 'gastos_totales' in df:
+        series['gastos_totales'] = columna('gastos_totales')
+    else:
+        series['gastos_totales'] = series['gastos_operativos'] + series['otros_gastos']
+    return series
+
+def _series(datos):
+    return datos if isinstance(datos, dict) else preparar_series(datos)
+
+def _eje_numerico(x):
+    """Convierte el eje x a float para calcular áreas sin perder precisión en las fechas."""
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype('datetime64[ns]').astype(np.int64)
+        return (x - x[0]).astype(np.float64)
+    return np.asarray(x, dtype=np.float64)
+
+def indices_lttb(x, y, maximo_puntos=MAXIMO_PUNTOS):
+    """Elige los puntos a dibujar con Largest-Triangle-Three-Buckets.
+
+    Conserva el primer y el último punto y, de cada cubeta intermedia, el que
+    forma el triángulo de mayor área con el punto elegido antes y el promedio
+    de la cubeta siguiente.
+    """
+    n = len(y)
+    if n <= maximo_puntos or maximo_puntos < 3:
+        return np.arange(n)
+
+    x = _eje_numerico(x)
+    bordes = np.linspace(1, n - 1, maximo_puntos - 1).astype(np.int64)
+    indices = np.empty(maximo_puntos, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    anterior = 0
+    for i in range(maximo_puntos - 2):
+        inicio, fin = bordes[i], bordes[i + 1]
+        siguiente_fin = bordes[i + 2] if i + 2 < len(bordes) else n
+        promedio_x = x[fin:siguiente_fin].mean()
+        promedio_y = y[fin:siguiente_fin].mean()
+        areas = np.abs(
+            (x[anterior] - promedio_x) * (y[inicio:fin] - y[anterior])
+            - (x[anterior] - x[inicio:fin]) * (promedio_y - y[anterior])
+        )
+        anterior = inicio + int(np.argmax(areas))
+        indices[i + 1] = anterior
+    return indices
+
+def indices_min_max(columnas, maximo_puntos=MAXIMO_PUNTOS):
+    """Elige el mínimo y el máximo de cada cubeta para varias series a la vez.
+
+    Todas las series comparten los mismos puntos, lo que mantiene alineadas
+    las áreas apiladas.
+    """
+    n = len(columnas[0])
+    if n <= maximo_puntos:
+        return np.arange(n)
+
+    cubetas = max(maximo_puntos // (2 * len(columnas)), 1)
+    bordes = np.linspace(0, n, cubetas + 1).astype(np.int64)
+    elegidos = [np.array([0, n - 1])]
+    for y in columnas:
+        for inicio, fin in zip(bordes[:-1], bordes[1:]):
+            if fin > inicio:
+                tramo = y[inicio:fin]
+                elegidos.append(np.array([inicio + np.argmin(tramo), inicio + np.argmax(tramo)]))
+    return np.unique(np.concatenate(elegidos))
+
+def _tipo_traza(puntos):
+    return go.Scattergl if puntos > UMBRAL_WEBGL else go.Scatter
+
+def _linea(x, y, maximo_puntos, **opciones):
+    """Crea la traza de una línea reducida con LTTB."""
+    indices = indices_lttb(x, y, maximo_puntos)
+    return _tipo_traza(len(y))(x=x[indices], y=y[indices], **opciones)
+
+def grafico_lineas_temporales(df, maximo_puntos=MAXIMO_PUNTOS):
     """Crea un gráfico de líneas para la evolución temporal."""
+    series = _series(df)
+    x = series['x']
     fig = go.Figure()
 
     # Facturación total
-    facturacion_total = df['facturacion_a'] + df['facturacion_b'] + df['facturacion_c']
-    fig.add_trace(go.Scatter(
-        x=df.index,
-        y=facturacion_total,
+    fig.add_trace(_linea(
+        x, series['facturacion_total'], maximo_puntos,
         name='Facturación Total',
         line=dict(color='#2ecc71')
     ))
 
     # Gastos totales
-    gastos_totales = df['gastos_operativos'] + df['otros_gastos']
-    fig.add_trace(go.Scatter(
-        x=df.index,
-        y=gastos_totales,
+    fig.add_trace(_linea(
+        x, series['gastos_totales'], maximo_puntos,
         name='Gastos Totales',
         line=dict(color='#e74c3c')
     ))
 
     # Utilidad
-    fig.add_trace(go.Scatter(
-        x=df.index,
-        y=df['utilidad'],
+    fig.add_trace(_linea(
+        x, series['utilidad'], maximo_puntos,
         name='Utilidad',
         line=dict(color='#3498db')
     ))
@@ -47,23 +153,24 @@ def grafico_lineas_temporales(df):
 
 def grafico_barras_comparativo(df):
     """Crea un gráfico de barras comparativo de facturación por tipo."""
+    series = _series(df)
     fig = go.Figure(data=[
         go.Bar(
             name='Facturación A',
-            x=df.index,
-            y=df['facturacion_a'],
+            x=series['x'],
+            y=series['facturacion_a'],
             marker_color='#2ecc71'
         ),
         go.Bar(
             name='Facturación B',
-            x=df.index,
-            y=df['facturacion_b'],
+            x=series['x'],
+            y=series['facturacion_b'],
             marker_color='#3498db'
         ),
         go.Bar(
             name='Facturación C',
-            x=df.index,
-            y=df['facturacion_c'],
+            x=series['x'],
+            y=series['facturacion_c'],
             marker_color='#9b59b6'
         )
     ])
@@ -83,17 +190,18 @@ def grafico_barras_comparativo(df):
 
 def grafico_barras_gastos(df):
     """Crea un gráfico de barras para los gastos."""
+    series = _series(df)
     fig = go.Figure(data=[
         go.Bar(
             name='Gastos Operativos',
-            x=df.index,
-            y=df['gastos_operativos'],
+            x=series['x'],
+            y=series['gastos_operativos'],
             marker_color='#e74c3c'
         ),
         go.Bar(
             name='Otros Gastos',
-            x=df.index,
-            y=df['otros_gastos'],
+            x=series['x'],
+            y=series['otros_gastos'],
             marker_color='#f39c12'
         )
     ])
@@ -111,29 +219,34 @@ def grafico_barras_gastos(df):
 
     return fig
 
-def grafico_impuestos(df):
+def grafico_impuestos(df, maximo_puntos=MAXIMO_PUNTOS):
     """Crea un gráfico de área para los impuestos."""
+    series = _series(df)
+    iva, ingresos_brutos, retenciones = series['iva_total'], series['ingresos_brutos'], series['retenciones']
+    indices = indices_min_max([iva, ingresos_brutos, retenciones], maximo_puntos)
+    x = series['x'][indices]
+    traza = _tipo_traza(len(series['x']))
     fig = go.Figure()
 
-    fig.add_trace(go.Scatter(
-        x=df.index,
-        y=df['iva_total'],
+    fig.add_trace(traza(
+        x=x,
+        y=iva[indices],
         name='IVA',
         fill='tonexty',
         line=dict(color='#3498db')
     ))
 
-    fig.add_trace(go.Scatter(
-        x=df.index,
-        y=df['ingresos_brutos'],
+    fig.add_trace(traza(
+        x=x,
+        y=ingresos_brutos[indices],
         name='Ingresos Brutos',
         fill='tonexty',
         line=dict(color='#2ecc71')
     ))
 
-    fig.add_trace(go.Scatter(
-        x=df.index,
-        y=df['retenciones'],
+    fig.add_trace(traza(
+        x=x,
+        y=retenciones[indices],
         name='Retenciones',
         fill='tonexty',
         line=dict(color='#e74c3c')
@@ -150,4 +263,106 @@ def grafico_impuestos(df):
         )
     )
 
-    return fig
\ No newline at end of file
+    return fig
+
+def grafico_totales_moviles(df):
+    """Crea un gráfico de líneas con los totales de los últimos 12 meses."""
+    x = df.index.to_numpy()
+    fig = go.Figure()
+    for columna, nombre, color in [
+        ('facturacion_total_12m', 'Facturación', '#2ecc71'),
+        ('gastos_totales_12m', 'Gastos', '#e74c3c'),
+        ('utilidad_12m', 'Utilidad', '#3498db')
+    ]:
+        fig.add_trace(go.Scatter(x=x, y=df[columna].to_numpy(), name=nombre, line=dict(color=color)))
+
+    fig.update_layout(
+        title='Totales de los Últimos 12 Meses',
+        xaxis_title='Fecha',
+        yaxis_title='Monto ($)',
+        hovermode='x unified',
+        xaxis=dict(
+            tickformat="%B %Y",
+            tickangle=45
+        )
+    )
+
+    return fig
+
+def grafico_promedios_moviles(df, periodos):
+    """Crea un gráfico con la facturación y los gastos de cada mes y sus promedios móviles."""
+    x = df.index.to_numpy()
+    fig = go.Figure()
+    for medida, nombre, color in [
+        ('facturacion_total', 'Facturación', '#2ecc71'),
+        ('gastos_totales', 'Gastos', '#e74c3c')
+    ]:
+        fig.add_trace(go.Bar(x=x, y=df[medida].to_numpy(), name=nombre, marker_color=color, opacity=0.4))
+        fig.add_trace(go.Scatter(
+            x=x,
+            y=df[f'{medida}_promedio_movil'].to_numpy(),
+            name=f'{nombre} (promedio {periodos} meses)',
+            line=dict(color=color)
+        ))
+
+    fig.update_layout(
+        title='Promedios Móviles',
+        barmode='group',
+        xaxis_title='Fecha',
+        yaxis_title='Monto ($)',
+        hovermode='x unified',
+        xaxis=dict(
+            tickformat="%B %Y",
+            tickangle=45
+        )
+    )
+
+    return fig
+
+def grafico_variacion_interanual(df):
+    """Crea un gráfico de barras con la variación de cada mes contra el mismo mes del año anterior."""
+    x = df.index.to_numpy()
+    fig = go.Figure(data=[
+        go.Bar(name=nombre, x=x, y=df[columna].to_numpy() * 100, marker_color=color)
+        for columna, nombre, color in [
+            ('facturacion_total_interanual', 'Facturación', '#2ecc71'),
+            ('gastos_totales_interanual', 'Gastos', '#e74c3c'),
+            ('utilidad_interanual', 'Utilidad', '#3498db')
+        ]
+    ])
+
+    fig.update_layout(
+        title='Variación Interanual',
+        barmode='group',
+        xaxis_title='Fecha',
+        yaxis_title='Variación (%)',
+        xaxis=dict(
+            tickformat="%B %Y",
+            tickangle=45
+        )
+    )
+
+    return fig
+
+def grafico_utilidad_acumulada(df):
+    """Crea un gráfico de área con la utilidad acumulada desde el primer mes."""
+    fig = go.Figure(go.Scatter(
+        x=df.index.to_numpy(),
+        y=df['utilidad_acumulado'].to_numpy(),
+        name='Utilidad Acumulada',
+        fill='tozeroy',
+        line=dict(color='#3498db')
+    ))
+
+    fig.update_layout(
+        title='Utilidad Acumulada',
+        xaxis_title='Fecha',
+        yaxis_title='Monto ($)',
+        hovermode='x unified',
+        xaxis=dict(
+            tickformat="%B %Y",
+            tickangle=45
+        )
+    )
+
+    return fig